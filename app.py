@@ -1,45 +1,182 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
-import math
+import atexit
+import os
+import threading
+import numpy as np
+import location_log
+from geo_index import GeoIndex, haversine_many
 
 app = Flask(__name__)
 CORS(app)
 
-last_location = {}
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOG_PATH = os.environ.get("LOCATION_LOG", os.path.join(BASE_DIR, "locations.jsonl"))
+LEGACY_LOG_PATH = os.path.join(BASE_DIR, "locations.txt")
+MIN_MOVE_METERS = 10  # Pings closer than this to a device's last saved location are ignored
+MAX_BATCH = 10000  # Pings accepted per /locations request
+MAX_RADIUS = 100000  # Largest /nearby radius, in meters
+MAX_RESULTS = 1000  # Most devices returned by /nearby and /nearest
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # Earth radius in meters
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
+# Rebuild every device's last position from the log; the old repr-per-line
+# locations.txt is converted once
+if not os.path.exists(LOG_PATH) and os.path.exists(LEGACY_LOG_PATH):
+    print(f"Imported {location_log.import_legacy(LEGACY_LOG_PATH, LOG_PATH)} pings from {LEGACY_LOG_PATH}")
+last_location = location_log.replay(LOG_PATH)
+location_lock = threading.Lock()
+print(f"Restored {len(last_location)} device locations from {LOG_PATH}")
 
-    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+# Spatial index over last_location, kept in step with it by save_pings
+device_index = GeoIndex()
+device_index.update_many((device_id, lat, lon) for device_id, (lat, lon) in last_location.items())
+
+log = location_log.LocationLog(LOG_PATH)
+atexit.register(log.close)
+
+def _parse(data):
+    # (device_id, lat, lon, timestamp), or None if the ping is unusable
+    if not isinstance(data, dict):
+        return None
+    device_id, lat, lon = data.get("device_id"), data.get("latitude"), data.get("longitude")
+    if device_id is None or not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return str(device_id), float(lat), float(lon), data.get("timestamp")
+
+def save_pings(pings):
+    """
+    Filter a batch of parsed pings against each device's last saved
+    location and log the ones that moved. Returns, per ping, the distance
+    moved in meters (None for a device's first ping) and whether it was
+    saved. A device may appear more than once; its pings are compared in
+    order, one vectorized round per repeat.
+    """
+    distances = [None] * len(pings)
+    saved = [False] * len(pings)
+    rounds = []  # Round r holds the indices of each device's r-th ping in the batch
+    seen = {}
+    for i, (device_id, _, _, _) in enumerate(pings):
+        r = seen.get(device_id, 0)
+        seen[device_id] = r + 1
+        if r == len(rounds):
+            rounds.append([])
+        rounds[r].append(i)
+
+    lines = []
+    moves = []
+    with location_lock:
+        for indices in rounds:
+            known = [i for i in indices if pings[i][0] in last_location]
+            if known:
+                previous = np.array([last_location[pings[i][0]] for i in known])
+                current = np.array([pings[i][1:3] for i in known])
+                moved = haversine_many(current[:, 0], current[:, 1], previous[:, 0], previous[:, 1])
+                for i, distance in zip(known, moved.tolist()):
+                    distances[i] = distance
+                    saved[i] = distance >= MIN_MOVE_METERS
+            for i in indices:
+                if distances[i] is None:
+                    saved[i] = True
+                if saved[i]:
+                    device_id, lat, lon, timestamp = pings[i]
+                    last_location[device_id] = (lat, lon)
+                    moves.append((device_id, lat, lon))
+                    lines.append(location_log.encode(device_id, lat, lon, timestamp))
+        device_index.update_many(moves)
+        # Appended under the lock so the log keeps the order of last_location
+        log.append(lines)
+    return distances, saved
 
 @app.route('/location', methods=['POST'])
 def location():
     data = request.get_json()
-    device_id = data.get("device_id")
-    lat = data.get("latitude")
-    lon = data.get("longitude")
-    timestamp = data.get("timestamp")
-
-    if device_id in last_location:
-        last_lat, last_lon = last_location[device_id]
-        distance = haversine(lat, lon, last_lat, last_lon)
-        if distance < 10:
-            print(f"[{timestamp}] Skipped location — moved only {distance:.2f} meters.")
-            return jsonify({"status": "ignored", "message": "Location unchanged"}), 200
-
-    # Save new location
-    last_location[device_id] = (lat, lon)
-    with open("locations.txt", "a") as f:
-        f.write(str(data) + "\n")
-    
-    print(f"[{timestamp}] Saved location: ({lat}, {lon}) for {device_id}")
+    ping = _parse(data)
+    if ping is None:
+        return jsonify({"status": "error", "message": "device_id, latitude and longitude are required"}), 400
+    _, lat, lon, timestamp = ping
+
+    distances, saved = save_pings([ping])
+    if not saved[0]:
+        print(f"[{timestamp}] Skipped location — moved only {distances[0]:.2f} meters.")
+        return jsonify({"status": "ignored", "message": "Location unchanged"}), 200
+
+    print(f"[{timestamp}] Saved location: ({lat}, {lon}) for {ping[0]}")
     return jsonify({"status": "success", "message": "Location saved"}), 200
 
+@app.route('/locations', methods=['POST'])
+def locations():
+    """
+    Many pings per request, as a JSON list of /location bodies or
+    {"pings": [...]}. Each gets a result of "saved", "ignored" or
+    "invalid", in order.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("pings")
+    if not isinstance(data, list):
+        return jsonify({"status": "error", "message": "Expected a list of pings"}), 400
+    if len(data) > MAX_BATCH:
+        return jsonify({"status": "error", "message": f"At most {MAX_BATCH} pings per request"}), 413
+
+    parsed = [_parse(item) for item in data]
+    valid = [i for i, ping in enumerate(parsed) if ping is not None]
+    _, saved = save_pings([parsed[i] for i in valid])
+    results = ["invalid"] * len(data)
+    for i, was_saved in zip(valid, saved):
+        results[i] = "saved" if was_saved else "ignored"
+
+    counts = {status: results.count(status) for status in ("saved", "ignored", "invalid")}
+    print(f"[{datetime.now().isoformat(timespec='seconds')}] Batch of {len(data)} pings: "
+          f"{counts['saved']} saved, {counts['ignored']} ignored, {counts['invalid']} invalid")
+    return jsonify({"status": "success", **counts, "results": results}), 200
+
+def _query_point():
+    # (lat, lon) from the query string, or an error response
+    lat = request.args.get("latitude", type=float)
+    lon = request.args.get("longitude", type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None, (jsonify({"status": "error", "message": "latitude and longitude are required"}), 400)
+    return (lat, lon), None
+
+def _devices(found):
+    return [{"device_id": device_id, "latitude": lat, "longitude": lon, "distance_m": round(distance, 1)}
+            for device_id, lat, lon, distance in found]
+
+@app.route('/nearby', methods=['GET'])
+def nearby():
+    """
+    Devices whose last location is within radius meters (default 1000)
+    of latitude, longitude, nearest first
+    """
+    point, error = _query_point()
+    if error:
+        return error
+    radius = request.args.get("radius", 1000, type=float)
+    limit = min(request.args.get("limit", MAX_RESULTS, type=int), MAX_RESULTS)
+    if not 0 < radius <= MAX_RADIUS or limit < 1:
+        return jsonify({"status": "error", "message": f"radius must be in (0, {MAX_RADIUS}] meters"}), 400
+
+    found = device_index.within(*point, radius, limit=limit)
+    return jsonify({"status": "success", "count": len(found), "devices": _devices(found)}), 200
+
+@app.route('/nearest', methods=['GET'])
+def nearest():
+    """
+    The k (default 5) devices whose last location is closest to latitude,
+    longitude, nearest first
+    """
+    point, error = _query_point()
+    if error:
+        return error
+    k = request.args.get("k", 5, type=int)
+    if not 1 <= k <= MAX_RESULTS:
+        return jsonify({"status": "error", "message": f"k must be between 1 and {MAX_RESULTS}"}), 400
+
+    found = device_index.nearest(*point, k)
+    return jsonify({"status": "success", "count": len(found), "devices": _devices(found)}), 200
+
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # The debug server's reloader would run a second writer on the same log
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
@@ -0,0 +1,490 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import numpy as np
+from . import config
+
+# Columnar archive of every detection made by /detect-video jobs and live
+# sources, so questions like "all trucks on camera X between 14:00 and 15:00"
+# are answered from disk instead of by running the model over the video again.
+#
+#   archive/<source>/<part>/frame.bin, time.bin, cls.bin, ...  one raw column each
+#   archive/<source>/<part>/meta.json                         row count, class names, spans
+#
+# Each writer (a job, a segment of one, or a live source's producer) appends
+# to parts of its own, so worker processes never share a file. Columns are
+# written before meta.json is replaced, and readers only look at the rows
+# meta.json counts, so a part can be read while it is still growing. Rows in
+# a part are in frame and time order; a writer starts a new part when either
+# would go backwards (a looping file) or the part reaches PART_ROWS. That makes
+# each part's frame and time columns their own index: a range query is a
+# binary search into a memory-mapped column, and filters and aggregates run
+# as NumPy operations over views of the files, without loading or copying
+# the rows outside the range.
+#
+# Eviction never deletes a part a writer in this process still has open. A
+# part deleted anyway (by another process, or DELETE /archive/<source>)
+# makes its writer carry on in a new part.
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), "archive")
+PART_ROWS = 1 << 20  # Rows per part before a writer starts the next
+FLUSH_ROWS = 4096  # Rows a writer buffers before appending them to its part
+FLUSH_SECONDS = 1.0  # Longest a row waits in a writer's buffer
+MAX_QUERY_ROWS = 10000  # Most rows one query returns
+MAX_TIMELINE_BUCKETS = MAX_QUERY_ROWS  # Most intervals a summary's timeline may span
+
+FLAG_ACCIDENT = 1  # flags bit: the box is one of an accident pair
+
+# name -> (dtype, values per row)
+COLUMNS = {
+    "frame": (np.dtype("<i4"), 1),
+    "time": (np.dtype("<f8"), 1),  # Unix seconds
+    "cls": (np.dtype("<i2"), 1),
+    "conf": (np.dtype("<f4"), 1),
+    "box": (np.dtype("<f4"), 4),  # x1, y1, x2, y2 in source pixels
+    "track": (np.dtype("<i4"), 1),  # Tracker id, -1 where there is no tracker
+    "flags": (np.dtype("u1"), 1),
+}
+
+_SAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+def source_name(name):
+    """
+    name reduced to characters safe as a directory name under ARCHIVE_DIR
+    """
+    return _SAFE.sub("_", name).lstrip(".")[:128] or "_"
+
+def video_source(video_path):
+    """
+    The source name a job's detections are archived under: its output
+    video's name up to the first dot, so a segment's part files map to
+    the job
+    """
+    return source_name(os.path.basename(video_path).split(".", 1)[0])
+
+def _source_dir(source):
+    return os.path.join(ARCHIVE_DIR, source_name(source))
+
+_open_parts = set()  # Directories of the parts this process's writers have open
+_open_parts_lock = threading.Lock()
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+class ArchiveWriter:
+    """
+    Appends one source's detections to the archive. Not thread-safe: each
+    producer has its own writer.
+    """
+    def __init__(self, source, fps=None):
+        self.source = source_name(source)
+        self.fps = fps
+        self.rows = 0
+        self._buffer = []  # (frame, time, Detections, track ids, flags)
+        self._buffered = 0
+        self._flushed_at = time.monotonic()
+        self._part = None  # Directory of the part being written
+        self._files = {}
+        self._meta = None
+        self._last = None  # (frame, time) of the last row written or buffered
+
+    def write(self, frame_index, timestamp, detections, track_ids=None, flags=None):
+        """
+        Add one frame's Detections, with optional per-box track ids and flags
+        """
+        boxes = detections.boxes
+        if not len(boxes):
+            return
+        last = self._last
+        if last is not None and (frame_index < last[0] or timestamp < last[1]):
+            self._roll()
+        elif self._meta is not None and self._meta["names"] != detections.names:
+            self._roll()
+        self._buffer.append((frame_index, timestamp, detections, track_ids, flags))
+        self._buffered += len(boxes)
+        self._last = (frame_index, timestamp)
+        if self._buffered >= FLUSH_ROWS or time.monotonic() - self._flushed_at >= FLUSH_SECONDS:
+            self.flush()
+
+    def _open_part(self, names, frame, timestamp):
+        stamp = int(timestamp * 1000)
+        self._part = os.path.join(_source_dir(self.source), f"{stamp:014d}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(self._part, exist_ok=True)
+        with _open_parts_lock:
+            _open_parts.add(self._part)
+        self._files = {name: open(os.path.join(self._part, f"{name}.bin"), "ab") for name in COLUMNS}
+        self._meta = {
+            "source": self.source, "rows": 0, "names": names, "fps": self.fps,
+            "frame_min": int(frame), "frame_max": int(frame),
+            "time_min": float(timestamp), "time_max": float(timestamp),
+        }
+
+    def _close_part(self):
+        for f in self._files.values():
+            f.close()
+        with _open_parts_lock:
+            _open_parts.discard(self._part)
+        self._files = {}
+        self._part = None
+        self._meta = None
+
+    def _roll(self):
+        # Whatever is buffered belongs to the current part
+        self.flush()
+        self._close_part()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        buffer, self._buffer, self._buffered = self._buffer, [], 0
+        while buffer:
+            if self._meta is None:
+                frame, timestamp, detections, _, _ = buffer[0]
+                self._open_part({int(k): v for k, v in detections.names.items()}, frame, timestamp)
+            # Fill the part up to PART_ROWS, then carry on in a new one
+            room = PART_ROWS - self._meta["rows"]
+            take, rows = 0, 0
+            while take < len(buffer) and (rows + len(buffer[take][2].boxes) <= room or take == 0):
+                rows += len(buffer[take][2].boxes)
+                take += 1
+            if rows > room and self._meta["rows"]:
+                self._close_part()
+                continue
+            try:
+                self._append(buffer[:take], rows)
+            except FileNotFoundError:
+                if os.path.isdir(self._part):
+                    raise
+                # The part was deleted under us; write these rows to a new one
+                self._close_part()
+                continue
+            buffer = buffer[take:]
+            if self._meta["rows"] >= PART_ROWS:
+                self._close_part()
+
+    def _append(self, frames, rows):
+        counts = [len(dets.boxes) for _, _, dets, _, _ in frames]
+        columns = {
+            "frame": np.repeat([f for f, _, _, _, _ in frames], counts),
+            "time": np.repeat([t for _, t, _, _, _ in frames], counts),
+            "cls": np.concatenate([dets.cls_ids for _, _, dets, _, _ in frames]),
+            "conf": np.concatenate([dets.scores for _, _, dets, _, _ in frames]),
+            "box": np.concatenate([dets.boxes for _, _, dets, _, _ in frames]),
+            "track": np.concatenate([
+                np.full(len(dets.boxes), -1) if tracks is None else tracks for _, _, dets, tracks, _ in frames
+            ]),
+            "flags": np.concatenate([
+                np.zeros(len(dets.boxes)) if flags is None else flags for _, _, dets, _, flags in frames
+            ]),
+        }
+        for name, (dtype, _) in COLUMNS.items():
+            self._files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            self._files[name].flush()
+        meta = self._meta
+        meta["rows"] += rows
+        meta["frame_max"] = int(frames[-1][0])
+        meta["time_max"] = float(frames[-1][1])
+        meta["fps"] = self.fps
+        # Only now may readers see the new rows
+        _write_json(os.path.join(self._part, "meta.json"), meta)
+        self.rows += rows
+
+    def close(self):
+        self.flush()
+        if self._meta is not None:
+            self._close_part()
+
+class Part:
+    """
+    One part of the archive, read through memory maps
+    """
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = meta
+        self.rows = meta["rows"]
+        self.names = {int(k): v for k, v in meta["names"].items()}
+        self._columns = {}
+
+    def column(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            dtype, width = COLUMNS[name]
+            shape = (self.rows, width) if width > 1 else (self.rows,)
+            column = self._columns[name] = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype,
+                                                     mode="r", shape=shape)
+        return column
+
+    def span(self, start_time=None, end_time=None, start_frame=None, end_frame=None):
+        """
+        Row range [lo, hi) within the time range [start_time, end_time) and
+        frame range [start_frame, end_frame), by binary search
+        """
+        lo, hi = 0, self.rows
+        if start_time is not None or end_time is not None:
+            times = self.column("time")
+            if start_time is not None:
+                lo = max(lo, int(np.searchsorted(times, start_time, "left")))
+            if end_time is not None:
+                hi = min(hi, int(np.searchsorted(times, end_time, "left")))
+        if start_frame is not None or end_frame is not None:
+            frames = self.column("frame")
+            if start_frame is not None:
+                lo = max(lo, int(np.searchsorted(frames, start_frame, "left")))
+            if end_frame is not None:
+                hi = min(hi, int(np.searchsorted(frames, end_frame, "left")))
+        return lo, max(lo, hi)
+
+    def class_ids(self, classes):
+        return [cid for cid, name in self.names.items() if name in classes]
+
+def parts(source, start_time=None, end_time=None, start_frame=None, end_frame=None):
+    """
+    The readable parts of source, oldest first, skipping those whose spans
+    fall outside the ranges
+    """
+    directory = _source_dir(source)
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # Not flushed yet, or being deleted
+        if not meta["rows"]:
+            continue
+        if start_time is not None and meta["time_max"] < start_time:
+            continue
+        if end_time is not None and meta["time_min"] >= end_time:
+            continue
+        if start_frame is not None and meta["frame_max"] < start_frame:
+            continue
+        if end_frame is not None and meta["frame_min"] >= end_frame:
+            continue
+        found.append(Part(path, meta))
+    return found
+
+def _select(part, ranges, classes=None, min_conf=None, accidents_only=False):
+    # Indices (relative to the range start) of the rows that pass the filters
+    lo, hi = part.span(**ranges)
+    keep = np.ones(hi - lo, dtype=bool)
+    if classes is not None:
+        keep &= np.isin(part.column("cls")[lo:hi], part.class_ids(classes))
+    if min_conf is not None:
+        keep &= part.column("conf")[lo:hi] >= min_conf
+    if accidents_only:
+        keep &= (part.column("flags")[lo:hi] & FLAG_ACCIDENT) != 0
+    return lo, hi, keep
+
+def query(source, classes=None, min_conf=None, accidents_only=False, limit=MAX_QUERY_ROWS, **ranges):
+    """
+    Rows of source in the ranges (see Part.span) matching the filters, in
+    order, at most limit of them. Returns (rows, matched) where matched
+    counts every matching row.
+    """
+    rows = []
+    matched = 0
+    for part in parts(source, **ranges):
+        lo, hi, keep = _select(part, ranges, classes, min_conf, accidents_only)
+        indices = np.flatnonzero(keep)
+        matched += len(indices)
+        take = indices[:max(0, limit - len(rows))] + lo
+        if not len(take):
+            continue
+        names = part.names
+        for frame, timestamp, cid, conf, box, track, flags in zip(
+            part.column("frame")[take].tolist(), part.column("time")[take].tolist(),
+            part.column("cls")[take].tolist(), part.column("conf")[take].tolist(),
+            part.column("box")[take].astype(np.float64).round(1).tolist(), part.column("track")[take].tolist(),
+            part.column("flags")[take].tolist(),
+        ):
+            rows.append({
+                "frame": frame, "time": round(timestamp, 3), "class": names.get(cid, str(cid)),
+                "confidence": round(conf, 3), "box": box, "track": track if track >= 0 else None,
+                "accident": bool(flags & FLAG_ACCIDENT),
+            })
+    return rows, matched
+
+def aggregate(source, classes=None, min_conf=None, accidents_only=False, interval=None, min_count=None,
+              limit=MAX_QUERY_ROWS, **ranges):
+    """
+    Summary of the matching rows of source: detections and mean confidence
+    per class, detections per interval seconds, and the frames with at
+    least min_count matching detections (at most limit of them). Raises
+    ValueError if the timeline would span over MAX_TIMELINE_BUCKETS intervals.
+    """
+    found = parts(source, **ranges)
+    if interval and found:
+        first = max(min(part.meta["time_min"] for part in found), ranges.get("start_time") or -np.inf)
+        last = min(max(part.meta["time_max"] for part in found), ranges.get("end_time") or np.inf)
+        if (last - first) / interval + 1 > MAX_TIMELINE_BUCKETS:
+            raise ValueError(f"interval is too short: the timeline may span at most {MAX_TIMELINE_BUCKETS} intervals")
+    per_class = {}
+    buckets = {}
+    dense = []
+    total = 0
+    frames_seen = 0
+    for part in found:
+        lo, hi, keep = _select(part, ranges, classes, min_conf, accidents_only)
+        if not keep.any():
+            continue
+        cls = part.column("cls")[lo:hi][keep]
+        conf = part.column("conf")[lo:hi][keep].astype(np.float64)
+        total += len(cls)
+
+        ids, inverse = np.unique(cls, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=conf)
+        for cid, count, conf_sum in zip(ids.tolist(), counts.tolist(), sums.tolist()):
+            name = part.names.get(cid, str(cid))
+            entry = per_class.setdefault(name, [0, 0.0])
+            entry[0] += count
+            entry[1] += conf_sum
+
+        if interval:
+            times = part.column("time")[lo:hi][keep]
+            slots, slot_counts = np.unique(np.floor(times / interval).astype(np.int64), return_counts=True)
+            for slot, count in zip(slots.tolist(), slot_counts.tolist()):
+                buckets[slot] = buckets.get(slot, 0) + count
+
+        # Rows are in frame order, so each frame is one run
+        frames = part.column("frame")[lo:hi][keep]
+        starts = np.flatnonzero(np.r_[True, frames[1:] != frames[:-1]])
+        per_frame = np.diff(np.r_[starts, len(frames)])
+        frames_seen += len(starts)
+        if min_count is not None and len(dense) < limit:
+            over = np.flatnonzero(per_frame >= min_count)[:limit - len(dense)]
+            times = part.column("time")[lo:hi][keep]
+            for i in over.tolist():
+                row = starts[i]
+                dense.append({"frame": int(frames[row]), "time": round(float(times[row]), 3),
+                              "count": int(per_frame[i])})
+
+    summary = {
+        "source": source_name(source),
+        "detections": total,
+        "frames": frames_seen,
+        "classes": {name: {"detections": count, "mean_confidence": round(conf_sum / count, 3)}
+                    for name, (count, conf_sum) in sorted(per_class.items())},
+    }
+    if interval:
+        summary["interval"] = interval
+        summary["timeline"] = [{"start": round(slot * interval, 3), "detections": count}
+                               for slot, count in sorted(buckets.items())]
+    if min_count is not None:
+        summary["min_count"] = min_count
+        summary["dense_frames"] = dense
+    return summary
+
+def sources():
+    """
+    Every archived source with its rows, bytes and time and frame spans
+    """
+    listed = []
+    try:
+        names = sorted(os.listdir(ARCHIVE_DIR))
+    except FileNotFoundError:
+        return listed
+    for name in names:
+        found = parts(name)
+        if not found:
+            continue
+        listed.append({
+            "source": name,
+            "parts": len(found),
+            "rows": sum(part.rows for part in found),
+            "bytes": sum(_size(part.path) for part in found),
+            "time_min": min(part.meta["time_min"] for part in found),
+            "time_max": max(part.meta["time_max"] for part in found),
+            "frame_min": min(part.meta["frame_min"] for part in found),
+            "frame_max": max(part.meta["frame_max"] for part in found),
+        })
+    return listed
+
+def exists(source):
+    return os.path.isdir(_source_dir(source))
+
+def remove(source):
+    """
+    Delete every part of source; returns whether there was anything to delete
+    """
+    directory = _source_dir(source)
+    if not os.path.isdir(directory):
+        return False
+    shutil.rmtree(directory, ignore_errors=True)
+    return True
+
+def _size(path):
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file():
+                    total += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+_evict_lock = threading.Lock()
+
+def evict(max_bytes=None, min_age=0.0):
+    """
+    Delete the oldest parts, across sources, until the archive fits in
+    max_bytes. Parts open in one of this process's writers, and parts
+    written to within min_age seconds, are kept.
+    """
+    max_bytes = config.ARCHIVE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        entries = []
+        total = 0
+        try:
+            source_dirs = os.listdir(ARCHIVE_DIR)
+        except FileNotFoundError:
+            return 0
+        for source in source_dirs:
+            directory = os.path.join(ARCHIVE_DIR, source)
+            try:
+                names = os.listdir(directory)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                size = _size(path)
+                try:
+                    modified = os.path.getmtime(path)
+                except OSError:
+                    continue
+                entries.append((name, modified, size, path))
+                total += size
+        # Part names start with their first row's time in milliseconds
+        entries.sort()
+        removed = 0
+        now = time.time()
+        with _open_parts_lock:
+            in_use = set(_open_parts)
+        for _, modified, size, path in entries:
+            if total <= max_bytes:
+                break
+            if path in in_use or now - modified < min_age:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        for source in source_dirs:
+            try:
+                os.rmdir(os.path.join(ARCHIVE_DIR, source))  # Only succeeds once a source is empty
+            except OSError:
+                pass
+        return removed
@@ -0,0 +1,140 @@
+import fcntl
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+# Model backends. "torch" runs the .pt weights in PyTorch eager mode; "onnx"
+# (ONNX Runtime) and "openvino" run a CPU export of the same weights, which is
+# usually several times faster on machines without a GPU. Exports are made
+# once with ultralytics, for one input size and any batch size, and kept in
+# EXPORT_DIR until the weights change. Job processes load their own model, so
+# exports are made under a file lock in a private directory and published with
+# a rename; the others wait and then reuse it. All backends are loaded through
+# YOLO, so callers use the same predict API whichever one is active. The
+# optional runtimes (onnxruntime, openvino) must be installed for their
+# backend; without them loading falls back to torch, and resolve says so up
+# front. ultralytics (and torch with it) is only imported once a model is
+# actually loaded.
+
+EXPORT_DIR = os.path.join(os.path.dirname(__file__), "models")
+BACKENDS = {
+    "torch": None,
+    "onnx": ("onnx", ".onnx", "onnxruntime"),  # ultralytics export format, exported file suffix, runtime module
+    "openvino": ("openvino", "_openvino_model", "openvino"),
+}
+WARMUP_RUNS = 3  # Dummy batches at load; the first is discarded from the latency
+
+def export_path(weights, backend, size):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    return os.path.join(EXPORT_DIR, f"{stem}_{size}{BACKENDS[backend][1]}")
+
+def resolve(backend):
+    """
+    The backend load will use when asked for backend: torch if it is
+    unknown or its runtime isn't installed
+    """
+    if backend not in BACKENDS:
+        return "torch"
+    if BACKENDS[backend] is not None and importlib.util.find_spec(BACKENDS[backend][2]) is None:
+        return "torch"
+    return backend
+
+def _fresh(path, weights):
+    return os.path.exists(path) and (not os.path.exists(weights) or os.path.getmtime(path) >= os.path.getmtime(weights))
+
+def _export(weights, backend, size):
+    """
+    Path of the backend's export of weights, exporting it first unless an
+    export at least as new as the weights is already cached
+    """
+    path = export_path(weights, backend, size)
+    if _fresh(path, weights):
+        return path
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _fresh(path, weights):
+            return path  # Exported by another process while we waited
+
+        from ultralytics import YOLO
+        print(f"Exporting {weights} to {backend} at {size}px...")
+        start = time.perf_counter()
+        work_dir = tempfile.mkdtemp(prefix=".export-", dir=EXPORT_DIR)
+        try:
+            # ultralytics writes the export next to the weights, so export a
+            # private copy (YOLO downloads the weights if they're missing)
+            source = os.path.join(work_dir, os.path.basename(weights))
+            shutil.copy2(YOLO(weights).ckpt_path, source)
+            exported = YOLO(source).export(format=BACKENDS[backend][0], imgsz=size, dynamic=True, verbose=False)
+            if os.path.isdir(path):
+                os.replace(path, os.path.join(work_dir, "stale"))  # A directory can't be replaced in place
+            os.replace(exported, path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"Exported {path} in {time.perf_counter() - start:.1f}s")
+    return path
+
+def _model_bytes(model, path):
+    # Weights held in memory for torch; the export's size on disk otherwise
+    if path.endswith(".pt"):
+        tensors = list(model.model.parameters()) + list(model.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+def warmup(model, size, batch_size=1, runs=WARMUP_RUNS):
+    """
+    Run a few black 16:9 batches through model so the first real request
+    doesn't pay for lazy initialisation. Returns the mean latency of the
+    runs after the first, in milliseconds per batch.
+    """
+    frames = [np.zeros((size * 9 // 16, size, 3), dtype=np.uint8)] * max(1, batch_size)
+    timings = []
+    for _ in range(max(2, runs)):
+        start = time.perf_counter()
+        model.predict(source=frames, imgsz=size, verbose=False)
+        timings.append(time.perf_counter() - start)
+    return round(1000 * sum(timings[1:]) / len(timings[1:]), 2)
+
+def load(weights, backend, size, warmup_batch=1):
+    """
+    Load weights with the named backend and warm it up. Returns the model
+    and a dict describing it (backend, path, input size, load and warmup
+    times), falling back to torch if the backend can't be used.
+    """
+    from ultralytics import YOLO
+    if resolve(backend) != backend:
+        print(f"Cannot use the {backend!r} inference backend, using torch")
+        backend = "torch"
+
+    start = time.perf_counter()
+    path = weights
+    if BACKENDS[backend] is not None:
+        try:
+            path = _export(weights, backend, size)
+            model = YOLO(path, task="detect")
+        except Exception as e:
+            print(f"Cannot use the {backend} backend ({e}), using torch")
+            backend, path = "torch", weights
+    if backend == "torch":
+        model = YOLO(weights)
+    load_seconds = time.perf_counter() - start
+
+    latency = warmup(model, size, warmup_batch)
+    model_bytes = _model_bytes(model, path)
+    print(f"YOLO model loaded with {backend} in {load_seconds:.2f}s, {latency}ms per warmup batch of {warmup_batch}")
+    return model, {
+        "backend": backend,
+        "path": os.path.basename(path),
+        "input_size": size,
+        "load_seconds": round(load_seconds, 3),
+        "warmup_batch_size": warmup_batch,
+        "warmup_latency_ms": latency,
+        "model_bytes": model_bytes,
+    }
@@ -0,0 +1,55 @@
+import argparse
+import timeit
+import numpy as np
+from ..process_video import IOU_THRESHOLD, compute_iou, overlapping_pairs
+
+# Compares the vectorized overlap check in process_video against the scalar
+# double loop it replaced, on synthetic traffic scenes.
+#
+#   python -m backend.benchmarks.bench_iou
+
+def loop_pairs(boxes, threshold=IOU_THRESHOLD):
+    pairs = []
+    for i in range(len(boxes)):
+        for j in range(i+1, len(boxes)):
+            if compute_iou(boxes[i], boxes[j]) > threshold:
+                pairs.append((i, j))
+    return pairs
+
+def synthetic_boxes(n, width=1920, height=1080, seed=0):
+    """
+    n vehicle-sized xyxy boxes, with a share of them placed on top of another
+    box so that some pairs overlap
+    """
+    rng = np.random.default_rng(seed)
+    w = rng.uniform(40, 260, n)
+    h = rng.uniform(30, 180, n)
+    x1 = rng.uniform(0, width - w)
+    y1 = rng.uniform(0, height - h)
+    crash = rng.random(n) < 0.2
+    anchor = rng.integers(0, n, n)
+    x1[crash] = x1[anchor[crash]] + rng.uniform(-20, 20, crash.sum())
+    y1[crash] = y1[anchor[crash]] + rng.uniform(-20, 20, crash.sum())
+    return np.stack([x1, y1, x1 + w, y1 + h], axis=1).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pairwise overlap check")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'boxes':>6} {'pairs':>6} {'loop ms':>10} {'vector ms':>10} {'speedup':>8}")
+    for n in args.sizes:
+        boxes = synthetic_boxes(n)
+        expected = loop_pairs(boxes)
+        i, j = overlapping_pairs(boxes)
+        if expected != list(zip(i.tolist(), j.tolist())):
+            raise SystemExit(f"Vectorized pairs differ from the loop at {n} boxes")
+
+        number = max(1, 2000 // n)
+        loop = min(timeit.repeat(lambda: loop_pairs(boxes), number=number, repeat=args.repeat)) / number
+        vector = min(timeit.repeat(lambda: overlapping_pairs(boxes), number=number, repeat=args.repeat)) / number
+        print(f"{n:>6} {len(expected):>6} {loop * 1e3:>10.3f} {vector * 1e3:>10.3f} {loop / vector:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
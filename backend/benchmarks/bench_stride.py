@@ -0,0 +1,55 @@
+import argparse
+import glob
+import os
+import tempfile
+from ..pipeline import run_pipeline
+
+# Speed and accident recall of frame skipping against full per-frame
+# detection on the bundled test clips.
+#
+#   python -m backend.benchmarks.bench_stride --strides 2 3 5 --adaptive
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(__file__))
+
+def run(path, output_path, stride, adaptive):
+    accident_frames = set()
+
+    def on_frame(frame_index, detections, confidences):
+        if confidences:
+            accident_frames.add(frame_index)
+
+    result = run_pipeline(path, output_path, stride=stride, adaptive=adaptive, on_frame=on_frame)
+    return result, accident_frames
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame skipping on the test videos")
+    parser.add_argument("videos", nargs="*",
+                        default=sorted(glob.glob(os.path.join(BACKEND_DIR, "Video_for_test_lb*.mp4"))))
+    parser.add_argument("--strides", type=int, nargs="+", default=[2, 3, 5])
+    parser.add_argument("--adaptive", action="store_true", help="Also run each stride in adaptive mode")
+    args = parser.parse_args()
+
+    modes = [(stride, False) for stride in args.strides]
+    if args.adaptive:
+        modes += [(stride, True) for stride in args.strides]
+
+    print(f"{'video':<24} {'mode':<12} {'fps':>7} {'speedup':>8} {'inferred':>9} {'accident':>9} {'recall':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "out.mp4")
+        for path in args.videos:
+            name = os.path.basename(path)
+            base, base_frames = run(path, output_path, 1, False)
+            base_fps = base["timings"]["fps"]
+            print(f"{name:<24} {'every frame':<12} {base_fps:>7.1f} {'1.0x':>8} "
+                  f"{base['inferred_frames']:>9} {str(base['accident_detected']):>9} {'-':>7}")
+
+            for stride, adaptive in modes:
+                result, frames = run(path, output_path, stride, adaptive)
+                speedup = result["timings"]["fps"] / base_fps if base_fps else 0.0
+                recall = len(frames & base_frames) / len(base_frames) if base_frames else 1.0
+                mode = f"{'adaptive' if adaptive else 'stride'} {stride}"
+                print(f"{'':<24} {mode:<12} {result['timings']['fps']:>7.1f} {speedup:>7.1f}x "
+                      f"{result['inferred_frames']:>9} {str(result['accident_detected']):>9} {recall:>7.2f}")
+
+if __name__ == "__main__":
+    main()
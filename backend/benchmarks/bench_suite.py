@@ -0,0 +1,275 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import cv2
+import numpy as np
+from .. import config, inference, metrics
+from ..inference import Detections
+from ..live import LiveSource
+from ..pipeline import run_pipeline
+from ..process_video import process_video
+from .bench_iou import synthetic_boxes
+
+# End-to-end benchmark of the three detection engines: process_video (the
+# sequential reference), run_pipeline (the /detect-video engine) and the
+# live preview producer, on the bundled test clips, plus run_pipeline on
+# synthetic crowded scenes replayed without the model. Reports throughput,
+# per-frame stage latency percentiles, peak RSS and the accident results,
+# writes them as JSON and compares them against a saved baseline. Exits
+# with status 1 when anything regressed, or when process_video and
+# run_pipeline disagree on a clip, so it can gate a change.
+#
+#   python -m backend.benchmarks.bench_suite --save-baseline baseline.json
+#   python -m backend.benchmarks.bench_suite --baseline baseline.json --output latest.json
+#
+# Baselines only compare meaningfully on the same machine and settings.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(__file__))
+PERCENTILES = (50, 95, 99)
+SYNTHETIC_NAMES = {2: "car", 7: "truck"}
+TOLERANCE = 0.15  # Relative slowdown or growth that counts as a regression
+MIN_LATENCY_DELTA = 0.0005  # Stage latency changes below this many seconds are noise
+
+def _reset_peak_rss():
+    # Linux can reset the peak RSS counter, so each scenario gets its own
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def trim(path, frames, output_path):
+    """
+    Copy the first frames frames of a video, so runs can be kept short
+    """
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    out = None
+    try:
+        for _ in range(frames):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if out is None:
+                height, width = frame.shape[:2]
+                out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            out.write(frame)
+    finally:
+        cap.release()
+        if out: out.release()
+    return output_path
+
+def synthetic_scene(path, vehicles, frames, width=1280, height=720, seed=0):
+    """
+    Write a plain frames-long video to path and return Detections for each
+    frame: vehicles boxes drifting across it, a share of them overlapping
+    """
+    rng = np.random.default_rng(seed)
+    boxes = synthetic_boxes(vehicles, width, height, seed)
+    velocity = np.tile(rng.uniform(-2, 2, (vehicles, 2)), 2).astype(np.float32)
+    cls_ids = rng.choice(list(SYNTHETIC_NAMES), vehicles)
+    scores = rng.uniform(0.3, 1.0, vehicles).astype(np.float32)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25.0, (width, height))
+    detections = []
+    try:
+        for t in range(frames):
+            frame = np.full((height, width, 3), 96, dtype=np.uint8)
+            cv2.putText(frame, str(t), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+            out.write(frame)
+            detections.append(Detections(boxes + velocity * t, scores, cls_ids, SYNTHETIC_NAMES))
+    finally:
+        out.release()
+    return detections
+
+def _signature(result):
+    # The parts of a result that must not change when only speed should
+    return {
+        "accident_detected": result["accident_detected"],
+        "confidence": round(result["confidence"], 6),
+        "total_frames": result["total_frames"],
+        "events": [[e["start_frame"], e["end_frame"]] for e in result["events"]],
+    }
+
+def _measure(name, engine, path_label, run):
+    """
+    Run one scenario; run() returns (frames, result or None)
+    """
+    _reset_peak_rss()
+    metrics.start_sampling()
+    start = time.perf_counter()
+    try:
+        frames, result = run()
+    finally:
+        samples = metrics.stop_sampling()
+    wall = time.perf_counter() - start
+
+    stages = {}
+    for key, values in samples.items():
+        if key[:2] == (metrics.STAGE_SECONDS.name, path_label):
+            stage = key[2]
+            values = np.asarray(values)
+            stages[stage] = {f"p{p}": round(float(np.percentile(values, p)), 6) for p in PERCENTILES}
+            stages[stage]["mean"] = round(float(values.mean()), 6)
+    return {
+        "name": name,
+        "engine": engine,
+        "frames": frames,
+        "wall_seconds": round(wall, 3),
+        "fps": round(frames / wall, 2) if wall > 0 else 0.0,
+        "stages": stages,
+        "peak_rss_mb": _peak_rss_mb(),
+        "result": _signature(result) if result else None,
+    }
+
+def run_clip(path, output_path):
+    name = os.path.basename(path)
+
+    def sequential():
+        result = process_video(path, output_path, batch_size=config.PIPELINE_BATCH_SIZE)
+        return result["total_frames"], result
+
+    def pipeline():
+        # Every frame, like process_video, so their results must agree
+        result = run_pipeline(path, output_path, batch_size=config.PIPELINE_BATCH_SIZE,
+                              queue_size=config.PIPELINE_QUEUE_SIZE, workers=config.PIPELINE_WORKERS,
+                              stride=1, adaptive=False)
+        return result["total_frames"], result
+
+    def live_preview():
+        source = LiveSource(path, paced=False, loop=False, archive_detections=False)
+        source.run()
+        return source.frames_produced, None
+
+    return [
+        _measure(name, "process_video", "sequential", sequential),
+        _measure(name, "run_pipeline", "upload", pipeline),
+        _measure(name, "live", "live", live_preview),
+    ]
+
+def run_synthetic(vehicles, frames, tmp):
+    video_path = os.path.join(tmp, f"crowd{vehicles}.mp4")
+    detections = synthetic_scene(video_path, vehicles, frames)
+
+    def pipeline():
+        result = run_pipeline(video_path, os.path.join(tmp, "out.mp4"), detections=detections,
+                              queue_size=config.PIPELINE_QUEUE_SIZE)
+        return result["total_frames"], result
+
+    return _measure(f"synthetic-{vehicles}", "run_pipeline", "upload", pipeline)
+
+def compare(scenarios, baseline, tolerance=TOLERANCE):
+    """
+    Regressions of scenarios against a baseline run, as readable lines
+    """
+    previous = {(s["name"], s["engine"]): s for s in baseline["scenarios"]}
+    regressions = []
+    for scenario in scenarios:
+        label = f"{scenario['name']} {scenario['engine']}"
+        base = previous.get((scenario["name"], scenario["engine"]))
+        if base is None:
+            continue
+        if scenario["fps"] < base["fps"] * (1 - tolerance):
+            regressions.append(f"{label}: {scenario['fps']} fps, was {base['fps']}")
+        for stage, latency in scenario["stages"].items():
+            before = base["stages"].get(stage)
+            if before and latency["p95"] > before["p95"] * (1 + tolerance) + MIN_LATENCY_DELTA:
+                regressions.append(f"{label}: {stage} p95 {latency['p95'] * 1e3:.2f}ms, "
+                                   f"was {before['p95'] * 1e3:.2f}ms")
+        if scenario["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{label}: peak RSS {scenario['peak_rss_mb']}MB, was {base['peak_rss_mb']}MB")
+        if scenario["result"] != base["result"]:
+            regressions.append(f"{label}: accident result changed from {base['result']} to {scenario['result']}")
+    return regressions
+
+def _environment(args):
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "model": {key: inference.model_info[key] for key in ("backend", "path", "input_size")},
+        "batch_size": config.PIPELINE_BATCH_SIZE,
+        "live_stride": config.DETECT_STRIDE,  # The live scenario follows it
+        "live_adaptive": config.ADAPTIVE_STRIDE,
+        "frames": args.frames,
+    }
+
+def _print_scenario(scenario):
+    stages = "  ".join(f"{stage} {latency['p50'] * 1e3:.2f}/{latency['p95'] * 1e3:.2f}"
+                       for stage, latency in scenario["stages"].items())
+    print(f"{scenario['name']:<24} {scenario['engine']:<14} {scenario['fps']:>8.1f} "
+          f"{scenario['peak_rss_mb']:>8.0f}  {stages}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection engines")
+    parser.add_argument("videos", nargs="*",
+                        default=sorted(glob.glob(os.path.join(BACKEND_DIR, "Video_for_test_lb*.mp4"))))
+    parser.add_argument("--frames", type=int, default=300, help="Frames used from each clip (0 for all)")
+    parser.add_argument("--crowds", type=int, nargs="*", default=[50, 200],
+                        help="Vehicles per synthetic scene")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this earlier JSON output")
+    parser.add_argument("--save-baseline", help="Write the results here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    if inference.load_model() is None:
+        raise SystemExit("YOLO model not loaded")
+
+    scenarios = []
+    regressions = []
+    print(f"{'scenario':<24} {'engine':<14} {'fps':>8} {'rss MB':>8}  stage p50/p95 ms")
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in args.videos:
+            if args.frames:
+                path = trim(path, args.frames, os.path.join(tmp, os.path.basename(path)))
+            clip = run_clip(path, os.path.join(tmp, "out.mp4"))
+            for scenario in clip:
+                _print_scenario(scenario)
+            sequential, pipeline = clip[0]["result"], clip[1]["result"]
+            if sequential != pipeline:
+                print(f"{'':<24} engines disagree: {sequential} vs {pipeline}")
+                regressions.append(f"{clip[0]['name']}: run_pipeline result {pipeline} "
+                                   f"differs from process_video {sequential}")
+            scenarios.extend(clip)
+        for vehicles in args.crowds:
+            scenario = run_synthetic(vehicles, args.frames or 300, tmp)
+            _print_scenario(scenario)
+            scenarios.append(scenario)
+
+    report = {"created_at": time.time(), "environment": _environment(args), "scenarios": scenarios}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["environment"] != report["environment"]:
+            print("Baseline was recorded with different settings; comparing anyway")
+        regressions.extend(compare(scenarios, baseline, args.tolerance))
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        raise SystemExit(1)
+    if args.baseline:
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+import numpy as np
+from . import config, events, inference
+from .preprocess import model_size
+from . import process_video as pv
+from . import tracker
+from .inference import CONF_THRESHOLD, MODEL_PATH, Detections
+
+# Persistent cache for /detect-video, keyed by the SHA-256 of the uploaded
+# file. Two kinds of entry:
+#   <detection key>.npz  per-frame detections, keyed by content + model +
+#                        inference settings
+#   <result key>.json    the finished result, keyed by the detection key plus
+#                        the overlap/tracker settings
+# A result hit answers without any processing; a detection hit (e.g. after an
+# overlap threshold change) replays the cheap overlap logic on the stored
+# detections instead of running YOLO again. Entries are evicted least
+# recently used first once the directory grows past CACHE_MAX_BYTES.
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_evict_lock = threading.Lock()
+
+def new_hasher():
+    return hashlib.sha256()
+
+def _digest(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+def detection_key(content_hash, stride=1, adaptive=False):
+    return _digest({
+        "content": content_hash,
+        "model": MODEL_PATH,
+        "backend": inference.active_backend(),
+        "conf": CONF_THRESHOLD,
+        "size": model_size(config.INFERENCE_SIZE),
+        "stride": stride,
+        "adaptive": bool(adaptive) and stride > 1,
+        "classes": sorted(pv.VEHICLE_CLASSES),
+    })
+
+# run_pipeline options that change the output but not the detections
+OUTPUT_OPTIONS = {"write_video": True, "codec": "mp4v", "scale": 1.0}
+
+def result_key(det_key, options=None):
+    output = {name: (options or {}).get(name, default) for name, default in OUTPUT_OPTIONS.items()}
+    return _digest({
+        "detections": det_key,
+        "iou": pv.IOU_THRESHOLD,
+        "sustained_frames": pv.SUSTAINED_FRAMES,
+        "vehicle_classes": sorted(pv.VEHICLE_CLASSES),
+        "track_iou": tracker.TRACK_IOU_THRESHOLD,
+        "track_max_misses": tracker.TRACK_MAX_MISSES,
+        "track_max_center_shift": tracker.TRACK_MAX_CENTER_SHIFT,
+        "event_gap": events.EVENT_GAP_FRAMES,
+        "output": output,
+    })
+
+def _path(key, ext):
+    return os.path.join(CACHE_DIR, key + ext)
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _write_atomic(path, write):
+    # Several job processes share the cache, so never expose half a file
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict()
+
+def load_detections(key):
+    """
+    Return the cached list of per-frame Detections for key, or None
+    """
+    path = _path(key, ".npz")
+    try:
+        with np.load(path) as data:
+            counts = data["counts"]
+            boxes = data["boxes"]
+            scores = data["scores"]
+            cls_ids = data["cls_ids"].astype(int)
+            names = {int(k): v for k, v in json.loads(str(data["names"])).items()}
+    except (OSError, KeyError, ValueError):
+        return None
+    _touch(path)
+
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    return [
+        Detections(boxes[start:end], scores[start:end], cls_ids[start:end], names)
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+def has_detections(key):
+    return os.path.exists(_path(key, ".npz"))
+
+def store_detections(key, detections):
+    if not detections:
+        return
+    counts = np.array([len(d.boxes) for d in detections], dtype=np.int32)
+    boxes = np.concatenate([np.asarray(d.boxes, dtype=np.float32).reshape(-1, 4) for d in detections])
+    scores = np.concatenate([np.asarray(d.scores, dtype=np.float32) for d in detections])
+    cls_ids = np.concatenate([np.asarray(d.cls_ids, dtype=np.int16) for d in detections])
+    names = json.dumps({str(k): v for k, v in detections[0].names.items()})
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.savez(f, counts=counts, boxes=boxes, scores=scores, cls_ids=cls_ids, names=names)
+
+    _write_atomic(_path(key, ".npz"), write)
+
+def load_result(key):
+    """
+    Return the cached result dict for key, or None. A result whose processed
+    video has since been deleted counts as a miss.
+    """
+    path = _path(key, ".json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    output_path = entry.get("output_path")
+    if output_path and not os.path.exists(output_path):
+        return None
+    _touch(path)
+    return entry["result"]
+
+def store_result(key, result, output_path=None):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump({"result": result, "output_path": output_path}, f)
+
+    _write_atomic(_path(key, ".json"), write)
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used entries until the cache fits in max_bytes
+    """
+    max_bytes = config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        entries = []
+        total = 0
+        try:
+            with os.scandir(CACHE_DIR) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+        except FileNotFoundError:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def stats():
+    total = 0
+    count = 0
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                if entry.is_file():
+                    total += entry.stat().st_size
+                    count += 1
+    except FileNotFoundError:
+        pass
+    return {"entries": count, "bytes": total, "max_bytes": config.CACHE_MAX_BYTES}
@@ -0,0 +1,78 @@
+import os
+
+# Deployment settings. Each one can be overridden with an environment
+# variable of the same name.
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# /detect-video pipeline
+PIPELINE_BATCH_SIZE = _env_int("PIPELINE_BATCH_SIZE", 16)  # Frames per inference call
+PIPELINE_QUEUE_SIZE = _env_int("PIPELINE_QUEUE_SIZE", 4)  # Batches in flight between stages
+PIPELINE_WORKERS = _env_int("PIPELINE_WORKERS", 1)  # Threads feeding batches to the inference service
+
+# /detect-video output
+OUTPUT_VIDEO = _env_bool("OUTPUT_VIDEO", True)  # Write the annotated video, not just detections
+OUTPUT_CODEC = os.environ.get("OUTPUT_CODEC") or "mp4v"  # VideoWriter fourcc for annotated videos
+OUTPUT_SCALE = _env_float("OUTPUT_SCALE", 1.0)  # Annotated video size relative to the source; 0.5 encodes ~2x faster
+
+# /detect-video job queue
+JOB_WORKERS = _env_int("JOB_WORKERS", os.cpu_count() or 1)  # Worker processes
+MAX_PENDING_JOBS = _env_int("MAX_PENDING_JOBS", 2 * JOB_WORKERS)  # Queued + running before rejecting
+JOB_HISTORY = _env_int("JOB_HISTORY", 100)  # Finished jobs kept for status polling
+DETECT_SEGMENTS = _env_int("DETECT_SEGMENTS", 1)  # Default parallel segments per long upload
+
+# /detect-video result cache
+CACHE_MAX_BYTES = _env_int("CACHE_MAX_BYTES", 2 * 1024 ** 3)  # Evict least recently used beyond this
+
+# Detection archive and disk retention
+ARCHIVE_DETECTIONS = _env_bool("ARCHIVE_DETECTIONS", True)  # Keep every job's and live source's detections on disk
+ARCHIVE_MAX_BYTES = _env_int("ARCHIVE_MAX_BYTES", 4 * 1024 ** 3)  # Oldest archive parts are deleted beyond this
+UPLOADS_MAX_BYTES = _env_int("UPLOADS_MAX_BYTES", 4 * 1024 ** 3)  # Oldest uploaded videos are deleted beyond this
+PROCESSED_MAX_BYTES = _env_int("PROCESSED_MAX_BYTES", 4 * 1024 ** 3)  # Oldest annotated videos, overlays and events beyond this
+LIVE_FILES_MAX_BYTES = _env_int("LIVE_FILES_MAX_BYTES", 2 * 1024 ** 3)  # Oldest live preview videos not in use beyond this
+RETENTION_INTERVAL_SECONDS = _env_int("RETENTION_INTERVAL_SECONDS", 300)  # How often the limits above are enforced
+RETENTION_MIN_AGE_SECONDS = _env_int("RETENTION_MIN_AGE_SECONDS", 3600)  # Files younger than this are never deleted
+
+# Shared inference service
+MODEL_LOAD = os.environ.get("MODEL_LOAD") or "startup"  # preload (on import, before workers fork), startup or lazy
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND") or "torch"  # torch, onnx or openvino
+MODEL_WARMUP_BATCH = _env_int("MODEL_WARMUP_BATCH", 1)  # Frames per dummy batch when warming the model up
+INFERENCE_MAX_BATCH = _env_int("INFERENCE_MAX_BATCH", 32)  # Frames per model call across all callers
+INFERENCE_MAX_WAIT_MS = _env_int("INFERENCE_MAX_WAIT_MS", 10)  # How long a frame waits for batch-mates
+INFERENCE_SIZE = _env_int("INFERENCE_SIZE", 640)  # Longest side frames are downscaled to for YOLO (multiple of 32)
+
+# Frame skipping, for both /detect-video and /live-preview
+DETECT_STRIDE = _env_int("DETECT_STRIDE", 1)  # Run YOLO every Nth frame (max gap when adaptive)
+MAX_STRIDE = _env_int("MAX_STRIDE", 30)  # Largest stride a request may ask for; skipped frames wait in memory for the next keyframe
+ADAPTIVE_STRIDE = _env_bool("ADAPTIVE_STRIDE", False)  # Also run YOLO whenever the scene moves
+
+# /live-preview
+LIVE_MAX_SOURCES = _env_int("LIVE_MAX_SOURCES", 32)  # Live sources (one producer thread each) per node
+# Live frames inside the inference service at once. Below LIVE_MAX_SOURCES, so
+# a full node shares them fairly instead of every source always getting one
+LIVE_INFERENCE_SLOTS = _env_int("LIVE_INFERENCE_SLOTS", max(1, INFERENCE_MAX_BATCH // 2))
+LIVE_INFERENCE_FPS = _env_float("LIVE_INFERENCE_FPS", 0)  # Cap on live frames inferred per second, all sources together (0: none)
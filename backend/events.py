@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import cv2
+import numpy as np
+from .tracker import iou_matrix
+
+# Accident event timeline. detect_accidents reports every sustained overlap
+# pair per frame; EventTimeline groups a pair's consecutive frames into one
+# event with its frame range, peak confidence and boxes. After a job the
+# events are written next to the processed video, in <name>.events/, along
+# with a short clip and a few keyframes cut from the annotated output, so a
+# reviewer can jump straight to each incident.
+
+EVENT_GAP_FRAMES = 5  # A pair missing for longer than this ends its event
+JOIN_IOU = 0.3  # Events either side of a segment cut with this much box overlap are one event
+CLIP_PADDING_SECONDS = 1.0  # Context kept before and after each event in its clip
+MAX_EXPORTED_EVENTS = 50  # Clips and keyframes are cut for at most this many events
+
+def _union_box(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32)
+    return np.concatenate([boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)])
+
+class EventTimeline:
+    """
+    Groups per-frame accident pairs into events. Call add for every frame
+    in order, then finish.
+    """
+    def __init__(self):
+        self._open = {}  # (track_id, track_id) -> event
+        self._closed = []
+
+    def add(self, frame_index, incidents):
+        for incident in incidents:
+            key = incident["tracks"]
+            event = self._open.get(key)
+            if event is None:
+                event = {
+                    "start_frame": frame_index,
+                    "end_frame": frame_index,
+                    "peak_frame": frame_index,
+                    "peak_confidence": 0.0,
+                    "classes": incident["classes"],
+                    "boxes": incident["boxes"],
+                    "frames": [],
+                }
+                self._open[key] = event
+            event["end_frame"] = frame_index
+            event["frames"].append({
+                "frame": frame_index,
+                "boxes": incident["boxes"],
+                "confidence": incident["confidence"],
+            })
+            if incident["confidence"] > event["peak_confidence"]:
+                event["peak_frame"] = frame_index
+                event["peak_confidence"] = incident["confidence"]
+                event["boxes"] = incident["boxes"]
+
+        for key, event in list(self._open.items()):
+            if frame_index - event["end_frame"] > EVENT_GAP_FRAMES:
+                self._closed.append(self._open.pop(key))
+
+    def finish(self, fps):
+        """
+        Close every event and return them all, numbered in start order
+        """
+        events = self._closed + list(self._open.values())
+        self._closed, self._open = [], {}
+        return finalize(events, fps)
+
+def finalize(events, fps):
+    events = sorted(events, key=lambda e: (e["start_frame"], e["peak_frame"]))
+    for event_id, event in enumerate(events):
+        event["id"] = event_id
+        event["start_time"] = round(event["start_frame"] / fps, 3)
+        event["end_time"] = round((event["end_frame"] + 1) / fps, 3)
+    return events
+
+def merge_segments(parts, fps):
+    """
+    Join the events of consecutive video segments. An event that runs up
+    to a cut and one that starts just after it are the same incident when
+    their classes match and their boxes overlap; track ids can't be used
+    since every segment numbers its own.
+    """
+    merged = []
+    previous = []  # Events of the previous segment still open at its end
+    for events in parts:
+        current = []
+        for event in sorted(events, key=lambda e: e["start_frame"]):
+            match = None
+            for candidate in previous:
+                if (candidate["end_frame"] + EVENT_GAP_FRAMES >= event["start_frame"]
+                        and sorted(candidate["classes"]) == sorted(event["classes"])):
+                    last = _union_box(candidate["frames"][-1]["boxes"])
+                    first = _union_box(event["frames"][0]["boxes"])
+                    if iou_matrix(last[None], first[None])[0, 0] > JOIN_IOU:
+                        match = candidate
+                        break
+            if match is None:
+                merged.append(event)
+                current.append(event)
+                continue
+            previous.remove(match)
+            match["end_frame"] = event["end_frame"]
+            match["frames"].extend(event["frames"])
+            if event["peak_confidence"] > match["peak_confidence"]:
+                match["peak_frame"] = event["peak_frame"]
+                match["peak_confidence"] = event["peak_confidence"]
+                match["boxes"] = event["boxes"]
+            current.append(match)
+        previous = current
+    return finalize(merged, fps)
+
+def summarize(events):
+    """
+    Events without their per-frame boxes, for job results
+    """
+    return [{k: v for k, v in event.items() if k != "frames"} for event in events]
+
+def events_dir(video_path):
+    return os.path.splitext(video_path)[0] + ".events"
+
+def _write_frames(cap, start, end, path, fps, size):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    for _ in range(start, end + 1):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        out.write(frame)
+    out.release()
+
+def _grab_jpeg(cap, index, path):
+    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    ret, frame = cap.read()
+    return ret and cv2.imwrite(path, frame)
+
+def export(video_path, events, fps, total_frames, clip_source=None):
+    """
+    Write the timeline for an annotated video, with a clip (the event plus
+    CLIP_PADDING_SECONDS either side) and start/peak/end keyframes per
+    event, into events_dir(video_path). Clips are cut from the annotated
+    video itself unless clip_source names another copy (e.g. the original
+    upload when no annotated video was written).
+    """
+    directory = events_dir(video_path)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    cap = cv2.VideoCapture(clip_source or video_path)
+    try:
+        out_fps = cap.get(cv2.CAP_PROP_FPS) or fps
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        padding = int(round(CLIP_PADDING_SECONDS * fps))
+        entries = []
+        for event in events:
+            entry = dict(event, clip=None, keyframes={})
+            if cap.isOpened() and event["id"] < MAX_EXPORTED_EVENTS:
+                clip_name = f"event{event['id']}.mp4"
+                start = max(0, event["start_frame"] - padding)
+                end = min(total_frames - 1, event["end_frame"] + padding)
+                _write_frames(cap, start, end, os.path.join(directory, clip_name), out_fps, size)
+                entry["clip"] = clip_name
+                for label in ("start", "peak", "end"):
+                    image_name = f"event{event['id']}_{label}.jpg"
+                    if _grab_jpeg(cap, event[f"{label}_frame"], os.path.join(directory, image_name)):
+                        entry["keyframes"][label] = image_name
+            entries.append(entry)
+    finally:
+        cap.release()
+
+    timeline = {
+        "video": os.path.basename(video_path),
+        "fps": fps,
+        "total_frames": total_frames,
+        "events": entries,
+    }
+    with open(os.path.join(directory, "timeline.json"), "w") as f:
+        json.dump(timeline, f)
+    return timeline
+
+def load_timeline(video_path):
+    try:
+        with open(os.path.join(events_dir(video_path), "timeline.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
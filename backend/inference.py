@@ -0,0 +1,253 @@
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import Future
+import numpy as np
+from . import backends, config, metrics
+from .preprocess import FrameResizer, model_size, scale_detections
+
+# One YOLO model per process, shared by the live streams and the upload
+# pipeline. It is loaded on first use, or up front by load_model (the server
+# does this at startup, or at import when preloading for forked workers).
+# Callers submit frames to InferenceService, whose scheduler thread
+# gathers whatever arrives within MAX_WAIT_MS into a single predict call and
+# hands back plain NumPy Detections. Frames are downscaled to the inference
+# size first (see preprocess) and boxes come back in source coordinates.
+# Callers that only care about some classes name them, and the model skips
+# the rest before NMS instead of returning boxes nobody looks at.
+
+MODEL_PATH = "yolov8s.pt"
+CONF_THRESHOLD = 0.3
+LOAD_RETRY_SECONDS = 30.0  # Wait after a failed load before the next attempt
+
+model = None
+model_info = None
+_load_lock = threading.Lock()
+_load_failed_at = None  # monotonic time of the last failed load
+
+def load_model():
+    """
+    Load the YOLO model with the configured backend and warm it up, once
+    per process. Returns the model, or None if it failed to load; a failed
+    load is retried by a later call, at most every LOAD_RETRY_SECONDS.
+    """
+    global model, model_info, _load_failed_at
+    if model is not None:
+        return model
+    with _load_lock:
+        if model is None and (_load_failed_at is None
+                              or time.monotonic() - _load_failed_at >= LOAD_RETRY_SECONDS):
+            try:
+                model, model_info = backends.load(MODEL_PATH, config.INFERENCE_BACKEND,
+                                                  model_size(config.INFERENCE_SIZE),
+                                                  warmup_batch=config.MODEL_WARMUP_BATCH)
+                _load_failed_at = None
+            except Exception as e:
+                print(f"Error loading YOLO model: {e}")
+                _load_failed_at = time.monotonic()
+            if service.model is None:
+                service.model = model
+    return model
+
+def active_backend():
+    """
+    The backend the model loaded with, or the one it will load with if it
+    hasn't been loaded in this process
+    """
+    if model_info is not None:
+        return model_info["backend"]
+    return backends.resolve(config.INFERENCE_BACKEND)
+
+# Per-frame detections: boxes (N, 4) xyxy float32, scores (N,), cls_ids (N,)
+# int, and the model's class id -> name dict
+Detections = namedtuple("Detections", ["boxes", "scores", "cls_ids", "names"])
+
+def to_detections(result):
+    dets = result.boxes
+    return Detections(
+        dets.xyxy.cpu().numpy(),
+        dets.conf.cpu().numpy(),
+        dets.cls.cpu().numpy().astype(int),
+        result.names,
+    )
+
+def empty_detections(names):
+    return Detections(np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32),
+                      np.empty(0, dtype=int), names)
+
+def _fail(futures, error):
+    # Hand error to every future not resolved yet, so no caller waits forever
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
+
+class InferenceService:
+    """
+    Micro-batching scheduler in front of a single model
+    """
+    def __init__(self, model, max_batch=32, max_wait=0.01, size=640):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.size = model_size(size)
+        self._resizer = FrameResizer()  # Used by the scheduler thread only
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._frames = 0
+        self._batches = 0
+        self._busy = 0.0
+        self._preprocess = 0.0
+        self._class_ids = {}  # frozenset of class names -> the model's ids for them
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+                self._thread.start()
+
+    def submit(self, frame, conf=CONF_THRESHOLD, size=None, classes=None):
+        """
+        Queue one frame and return a Future for its Detections. size
+        overrides the service's inference size for this frame; classes, a
+        set of class names, limits the detections to those classes.
+        """
+        if self.model is None and load_model() is None:
+            raise RuntimeError("YOLO model not loaded")
+        future = Future()
+        self._ensure_thread()
+        classes = frozenset(classes) if classes is not None else None
+        self._queue.put((frame, conf, model_size(size) if size else self.size, classes, future))
+        return future
+
+    def predict(self, frames, conf=CONF_THRESHOLD, size=None, classes=None):
+        """
+        Run frames through the shared model and return their Detections in order
+        """
+        futures = [self.submit(frame, conf, size, classes) for frame in frames]
+        return [future.result() for future in futures]
+
+    def _ids(self, classes):
+        # The model's class ids for a set of names, None for every class
+        if classes is None:
+            return None
+        ids = self._class_ids.get(classes)
+        if ids is None:
+            ids = self._class_ids[classes] = sorted(cid for cid, name in self.model.names.items() if name in classes)
+        return ids
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._serve(batch)
+            except Exception as e:
+                # Whatever went wrong, the thread lives on for the next batch
+                print(f"Inference scheduler error: {e}")
+                _fail([future for *_, future in batch], e)
+
+    def _serve(self, batch):
+        # One predict call per input shape and settings, so every frame is
+        # letterboxed exactly as it would be on its own
+        groups = {}
+        for frame, conf, size, classes, future in batch:
+            if future.set_running_or_notify_cancel():
+                groups.setdefault((frame.shape, conf, size, classes), []).append((frame, future))
+
+        for (_, conf, size, classes), items in groups.items():
+            try:
+                self._predict_group(conf, size, classes, items)
+            except Exception as e:
+                _fail([future for _, future in items], e)
+
+    def _predict_group(self, conf, size, classes, items):
+        ids = self._ids(classes)
+        if ids == []:
+            # None of the classes asked for is one this model knows
+            for _, future in items:
+                future.set_result(empty_detections(self.model.names))
+            return
+        start = time.perf_counter()
+        frames, (fx, fy) = self._resizer.resize([frame for frame, _ in items], size)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._preprocess += elapsed
+        metrics.INFERENCE_BATCH_SECONDS.observe(elapsed, "preprocess")
+        start = time.perf_counter()
+        try:
+            results = self.model.predict(source=frames, conf=conf, imgsz=size, classes=ids, verbose=False)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self._batch_sizes[len(frames)] += 1
+                self._frames += len(frames)
+                self._batches += 1
+                self._busy += elapsed
+            metrics.INFERENCE_BATCH_SECONDS.observe(elapsed, "model")
+            metrics.INFERENCE_BATCH_SIZE.observe(len(frames))
+        for (_, future), result in zip(items, results):
+            future.set_result(scale_detections(to_detections(result), fx, fy))
+        _fail([future for _, future in items], RuntimeError(f"{len(results)} results for {len(items)} frames"))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "frames": self._frames,
+                "batches": self._batches,
+                "mean_batch_size": round(self._frames / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "busy_seconds": round(self._busy, 3),
+                "mean_batch_latency_ms": round(1000 * self._busy / self._batches, 2) if self._batches else None,
+                "preprocess_seconds": round(self._preprocess, 3),
+                "inference_size": self.size,
+            }
+
+service = InferenceService(None, max_batch=config.INFERENCE_MAX_BATCH,
+                           max_wait=config.INFERENCE_MAX_WAIT_MS / 1000.0,
+                           size=config.INFERENCE_SIZE)
+
+def predict(frames, conf=CONF_THRESHOLD, size=None, classes=None):
+    return service.predict(frames, conf, size, classes)
+
+def class_names():
+    """
+    The names of the classes the model detects, loading it if need be, or
+    None if it can't be loaded
+    """
+    if service.model is None and load_model() is None:
+        return None
+    return set(service.model.names.values())
+
+def model_loaded():
+    """
+    Whether the model is loaded, without loading it
+    """
+    return service.model is not None
+
+def set_num_threads(n):
+    """
+    Cap the CPU threads torch uses in this process, so several model
+    processes on one host don't oversubscribe the cores
+    """
+    import torch
+    torch.set_num_threads(max(1, n))
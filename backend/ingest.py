@@ -0,0 +1,194 @@
+import json
+import os
+import time
+from collections import deque
+import cv2
+from . import cache
+
+# Chunked upload ingestion. The server writes the request body to disk as it
+# arrives and drops a "<path>.done" marker (with the content hash) when the
+# upload completes or is aborted. GrowingVideoReader decodes the file while
+# it is still being written: when it runs out of data it waits for the file
+# to grow, reopens it and seeks back to where it was. A capture can't read
+# past the end it saw when opened, and a partial file has no index, so that
+# seek may decode from the first frame; the growth waited for is therefore
+# proportional to the file's size, keeping the total cost of reopening
+# linear rather than quadratic in the upload's length. Containers with their
+# index at the end (non-faststart MP4) cannot be opened before the upload
+# finishes, so those simply start once the marker appears. The last frame
+# before the end of a partial file can decode from a truncated packet, so
+# frames read from an incomplete file are only handed out once
+# HOLDBACK_FRAMES more have decoded after them.
+
+MIN_START_BYTES = 1024 * 1024  # Don't try to open a file smaller than this
+REOPEN_BYTES = 2 * 1024 * 1024  # Growth needed before reopening at end of data
+REOPEN_GROWTH = 0.25  # ...or this fraction of the size it was last opened at, if more
+POLL_INTERVAL = 0.1
+STALL_TIMEOUT = 60.0  # Give up if the upload stops growing for this long
+HOLDBACK_FRAMES = 8  # Frames kept back from the end of an incomplete file
+
+class UploadAborted(Exception):
+    pass
+
+def marker_path(path):
+    return path + ".done"
+
+def mark_complete(path, content_hash, size):
+    with open(marker_path(path), "w") as f:
+        json.dump({"complete": True, "content_hash": content_hash, "size": size,
+                   "completed_at": time.time()}, f)
+
+def mark_aborted(path):
+    with open(marker_path(path), "w") as f:
+        json.dump({"complete": False}, f)
+
+def read_marker(path):
+    try:
+        with open(marker_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove_marker(path):
+    if os.path.exists(marker_path(path)):
+        os.remove(marker_path(path))
+
+async def receive(stream, path):
+    """
+    Write an async byte stream to path chunk by chunk, flushing each one so
+    readers see it, and mark the upload complete. Returns the content hash
+    and size. On failure the upload is marked aborted and the error raised.
+    """
+    hasher = cache.new_hasher()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                hasher.update(chunk)
+                f.write(chunk)
+                f.flush()
+                size += len(chunk)
+    except BaseException:
+        mark_aborted(path)
+        raise
+    content_hash = hasher.hexdigest()
+    mark_complete(path, content_hash, size)
+    return content_hash, size
+
+class GrowingVideoReader:
+    """
+    cv2.VideoCapture look-alike for a file that is still being uploaded
+    """
+    def __init__(self, path):
+        self.path = path
+        self.frames_read = 0
+        self.marker = None
+        self._cap = None
+        self._pending = deque()  # Decoded from an incomplete file, not handed out yet
+        self._opened_complete = False  # Current capture was opened after the upload finished
+        self._opened_size = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT and not self._opened_complete:
+            return 0  # Unknown until the upload is complete
+        return self._cap.get(prop) if self._cap is not None else 0
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _check_marker(self):
+        if self.marker is None:
+            self.marker = read_marker(self.path)
+            if self.marker is not None and not self.marker.get("complete"):
+                raise UploadAborted(f"Upload of {self.path} was aborted")
+        return self.marker is not None
+
+    def _wait_for_growth(self, min_size):
+        last_size = -1
+        last_change = time.monotonic()
+        while not self._check_marker():
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size >= min_size:
+                return
+            if size != last_size:
+                last_size = size
+                last_change = time.monotonic()
+            elif time.monotonic() - last_change > STALL_TIMEOUT:
+                raise UploadAborted(f"Upload of {self.path} stalled")
+            time.sleep(POLL_INTERVAL)
+
+    def _reopen(self):
+        self.release()
+        self._pending.clear()
+        complete = self._check_marker()
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        if self.frames_read:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames_read)
+            if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != self.frames_read:
+                # Inexact seek; skip forward frame by frame instead
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                for _ in range(self.frames_read):
+                    if not cap.grab():
+                        break
+        self._cap = cap
+        self._opened_complete = complete
+        self._opened_size = os.path.getsize(self.path)
+        return True
+
+    def read(self):
+        while True:
+            if self._cap is not None and self._opened_complete:
+                ret, frame = self._cap.read()
+                if ret:
+                    self.frames_read += 1
+                    return True, frame
+            elif self._cap is not None:
+                while len(self._pending) <= HOLDBACK_FRAMES:
+                    ret, frame = self._cap.read()
+                    if not ret:
+                        break
+                    self._pending.append(frame)
+                else:
+                    self.frames_read += 1
+                    return True, self._pending.popleft()
+
+            # Out of data. If this capture already saw the whole file, that's the end.
+            if self._opened_complete:
+                if self.frames_read == 0:
+                    raise ValueError("Invalid video file - no frames could be decoded")
+                return False, None
+
+            if self._cap is None and self._opened_size == 0:
+                self._wait_for_growth(MIN_START_BYTES)
+            else:
+                self._wait_for_growth(self._opened_size + max(REOPEN_BYTES, int(self._opened_size * REOPEN_GROWTH)))
+            if not self._reopen():
+                if self._check_marker():
+                    raise ValueError("Invalid video file - cannot be opened")
+                # Container not readable yet (e.g. index at the end); wait for more
+                self._opened_size = os.path.getsize(self.path)
+
+def probe(path):
+    """
+    Block until the first frame of a (possibly still arriving) upload
+    decodes and return its width and height. Raises ValueError if the
+    finished upload holds no decodable video and UploadAborted if the
+    upload fails first.
+    """
+    reader = GrowingVideoReader(path)
+    try:
+        ret, frame = reader.read()
+    finally:
+        reader.release()
+    height, width = frame.shape[:2]
+    return width, height
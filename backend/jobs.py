@@ -0,0 +1,533 @@
+import functools
+import os
+import threading
+import time
+import uuid
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from . import config, metrics
+
+# Background processing for /detect-video. Each upload becomes a job that runs
+# run_pipeline in a worker process, so the event loop never blocks on a clip.
+# Workers report progress over a multiprocessing queue that a thread in the
+# server process drains into the job table. A job split into segments runs
+# one task per segment plus a final merge task, all on the same pool. Workers
+# also send the metrics they record over the progress queue.
+
+METRICS_FLUSH_SECONDS = 5.0  # How often a busy worker ships its metrics
+
+class JobQueueFull(Exception):
+    pass
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_finished = deque()  # Finished job ids, oldest first, for pruning
+_executor = None
+_progress_queue = None
+_progress_thread = None
+
+# Set inside worker processes by _init_worker
+_worker_progress_queue = None
+_worker_metrics_sent_at = 0.0
+
+def _init_worker(progress_queue):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+
+def _send_metrics(force=False):
+    # Runs in a worker process: hand what its metrics recorded to the server
+    global _worker_metrics_sent_at
+    now = time.monotonic()
+    if force or now - _worker_metrics_sent_at >= METRICS_FLUSH_SECONDS:
+        _worker_metrics_sent_at = now
+        _worker_progress_queue.put(("metrics", metrics.take()))
+
+def _sends_metrics(task):
+    # Worker tasks ship their remaining metrics when they end
+    @functools.wraps(task)
+    def run(*args, **kwargs):
+        try:
+            return task(*args, **kwargs)
+        finally:
+            _send_metrics(force=True)
+    return run
+
+def _export_events(result, output_path, upload_path, options):
+    # Cut the event clips and keyframes (from the source when there is no
+    # annotated video), and keep only the event summaries in the result
+    from . import events
+    clip_source = output_path if options.get("write_video", True) else upload_path
+    events.export(output_path, result["events"], result["fps"], result["total_frames"], clip_source)
+    result["events"] = events.summarize(result["events"])
+
+def _cached_path(output_path, options):
+    # The file whose presence makes a cached result usable
+    from .overlay import overlay_path
+    return output_path if options.get("write_video", True) else overlay_path(output_path)
+
+@_sends_metrics
+def _run_job(job_id, upload_path, output_path, options, result_extra, cache_keys, ingest_started_at=None):
+    # Runs in a worker process. Imported here so the server process never
+    # loads a model on behalf of the pool.
+    from . import archive, cache, inference, ingest
+    from .overlay import overlay_path
+    from .pipeline import run_pipeline
+
+    def report(done, total):
+        _worker_progress_queue.put((job_id, 0, done, total))
+        _send_metrics()
+
+    inference.set_num_threads(os.cpu_count() or 1)
+
+    report(0, 0)
+    streamed = cache_keys is None
+    if streamed:
+        # The upload is still arriving, so its hash (and cache key) is not
+        # known yet; decode it as it grows
+        capture = ingest.GrowingVideoReader(upload_path)
+        stored = None
+    else:
+        capture = None
+        det_key, res_key = cache_keys
+        stored = cache.load_detections(det_key)
+    recorded = []
+    first_detection_at = []
+
+    def record(frame_index, detections, confidences):
+        if not first_detection_at:
+            first_detection_at.append(time.time())
+        recorded.append(detections)
+
+    try:
+        result = run_pipeline(
+            upload_path,
+            output_path,
+            batch_size=config.PIPELINE_BATCH_SIZE,
+            queue_size=config.PIPELINE_QUEUE_SIZE,
+            workers=config.PIPELINE_WORKERS,
+            progress=report,
+            on_frame=record if stored is None else None,
+            detections=stored,
+            capture=capture,
+            overlay_path=overlay_path(output_path),
+            archive_source=archive.video_source(output_path) if config.ARCHIVE_DETECTIONS else None,
+            **options,
+        )
+    except Exception:
+        # A streamed upload belongs to this job alone; a content-addressed
+        # one may be the input of other jobs for the same clip, so it is
+        # left for retention
+        if streamed:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+            ingest.remove_marker(upload_path)
+        raise
+
+    _export_events(result, output_path, upload_path, options)
+    result["detections_cached"] = stored is not None
+    result.update(result_extra)
+
+    if streamed:
+        marker = capture.marker
+        ingest.remove_marker(upload_path)
+        det_key = cache.detection_key(marker["content_hash"], options.get("stride", 1),
+                                      options.get("adaptive", False))
+        res_key = cache.result_key(det_key, options)
+        result["ingest"] = {
+            "upload_seconds": round(marker["completed_at"] - ingest_started_at, 4),
+            "time_to_first_detection": round(first_detection_at[0] - ingest_started_at, 4)
+            if first_detection_at else None,
+        }
+        # Keep the upload under its content name like the buffered path does
+        ext = os.path.splitext(upload_path)[1]
+        os.replace(upload_path, os.path.join(os.path.dirname(upload_path), marker["content_hash"] + ext))
+
+    if stored is None:
+        cache.store_detections(det_key, recorded)
+    cache.store_result(res_key, result, _cached_path(output_path, options))
+    return result
+
+@_sends_metrics
+def _run_segment(job_id, part, upload_path, output_path, options, frame_range, threads):
+    # Runs in a worker process: one segment of a split job
+    from . import archive, inference, segments
+    from .overlay import overlay_path
+    from .pipeline import run_pipeline
+
+    def report(done, total):
+        # The job's total is known up front; only the frames done add up
+        _worker_progress_queue.put((job_id, part, done, 0))
+        _send_metrics()
+
+    # Segments share the cores rather than each grabbing all of them
+    inference.set_num_threads(threads)
+    recorded = []
+    confidences = []
+
+    def record(frame_index, detections, frame_confidences):
+        recorded.append(detections)
+        confidences.extend(frame_confidences)
+
+    start_frame, end_frame = frame_range
+    result = run_pipeline(
+        upload_path,
+        output_path,
+        batch_size=config.PIPELINE_BATCH_SIZE,
+        queue_size=config.PIPELINE_QUEUE_SIZE,
+        workers=config.PIPELINE_WORKERS,
+        progress=report,
+        on_frame=record,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        warmup=segments.SEGMENT_WARMUP,
+        overlay_path=overlay_path(output_path),
+        overlay_header=part == 0,
+        archive_source=archive.video_source(output_path) if config.ARCHIVE_DETECTIONS else None,
+        **dict(options, codec=segments.part_codec(options.get("codec", "mp4v"))),
+    )
+    return result, recorded, confidences
+
+@_sends_metrics
+def _merge_segments(upload_path, part_paths, output_path, part_results, options, result_extra, cache_keys):
+    # Runs in a worker process once every segment of a split job is done
+    from . import cache, overlay, segments
+
+    result = segments.merge_results(
+        [result for result, _, _ in part_results],
+        [c for _, _, confidences in part_results for c in confidences],
+    )
+    start = time.perf_counter()
+    if options.get("write_video", True):
+        segments.merge_videos(part_paths, output_path, result["fps"], options.get("codec", "mp4v"))
+    part_overlays = [overlay.overlay_path(path) for path in part_paths]
+    overlay.concatenate(part_overlays, overlay.overlay_path(output_path))
+    merge_seconds = time.perf_counter() - start
+    for path in part_paths + part_overlays:
+        if os.path.exists(path):
+            os.remove(path)
+
+    result["timings"]["merge"] = round(merge_seconds, 4)
+    result["timings"]["wall"] = round(result["timings"]["wall"] + merge_seconds, 4)
+    _export_events(result, output_path, upload_path, options)
+    result["detections_cached"] = False
+    result.update(result_extra)
+
+    det_key, res_key = cache_keys
+    cache.store_detections(det_key, [d for _, recorded, _ in part_results for d in recorded])
+    cache.store_result(res_key, result, _cached_path(output_path, options))
+    return result
+
+def _drain_progress(progress_queue):
+    while True:
+        message = progress_queue.get()
+        if message is None:
+            break
+        if message[0] == "metrics":
+            metrics.merge(message[1])
+            continue
+        job_id, part, done, total = message
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                continue
+            if job["status"] == "queued":
+                job["status"] = "running"
+                job["started_at"] = time.time()
+            job["part_frames"][part] = done
+            job["frames_done"] = sum(job["part_frames"].values())
+            if total:
+                job["total_frames"] = total
+
+def _ensure_executor():
+    global _executor, _progress_queue, _progress_thread
+    if _executor is not None:
+        return _executor
+    # spawn keeps torch and the server's threads out of the children
+    context = multiprocessing.get_context("spawn")
+    _progress_queue = context.Queue()
+    _executor = ProcessPoolExecutor(
+        max_workers=max(1, config.JOB_WORKERS),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(_progress_queue,),
+    )
+    _progress_thread = threading.Thread(
+        target=_drain_progress, args=(_progress_queue,), name="job-progress", daemon=True
+    )
+    _progress_thread.start()
+    return _executor
+
+def _finish(job_id, future):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        job["finished_at"] = time.time()
+        try:
+            result = future.result()
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e) or type(e).__name__
+        else:
+            job["status"] = "done"
+            job["result"] = result
+            job["frames_done"] = result["total_frames"]
+            job["total_frames"] = result["total_frames"]
+        metrics.JOBS.inc(job["status"])
+
+        _mark_finished_locked(job_id)
+
+def _mark_finished_locked(job_id):
+    _finished.append(job_id)
+    while len(_finished) > config.JOB_HISTORY:
+        _jobs.pop(_finished.popleft(), None)
+
+def _pending_locked():
+    return sum(1 for job in _jobs.values() if job["status"] in ("queued", "running"))
+
+def _pending_tasks_locked():
+    # Pool tasks of the queued and running jobs: a split job takes one per segment
+    return sum(job["tasks"] for job in _jobs.values() if job["status"] in ("queued", "running"))
+
+def active_count():
+    with _jobs_lock:
+        return _pending_locked()
+
+def running_fps():
+    """
+    Frames per second so far of each running job, by job id
+    """
+    now = time.time()
+    with _jobs_lock:
+        return {
+            job_id: round(job["frames_done"] / (now - job["started_at"]), 2)
+            for job_id, job in _jobs.items()
+            if job["status"] == "running" and job.get("started_at") and now > job["started_at"]
+        }
+
+def has_capacity():
+    with _jobs_lock:
+        return _pending_tasks_locked() < config.MAX_PENDING_JOBS
+
+def upload_in_use(upload_path):
+    """
+    Whether a queued or running job reads upload_path
+    """
+    with _jobs_lock:
+        return any(job["status"] in ("queued", "running") and job.get("upload_path") == upload_path
+                   for job in _jobs.values())
+
+def paths_in_use():
+    """
+    The upload and output paths of the queued and running jobs (an
+    output's part and overlay files share its name)
+    """
+    with _jobs_lock:
+        return [path for job in _jobs.values() if job["status"] in ("queued", "running")
+                for path in (job.get("upload_path"), job.get("output_path"))]
+
+def _plan_segments(upload_path, det_key, stride, count):
+    # Imported here, like the pipeline, to keep the server process light
+    from . import cache, segments
+    if count < 2 or cache.has_detections(det_key):
+        return None, None
+    total_frames = segments.count_frames(upload_path)
+    ranges = segments.plan_segments(total_frames, count, stride)
+    return (ranges, total_frames) if len(ranges) > 1 else (None, None)
+
+def _submit(*args):
+    # Submit a task to the pool, replacing the pool once if a worker died (e.g. OOM)
+    try:
+        return _ensure_executor().submit(*args)
+    except BrokenProcessPool:
+        shutdown()
+        return _ensure_executor().submit(*args)
+
+def _submit_segments(job_id, upload_path, output_path, options, result_extra, cache_keys, ranges):
+    from . import segments
+    part_paths = [segments.segment_path(output_path, part) for part in range(len(ranges))]
+    threads = max(1, (os.cpu_count() or 1) // len(ranges))
+    futures = []
+    try:
+        for part, frame_range in enumerate(ranges):
+            futures.append(_submit(_run_segment, job_id, part, upload_path, part_paths[part], options,
+                                   frame_range, threads))
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+    remaining = [len(futures)]
+    failed = []
+    lock = threading.Lock()
+
+    def discard_parts():
+        from .overlay import overlay_path
+        for path in part_paths + [overlay_path(p) for p in part_paths]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def segment_done(future):
+        # Every segment reports here, failed or not; the parts are only
+        # cleaned up once none of them can still be writing
+        with lock:
+            remaining[0] -= 1
+            last = not remaining[0]
+            first_failure = not failed and (future.cancelled() or future.exception() is not None)
+            if first_failure:
+                failed.append(future)
+        if first_failure:
+            _finish(job_id, future)
+            for other in futures:
+                other.cancel()  # Only those not started yet; the running ones finish first
+        if not last:
+            return
+        if failed:
+            discard_parts()
+            return
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                return
+        part_results = [f.result() for f in futures]
+        try:
+            merge = _submit(
+                _merge_segments, upload_path, part_paths, output_path, part_results, options, result_extra, cache_keys
+            )
+        except Exception as e:
+            failed_merge = Future()
+            failed_merge.set_exception(e)
+            _finish(job_id, failed_merge)
+            discard_parts()
+            return
+        merge.add_done_callback(lambda f: _finish(job_id, f))
+
+    for future in futures:
+        future.add_done_callback(segment_done)
+
+def submit(upload_path, output_path, cache_keys, options=None, result_extra=None, ingest_started_at=None,
+           segments=1):
+    """
+    Queue a video for processing and return its job id. cache_keys is the
+    (detection key, result key) pair for the cache, options are passed on to
+    run_pipeline and result_extra is merged into the finished result. A job
+    already queued or running for the same result key is reused. Raises
+    JobQueueFull when the job would take the queued and running tasks over
+    MAX_PENDING_JOBS; a split job counts one task per segment.
+
+    cache_keys of None means upload_path is still being written by
+    ingest.receive: the job decodes it as it grows and works out its cache
+    keys from the completion marker. ingest_started_at (time.time()) is when
+    the upload began, for the time-to-first-detection report.
+
+    segments > 1 splits a complete upload into that many frame ranges
+    processed in parallel by separate workers, unless the video is too short
+    to split or its detections are already cached. It is capped at
+    MAX_PENDING_JOBS.
+    """
+    job_id = uuid.uuid4().hex
+    res_key = cache_keys[1] if cache_keys else None
+    options = dict(options or {})
+    # Every segment stamps its archived detections from the same moment
+    options.setdefault("archive_epoch", time.time())
+    result_extra = dict(result_extra or {})
+
+    ranges, total_frames = None, None
+    if cache_keys is not None:
+        ranges, total_frames = _plan_segments(upload_path, cache_keys[0], options.get("stride", 1),
+                                              min(segments, config.MAX_PENDING_JOBS))
+    tasks = len(ranges) if ranges else 1
+
+    with _jobs_lock:
+        for job in _jobs.values():
+            if res_key and job["status"] in ("queued", "running") and job["cache_key"] == res_key:
+                return job["job_id"]
+        pending = _pending_tasks_locked()
+        if pending + tasks > config.MAX_PENDING_JOBS:
+            raise JobQueueFull(f"{pending} tasks already pending, this job needs {tasks}")
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "queued",
+            "cache_key": res_key,
+            "upload_path": upload_path,
+            "output_path": output_path,
+            "tasks": tasks,
+            "frames_done": 0,
+            "total_frames": total_frames,
+            "part_frames": {},
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    try:
+        if ranges:
+            _submit_segments(job_id, upload_path, output_path, options, result_extra, cache_keys, ranges)
+            return job_id
+
+        future = _submit(_run_job, job_id, upload_path, output_path, options, result_extra, cache_keys,
+                         ingest_started_at)
+    except Exception:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+        raise
+    future.add_done_callback(lambda f: _finish(job_id, f))
+    return job_id
+
+def add_finished(result, cache_key=None):
+    """
+    Record an already available result (a cache hit) as a finished job so
+    clients can poll it like any other
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "status": "done",
+            "cache_key": cache_key,
+            "frames_done": result.get("total_frames", 0),
+            "total_frames": result.get("total_frames", 0),
+            "created_at": now,
+            "started_at": now,
+            "finished_at": now,
+            "result": result,
+        }
+        _mark_finished_locked(job_id)
+    metrics.JOBS.inc("cached")
+    return job_id
+
+def get_job(job_id):
+    """
+    Return a snapshot of a job's status, or None if it is unknown
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "progress": {
+                "frames_done": job["frames_done"],
+                "total_frames": job["total_frames"],
+            },
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+        }
+        if job["status"] == "done":
+            snapshot["result"] = job["result"]
+        elif job["status"] == "failed":
+            snapshot["error"] = job["error"]
+        return snapshot
+
+def shutdown():
+    global _executor, _progress_thread
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _progress_thread is not None:
+        _progress_queue.put(None)
+        _progress_thread = None
@@ -0,0 +1,703 @@
+import asyncio
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from . import archive, config, inference, metrics
+from .preprocess import scale_detections
+from .scheduler import scheduler
+from .stride import StridePlanner
+
+# Live preview fan-out. Each video source has one LiveSource whose producer
+# thread decodes, runs detection, draws and JPEG-encodes every frame once and
+# hands the bytes to all of its subscribers. A subscriber only keeps the
+# newest frame, so a slow viewer skips frames instead of holding the producer
+# back. The producer stops when its last subscriber leaves.
+#
+# Cameras are added by name with add_source instead: those run whether or not
+# anyone is watching, until removed, and reopen a stream that fails. Every
+# source gets its detections through the FrameScheduler, which shares live
+# inference fairly between them. A source kept waiting for its turn skips the
+# frames that went stale meanwhile, so on an overloaded node each stream's fps
+# drops while its latency stays bounded. A named source can also carry a
+# roi.DetectionFilter: only its classes are detected and only inside its
+# region of interest, whose outline is drawn on the annotated frames. The
+# detections of every inferred frame are also appended to the archive, under
+# the source's name (or its video's name for on-demand sources).
+#
+# Each producer runs on its own thread and paces itself against the wall
+# clock. At most LIVE_MAX_SOURCES producers run at once, named and on-demand
+# alike, counting removed ones until their thread has exited. Viewers are
+# coroutines on the event loop, woken by the producer through
+# call_soon_threadsafe, so an idle connection costs no thread.
+#
+# WebSocket viewers (/ws) subscribe with raw=True and get a LiveFrame instead
+# of the annotated JPEG: the detections to draw themselves, plus the clean
+# frame, encoded only at the size and quality a viewer asks for. StreamRate
+# decides per viewer which frames go out with their image and at what quality,
+# from how quickly the viewer acknowledges them. A source with only WebSocket
+# viewers never draws or encodes the annotated JPEG at all.
+
+JPEG_QUALITY = 80
+LIVE_MAX_WIDTH = 1280  # Wider frames are shrunk to this for streaming
+FPS_WINDOW_SECONDS = 5.0  # Achieved fps is measured over this much recent time
+FPS_WINDOW_FRAMES = 1024  # Frame times kept for it
+RECONNECT_SECONDS = 5.0  # Wait before a persistent source reopens a failed stream
+STREAM_STALL_SECONDS = 10.0  # A stream with no new frame for this long is reopened
+
+# WebSocket viewers
+QUALITY_LADDER = ((1280, 80), (960, 70), (640, 60), (480, 50), (320, 40))  # (max width, JPEG quality), best first
+MAX_UNACKED = 2  # Image frames in flight to one viewer; further frames go out without their image
+ACK_TIMEOUT = 2.0  # Seconds after which an unacknowledged image is given up on
+RATE_WINDOW = 30  # Frames between quality adjustments
+DOWNGRADE_BELOW = 0.5  # Step down the ladder when a viewer got less than this share of a window's images
+
+def draw_detections(frame, detections):
+    """
+    Draw every detected box with its class and confidence
+    """
+    boxes, scores, cls_ids, names = detections
+    for i in range(len(boxes)):
+        x1, y1, x2, y2 = boxes[i].astype(int)
+        cls_name = names[cls_ids[i]]
+        conf = scores[i]
+
+        # Different colors for different classes
+        colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
+        color = colors[cls_ids[i] % len(colors)]
+
+        # Draw bounding box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+        # Draw label with background
+        label = f"{cls_name} {conf:.2f}"
+        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)[0]
+        cv2.rectangle(frame, (x1, y1 - label_size[1] - 10),
+                    (x1 + label_size[0], y1), color, -1)
+        cv2.putText(frame, label, (x1, y1 - 5),
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+def draw_roi(frame, polygon):
+    """
+    Outline a region of interest given as [x, y] fractions of the frame
+    """
+    height, width = frame.shape[:2]
+    points = np.round(polygon * (width, height)).astype(np.int32)
+    cv2.polylines(frame, [points], True, (0, 255, 255), 2)
+
+def error_jpeg(lines, origins, scale=0.7):
+    """
+    A black 640x480 JPEG with the given red text lines
+    """
+    error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for text, origin in zip(lines, origins):
+        cv2.putText(error_frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 255), 2)
+    ret, buffer = cv2.imencode('.jpg', error_frame)
+    return buffer.tobytes() if ret else None
+
+class LiveFrame:
+    """
+    One produced frame for raw subscribers: the clean display-size frame,
+    its detections in display pixels (None on error) and the error text.
+    JPEGs are encoded on demand and cached per (width, quality), so viewers
+    on the same step of the ladder share one encode.
+    """
+    def __init__(self, seq, index, total, image, detections, error=None):
+        self.seq, self.index, self.total = seq, index, total
+        self.image, self.detections, self.error = image, detections, error
+        self._jpegs = {}
+        self._lock = threading.Lock()
+
+    def payload(self):
+        """
+        The detections as a compact JSON-ready dict, boxes as
+        [x1, y1, x2, y2, class, confidence]
+        """
+        height, width = self.image.shape[:2] if self.image is not None else (0, 0)
+        message = {"type": "detections", "seq": self.seq, "frame": self.index, "total": self.total,
+                   "size": [width, height], "boxes": []}
+        if self.detections is not None:
+            boxes, scores, cls_ids, names = self.detections
+            message["boxes"] = [[*map(int, box), names[cls_id], round(float(score), 2)]
+                                for box, score, cls_id in zip(boxes, scores, cls_ids)]
+        if self.error:
+            message["error"] = self.error
+        return message
+
+    def jpeg(self, width, quality):
+        """
+        The clean frame as JPEG bytes, shrunk to at most width pixels wide
+        """
+        if self.image is None:
+            return None
+        with self._lock:
+            key = (width, quality)
+            if key not in self._jpegs:
+                image = self.image
+                if image.shape[1] > width:
+                    height = max(1, round(image.shape[0] * width / image.shape[1]))
+                    image = cv2.resize(image, (width, height))
+                ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                self._jpegs[key] = buffer.tobytes() if ret else None
+            return self._jpegs[key]
+
+class StreamRate:
+    """
+    One WebSocket viewer's frame budget. At most MAX_UNACKED images are in
+    flight, so the viewer's image rate follows how fast it acknowledges
+    them; frames beyond that still send their detections. Every RATE_WINDOW
+    frames the size and quality step down QUALITY_LADDER if the viewer got
+    less than DOWNGRADE_BELOW of the images, and back up if it got them all.
+    """
+    def __init__(self, frames=True, max_width=None, quality=None, max_fps=None):
+        self.level = 0
+        self.rtt = None  # Smoothed seconds from sending an image to its ack
+        self._in_flight = {}  # seq -> time sent
+        self._last_sent = 0.0
+        self._offered = self._sent = 0
+        self.configure(frames, max_width, quality, max_fps)
+
+    def configure(self, frames=True, max_width=None, quality=None, max_fps=None):
+        """
+        Apply a viewer's limits: whether it wants images at all, the widest
+        and best quality image it wants and its highest image rate
+        """
+        self.frames = bool(frames)
+        self.max_quality = int(quality) if quality else None
+        self.min_interval = 1.0 / float(max_fps) if max_fps else 0.0
+        self.best_level = next((i for i, (width, _) in enumerate(QUALITY_LADDER)
+                                if not max_width or width <= int(max_width)), len(QUALITY_LADDER) - 1)
+        self.level = max(self.level, self.best_level)
+
+    def settings(self):
+        """
+        (max width, JPEG quality) for the next image
+        """
+        width, quality = QUALITY_LADDER[self.level]
+        if self.max_quality:
+            quality = min(quality, self.max_quality)
+        return width, quality
+
+    def _adjust(self):
+        share = self._sent / self._offered
+        if share < DOWNGRADE_BELOW and self.level < len(QUALITY_LADDER) - 1:
+            self.level += 1
+        elif share == 1.0 and self.level > self.best_level:
+            self.level -= 1
+        self._offered = self._sent = 0
+
+    def want_image(self, now):
+        """
+        Whether the frame being sent now should carry its image
+        """
+        for seq, sent_at in list(self._in_flight.items()):
+            if now - sent_at > ACK_TIMEOUT:
+                del self._in_flight[seq]
+        # Frames held back by the viewer's own rate limit aren't congestion
+        if not self.frames or now - self._last_sent < self.min_interval:
+            return False
+        if self._offered >= RATE_WINDOW:
+            self._adjust()
+        self._offered += 1
+        return len(self._in_flight) < MAX_UNACKED
+
+    def sent(self, seq, now):
+        self._in_flight[seq] = now
+        self._last_sent = now
+        self._sent += 1
+
+    def ack(self, seq, now):
+        """
+        A viewer acknowledged image seq, and with it every earlier one
+        """
+        for pending in [s for s in self._in_flight if s <= seq]:
+            rtt = now - self._in_flight.pop(pending)
+            if pending == seq:
+                self.rtt = rtt if self.rtt is None else 0.8 * self.rtt + 0.2 * rtt
+
+class Subscriber:
+    """
+    One viewer's mailbox. Holds at most one unread frame; a newer frame
+    replaces it and counts as dropped. Filled from the producer thread and
+    read from the event loop. Raw subscribers get LiveFrames, the others
+    annotated JPEG bytes.
+    """
+    def __init__(self, loop, raw=False):
+        self.raw = raw
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._lock = threading.Lock()
+        self._frame = None
+        self.closed = False
+        self.dropped = 0
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    def offer(self, frame_bytes):
+        with self._lock:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame_bytes
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    async def next_frame(self, timeout=1.0):
+        """
+        Wait for the next frame. Returns None on timeout or once the source
+        has closed and nothing is left to read.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        with self._lock:
+            frame_bytes, self._frame = self._frame, None
+        return frame_bytes
+
+class LatestFrameReader:
+    """
+    Reads a network stream on its own thread and keeps only the newest
+    frame, so a source that falls behind jumps to the present instead of
+    working through the stream's backlog. Stands in for the VideoCapture
+    of a stream source.
+    """
+    def __init__(self, url):
+        self._cap = cv2.VideoCapture(url)
+        self._cond = threading.Condition()
+        self._frame = None
+        self._ended = False
+        self._closed = False
+        self.skipped = 0
+        if self._cap.isOpened():
+            threading.Thread(target=self._run, name="live-reader", daemon=True).start()
+
+    def isOpened(self):
+        return self._cap.isOpened()
+
+    def get(self, prop):
+        return self._cap.get(prop)
+
+    def set(self, prop, value):
+        # Streams can't seek
+        return False
+
+    def _run(self):
+        try:
+            while not self._closed:
+                ret, frame = self._cap.read()
+                with self._cond:
+                    if not ret:
+                        break
+                    if self._frame is not None:
+                        self.skipped += 1
+                    self._frame = frame
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+            self._cap.release()
+
+    def read(self):
+        """
+        The newest frame not read yet, waiting up to STREAM_STALL_SECONDS
+        for one
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self._ended, STREAM_STALL_SECONDS)
+            frame, self._frame = self._frame, None
+        return frame is not None, frame
+
+    def grab(self):
+        return False
+
+    def release(self):
+        # The reader thread releases the capture once its read returns
+        self._closed = True
+
+class LiveSource:
+    """
+    Single producer for one video file or stream, looping files at their
+    own frame rate. Benchmarks run it with paced=False and loop=False to
+    produce every frame once, as fast as possible. Sources added by name
+    are persistent: they run without viewers and reconnect when their
+    stream fails, until removed.
+    """
+    def __init__(self, video_path, paced=True, loop=True, name=None, persistent=False, detection_filter=None,
+                 archive_detections=None):
+        self.name = name or video_path
+        self.video_path = video_path
+        self.stream = "://" in video_path
+        self.paced = paced and not self.stream  # Streams arrive at their own pace
+        self.loop = loop
+        self.persistent = persistent
+        self.detection_filter = detection_filter  # roi.DetectionFilter, or None for every class everywhere
+        self.archive_detections = config.ARCHIVE_DETECTIONS if archive_detections is None else archive_detections
+        self.archive_source = name or archive.video_source(video_path)
+        self.subscribers = set()
+        self.frames_produced = 0
+        self.target_fps = None
+        self.started_at = None
+        self.state = "starting"
+        self.error = None
+        self.archive_error = None  # Last archive write failure, kept apart from detection errors
+        self._frames_skipped = 0
+        self._reader = None
+        self._published = deque(maxlen=FPS_WINDOW_FRAMES)  # monotonic times of recent frames
+        self._stop = threading.Event()
+
+    def start(self):
+        # Called with _sources_lock held
+        _running.add(self)
+        threading.Thread(target=self.run, name=f"live-source-{self.name}", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def frames_skipped(self):
+        """
+        Frames never shown because the source fell behind
+        """
+        return self._frames_skipped + (self._reader.skipped if self._reader else 0)
+
+    def achieved_fps(self, now=None):
+        """
+        Frames per second produced over the last FPS_WINDOW_SECONDS
+        """
+        now = time.monotonic() if now is None else now
+        if not self.started_at or now <= self.started_at:
+            return None
+        recent = sum(1 for at in list(self._published) if at >= now - FPS_WINDOW_SECONDS)
+        return round(recent / min(FPS_WINDOW_SECONDS, now - self.started_at), 2)
+
+    def _publish(self, frame_bytes, packet=None, subscribers=None):
+        if subscribers is None:
+            with _sources_lock:
+                subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if subscriber.raw:
+                if packet is not None:
+                    subscriber.offer(packet)
+            elif frame_bytes is not None:
+                subscriber.offer(frame_bytes)
+
+    def run(self):
+        """
+        Produce frames on the calling thread until stopped
+        """
+        scheduler.join(self)
+        try:
+            while True:
+                self._produce()
+                if not self.persistent or self._stop.is_set():
+                    break
+                self.state = "reconnecting"
+                if self._stop.wait(RECONNECT_SECONDS):
+                    break
+        finally:
+            scheduler.leave(self)
+            self.state = "stopped"
+            with _sources_lock:
+                if _sources.get(self.name) is self:
+                    del _sources[self.name]
+                _running.discard(self)
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.close()
+
+    def _archive(self, writer, frame_index, detections):
+        # A failing archive must not stop or look like detection
+        try:
+            writer.write(frame_index, time.time(), detections)
+            self.archive_error = None
+        except Exception as e:
+            if self.archive_error is None:
+                print(f"Archive error in live source {self.name}: {e}")
+            self.archive_error = str(e)
+
+    def _produce(self):
+        cap = None
+        writer = None
+        try:
+            if self.stream:
+                cap = self._reader = LatestFrameReader(self.video_path)
+            else:
+                cap = cv2.VideoCapture(self.video_path)
+            if not cap.isOpened():
+                raise Exception(f"Cannot open video file: {self.video_path}")
+
+            # Get video properties
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            frame_delay = 1.0 / fps
+            self.target_fps = fps
+            if self.archive_detections:
+                writer = archive.ArchiveWriter(self.archive_source, fps)
+            self.state = "running"
+            self.error = None
+
+            print(f"Video opened: FPS={fps}, Total frames={total_frames}")
+            self.started_at = time.monotonic()
+            next_frame_at = self.started_at
+
+            frame_count = 0
+            position = 0  # Frames read since opening, carrying on across loops, for the archive
+            planner = StridePlanner(config.DETECT_STRIDE, config.ADAPTIVE_STRIDE)
+            detections = None
+
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                ret, frame = cap.read()
+                decoded = time.perf_counter()
+
+                if not ret:
+                    if not self.loop or self.stream:
+                        break
+                    # Loop video when it ends
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    frame_count = 0
+                    continue
+
+                frame_count += 1
+                position += 1
+
+                # Perform YOLO detection on the decoded frame once the
+                # scheduler gives this source its turn; the inference
+                # service downscales it once to the model's input size
+                error = None
+                fresh = False
+                if inference.load_model() is not None:
+                    try:
+                        # Skipped frames reuse the last keyframe's boxes
+                        if planner.is_keyframe(frame) or detections is None:
+                            detections = scheduler.infer(self, frame, self.detection_filter)
+                            fresh = True
+                    except Exception as e:
+                        error = f"Detection Error: {str(e)[:30]}"
+                else:
+                    error = "YOLO model not loaded"
+                if writer and fresh:
+                    self._archive(writer, position - 1, detections)
+                inferred = time.perf_counter()
+                # Resize frame for display if too large (for better
+                # performance), scaling the boxes along with it
+                height, width = frame.shape[:2]
+                new_width, new_height = width, height
+                if width > LIVE_MAX_WIDTH:
+                    scale = LIVE_MAX_WIDTH / width
+                    new_width = int(width * scale)
+                    new_height = int(height * scale)
+                    frame = cv2.resize(frame, (new_width, new_height))
+
+                display = None
+                if error is None:
+                    display = scale_detections(detections, new_width / width, new_height / height)
+
+                with _sources_lock:
+                    subscribers = list(self.subscribers)
+                # Annotated JPEGs are only made for MJPEG viewers (or with
+                # no viewers at all, as in benchmarks)
+                annotate = not subscribers or not all(s.raw for s in subscribers)
+                packet = None
+                if any(s.raw for s in subscribers):
+                    image = frame.copy() if annotate else frame
+                    packet = LiveFrame(self.frames_produced, frame_count, total_frames, image, display, error)
+
+                frame_bytes = None
+                if annotate:
+                    if self.detection_filter is not None and self.detection_filter.polygon is not None:
+                        draw_roi(frame, self.detection_filter.polygon)
+                    if error is None:
+                        draw_detections(frame, display)
+                    else:
+                        # Show why there are no boxes on the frame
+                        cv2.putText(frame, error, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+                    # Add frame counter
+                    cv2.putText(frame, f"Frame: {frame_count}/{total_frames}", (10, frame.shape[0] - 10),
+                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+                    # Encode frame once for every viewer
+                    drawn = time.perf_counter()
+                    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                    encoded = time.perf_counter()
+                    if ret:
+                        frame_bytes = buffer.tobytes()
+                    metrics.STAGE_SECONDS.observe(drawn - inferred, "live", "draw")
+                    metrics.STAGE_SECONDS.observe(encoded - drawn, "live", "encode")
+
+                if frame_bytes is not None or packet is not None:
+                    self.frames_produced += 1
+                    self._published.append(time.monotonic())
+                    self._publish(frame_bytes, packet, subscribers)
+
+                metrics.STAGE_SECONDS.observe(decoded - started, "live", "decode")
+                metrics.STAGE_SECONDS.observe(inferred - decoded, "live", "inference")
+                metrics.FRAMES.inc("live")
+
+                if not self.paced:
+                    continue
+
+                # Control frame rate against the wall clock, so processing
+                # time is absorbed into the frame interval instead of added
+                next_frame_at += frame_delay
+                delay = next_frame_at - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    # Behind, e.g. waiting for a turn at inference: drop
+                    # the frames that are already stale instead of showing
+                    # them late
+                    behind = int(-delay / frame_delay)
+                    for _ in range(behind):
+                        if not cap.grab():
+                            break
+                        frame_count += 1
+                        position += 1
+                        self._frames_skipped += 1
+                    next_frame_at += behind * frame_delay
+
+        except Exception as e:
+            print(f"Error in live source {self.name}: {e}")
+            self.error = str(e)
+            error = f"Stream Error: {str(e)[:40]}"
+            self._publish(error_jpeg([error], [(10, 240)]),
+                          LiveFrame(self.frames_produced, 0, 0, None, None, error))
+
+        finally:
+            if cap:
+                cap.release()
+            if writer:
+                try:
+                    writer.close()
+                except Exception as e:
+                    print(f"Archive error in live source {self.name}: {e}")
+
+_sources = {}  # name (the video path for unnamed sources) -> LiveSource
+_sources_lock = threading.Lock()
+_running = set()  # Sources whose producer thread hasn't exited yet
+
+def _check_capacity():
+    # Called with _sources_lock held
+    if len(_running) >= config.LIVE_MAX_SOURCES:
+        raise RuntimeError(f"At most {config.LIVE_MAX_SOURCES} live sources can run at once")
+
+def add_source(name, url, detection_filter=None):
+    """
+    Start a persistent source reading url (a video file or stream URL)
+    under name, detecting what detection_filter allows. Raises ValueError
+    if the name is taken and RuntimeError when LIVE_MAX_SOURCES are
+    already running.
+    """
+    with _sources_lock:
+        if name in _sources:
+            raise ValueError(f"Live source {name!r} already exists")
+        _check_capacity()
+        source = LiveSource(url, name=name, persistent=True, detection_filter=detection_filter)
+        _sources[name] = source
+        source.start()
+    return source
+
+def remove_source(name):
+    """
+    Stop and forget a source, disconnecting its viewers. Returns it, or
+    None if there was no such source.
+    """
+    with _sources_lock:
+        source = _sources.pop(name, None)
+        if source is not None:
+            source.stop()
+            subscribers = list(source.subscribers)
+    if source is not None:
+        for subscriber in subscribers:
+            subscriber.close()
+    return source
+
+def set_filter(name, detection_filter):
+    """
+    Change what source name detects from its next keyframe on. Returns the
+    source, or None if there is no such source.
+    """
+    with _sources_lock:
+        source = _sources.get(name)
+        if source is not None:
+            source.detection_filter = detection_filter
+    return source
+
+def get_source(name):
+    with _sources_lock:
+        return _sources.get(name)
+
+def subscribe(name, loop, raw=False, on_demand=True):
+    """
+    Join the broadcast of source name from event loop loop. An unknown
+    name is taken as a video path and gets an on-demand producer, which
+    stops with its last viewer; without on_demand it raises KeyError
+    instead. raw subscribers get LiveFrames instead of JPEGs. Raises
+    RuntimeError if that producer would exceed LIVE_MAX_SOURCES.
+    """
+    subscriber = Subscriber(loop, raw)
+    with _sources_lock:
+        source = _sources.get(name)
+        if source is None:
+            if not on_demand:
+                raise KeyError(name)
+            _check_capacity()
+            source = LiveSource(name)
+            _sources[name] = source
+            source.start()
+        source.subscribers.add(subscriber)
+    return source, subscriber
+
+def unsubscribe(source, subscriber):
+    """
+    Leave a broadcast; an on-demand producer stops once nobody is watching
+    """
+    with _sources_lock:
+        source.subscribers.discard(subscriber)
+        if not source.subscribers and not source.persistent:
+            source.stop()
+            if _sources.get(source.name) is source:
+                del _sources[source.name]
+
+def stats():
+    now = time.monotonic()
+    with _sources_lock:
+        sources = list(_sources.values())
+        viewers = {source: list(source.subscribers) for source in sources}
+    return [
+        {
+            "name": source.name,
+            "video_path": source.video_path,
+            "persistent": source.persistent,
+            "state": source.state,
+            "error": source.error,
+            "archive_error": source.archive_error,
+            "subscribers": len(viewers[source]),
+            "frames_produced": source.frames_produced,
+            "frames_skipped": source.frames_skipped,
+            "frames_dropped": sum(s.dropped for s in viewers[source]),
+            "target_fps": source.target_fps,
+            "achieved_fps": source.achieved_fps(now),
+            "filter": source.detection_filter.settings() if source.detection_filter else None,
+            **scheduler.stats(source),
+        }
+        for source in sources
+    ]
+
+def shutdown():
+    with _sources_lock:
+        sources = list(_sources.values())
+    for source in sources:
+        source.stop()
@@ -1,20 +1,33 @@
+import gc
+import json
+import math
 import os
-import shutil
+import re
+import struct
 import cv2
-import numpy as np
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
-from .process_video import process_video
-from ultralytics import YOLO
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from . import archive, cache, config, events, inference, ingest, jobs, live, metrics, overlay, retention, roi, scheduler
 import threading
 import time
 import asyncio
+import uuid
+from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 
 app = FastAPI()
 
+if config.MODEL_LOAD == "preload":
+    # Load while the app is imported, i.e. before a preloading server
+    # (gunicorn --preload) forks its workers, so they share the model's
+    # pages copy-on-write. Freezing keeps the garbage collector from
+    # writing to those pages and unsharing them.
+    inference.load_model()
+    gc.freeze()
+startup_seconds = None  # Process start until the app was ready to serve
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -35,67 +48,390 @@ os.makedirs(LIVE_DIR, exist_ok=True)
 app.mount("/processed", StaticFiles(directory=PROCESSED_DIR), name="processed")
 app.mount("/live", StaticFiles(directory=LIVE_DIR), name="live")
 
-# Load YOLO model once
-try:
-    model = YOLO("yolov8s.pt")
-    print("YOLO model loaded successfully")
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    model = None
-
-CONF_THRESHOLD = 0.3
-
 # Global variables for live video management
 current_live_video = None
 live_video_lock = threading.Lock()
 active_streams = {}
 stream_counter = 0
 
-@app.post("/detect-video")
-async def detect_video(video: UploadFile = File(...)):
+def _queue_full_error():
+    return HTTPException(
+        status_code=503,
+        detail="Too many videos are being processed, try again later",
+        headers={"Retry-After": "30"},
+    )
+
+def _job_options(stride, adaptive, write_video):
+    return {
+        "stride": stride,
+        "adaptive": adaptive,
+        "write_video": write_video,
+        "codec": config.OUTPUT_CODEC,
+        "scale": config.OUTPUT_SCALE,
+    }
+
+def _result_links(output_name, filename, write_video):
+    return {
+        "processed_url": f"/processed/{output_name}" if write_video else None,
+        "overlay_url": f"/overlay/{output_name}",
+        "events_url": f"/events/{output_name}",
+        "archive_url": f"/archive/{archive.video_source(output_name)}" if config.ARCHIVE_DETECTIONS else None,
+        "filename": filename,
+    }
+
+@app.post("/detect-video", status_code=202)
+async def detect_video(
+    video: UploadFile = File(...),
+    stride: int = Form(config.DETECT_STRIDE),
+    adaptive: bool = Form(config.ADAPTIVE_STRIDE),
+    segments: int = Form(config.DETECT_SEGMENTS),
+    annotate: bool = Form(config.OUTPUT_VIDEO),
+):
+    """
+    Queue an uploaded video for accident detection. Returns a job id to
+    poll at /jobs/{job_id}; a clip seen before with the same settings comes
+    back already done. stride > 1 runs YOLO only on every stride-th frame
+    (or on motion when adaptive) and interpolates the rest. segments > 1
+    splits a long video into that many parts processed in parallel.
+    annotate=false skips writing the annotated video; the detections are
+    still available as an overlay at overlay_url for drawing over the
+    original.
+    """
     if not video.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
-    
-    upload_path = os.path.join(UPLOAD_DIR, video.filename)
-    output_path = os.path.join(PROCESSED_DIR, f"processed_{video.filename}")
+    if not 1 <= stride <= config.MAX_STRIDE:
+        raise HTTPException(status_code=400, detail=f"stride must be between 1 and {config.MAX_STRIDE}")
+    if segments < 1:
+        raise HTTPException(status_code=400, detail="segments must be at least 1")
+
+    # Turn work away before accepting the upload rather than after
+    if not jobs.has_capacity():
+        raise _queue_full_error()
 
-    # Save uploaded file
+    # Save uploaded file, hashing it on the way to disk
+    tmp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.part")
+    hasher = cache.new_hasher()
     try:
-        with open(upload_path, "wb") as f:
-            shutil.copyfileobj(video.file, f)
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = await video.read(cache.HASH_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
     except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise HTTPException(status_code=500, detail=f"Failed to save video: {str(e)}")
 
-    # Process video
+    content_hash = hasher.hexdigest()
+    det_key = cache.detection_key(content_hash, stride, adaptive)
+    options = _job_options(stride, adaptive, annotate)
+    res_key = cache.result_key(det_key, options)
+
+    # Same clip, model and thresholds as before: answer from the cache
+    cached = cache.load_result(res_key)
+    if cached is not None:
+        os.remove(tmp_path)
+        job_id = jobs.add_finished(dict(cached, cached=True), cache_key=res_key)
+        return {
+            "job_id": job_id,
+            "status": "done",
+            "status_url": f"/jobs/{job_id}"
+        }
+
+    # Uploads are stored by content, so repeats of a clip share one file
+    ext = os.path.splitext(video.filename)[1].lower() or ".mp4"
+    upload_path = os.path.join(UPLOAD_DIR, f"{content_hash}{ext}")
+    os.replace(tmp_path, upload_path)
+    output_name = f"processed_{res_key[:16]}{ext}"
+    output_path = os.path.join(PROCESSED_DIR, output_name)
+
+    # Queue video for processing
     try:
-        result = process_video(upload_path, output_path)
-    except Exception as e:
-        # Clean up uploaded file if processing fails
-        if os.path.exists(upload_path):
+        job_id = jobs.submit(
+            upload_path,
+            output_path,
+            (det_key, res_key),
+            options=options,
+            result_extra=_result_links(output_name, video.filename, annotate),
+            segments=segments,
+        )
+    except jobs.JobQueueFull:
+        # Filled up while this upload arrived; keep the file only for a job already reading it
+        if not jobs.upload_in_use(upload_path):
             os.remove(upload_path)
+        raise _queue_full_error()
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Video processing failed: {str(e)}")
 
-    result["processed_url"] = f"/processed/processed_{video.filename}"
-    return result
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}"
+    }
 
-@app.post("/upload-live-video")
-async def upload_live_video(video: UploadFile = File(...)):
+@app.post("/detect-video/stream", status_code=202)
+async def detect_video_stream(
+    request: Request,
+    filename: str,
+    stride: int = config.DETECT_STRIDE,
+    adaptive: bool = config.ADAPTIVE_STRIDE,
+    annotate: bool = config.OUTPUT_VIDEO,
+):
     """
-    Upload a video for live detection preview
+    Like /detect-video, but the request body is the raw video and detection
+    starts while it is still uploading instead of after the whole file is on
+    disk. Responds once the upload is complete; the job may already be well
+    under way by then. The finished result reports upload_seconds and
+    time_to_first_detection under "ingest".
     """
-    global current_live_video
-    
-    if not video.filename:
+    started_at = time.time()
+    if not 1 <= stride <= config.MAX_STRIDE:
+        raise HTTPException(status_code=400, detail=f"stride must be between 1 and {config.MAX_STRIDE}")
+
+    stream_id = uuid.uuid4().hex
+    ext = os.path.splitext(filename)[1].lower() or ".mp4"
+    upload_path = os.path.join(UPLOAD_DIR, f".stream-{stream_id}{ext}")
+    output_name = f"processed_{stream_id[:16]}{ext}"
+    output_path = os.path.join(PROCESSED_DIR, output_name)
+
+    # Queue the job first so it can pick up frames as soon as they land
+    try:
+        job_id = jobs.submit(
+            upload_path,
+            output_path,
+            None,
+            options=_job_options(stride, adaptive, annotate),
+            result_extra=_result_links(output_name, filename, annotate),
+            ingest_started_at=started_at,
+        )
+    except jobs.JobQueueFull:
+        raise _queue_full_error()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Video processing failed: {str(e)}")
+
+    try:
+        content_hash, size = await ingest.receive(request.stream(), upload_path)
+    except Exception as e:
+        # The job sees the aborted marker, fails and removes the partial file
+        raise HTTPException(status_code=400, detail=f"Upload interrupted: {str(e)}")
+
+    job = jobs.get_job(job_id)
+    return {
+        "job_id": job_id,
+        "status": job["status"] if job else "queued",
+        "status_url": f"/jobs/{job_id}",
+        "content_hash": content_hash,
+        "bytes": size,
+        "upload_seconds": round(time.time() - started_at, 4)
+    }
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    """
+    Report a detection job's status and progress, with the result once done
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
+
+@app.get("/overlay/{video_name}")
+def get_overlay(video_name: str):
+    """
+    Per-frame vehicle and accident boxes of a processed video as JSON
+    lines, for drawing over the original instead of the annotated copy
+    """
+    path = overlay.overlay_path(os.path.join(PROCESSED_DIR, os.path.basename(video_name)))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="No overlay for this video")
+    return FileResponse(path, media_type="application/x-ndjson")
+
+def _event_file(video_name, file_name):
+    # Only ever serve files from inside the video's own events directory
+    directory = events.events_dir(os.path.join(PROCESSED_DIR, os.path.basename(video_name)))
+    path = os.path.join(directory, os.path.basename(file_name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Event file not found")
+    return path
+
+@app.get("/events/{video_name}")
+def get_events(video_name: str):
+    """
+    Accident event timeline of a processed video: per event its frame
+    range, timestamps, peak confidence and boxes, with links to a short
+    clip and keyframes around it
+    """
+    timeline = events.load_timeline(os.path.join(PROCESSED_DIR, os.path.basename(video_name)))
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="No event timeline for this video")
+    for event in timeline["events"]:
+        base = f"/events/{timeline['video']}/{event['id']}"
+        event["clip_url"] = f"{base}/clip" if event.pop("clip") else None
+        event["keyframe_urls"] = {label: f"{base}/keyframes/{label}" for label in event.pop("keyframes")}
+    return timeline
+
+@app.get("/events/{video_name}/{event_id}/clip")
+def get_event_clip(video_name: str, event_id: int):
+    """
+    The pre-cut annotated clip around one accident event
+    """
+    return FileResponse(_event_file(video_name, f"event{event_id}.mp4"), media_type="video/mp4")
+
+@app.get("/events/{video_name}/{event_id}/keyframes/{which}")
+def get_event_keyframe(video_name: str, event_id: int, which: str):
+    """
+    The start, peak or end frame of one accident event as a JPEG
+    """
+    if which not in ("start", "peak", "end"):
+        raise HTTPException(status_code=404, detail="Keyframe must be start, peak or end")
+    return FileResponse(_event_file(video_name, f"event{event_id}_{which}.jpg"), media_type="image/jpeg")
+
+def _archive_time(value, field):
+    # Unix seconds or an ISO 8601 time (server local time unless it has an offset)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} must be unix seconds or an ISO 8601 time")
+
+def _archive_filters(source, start, end, start_frame, end_frame, classes, min_conf, accidents):
+    if not archive.exists(source):
+        raise HTTPException(status_code=404, detail=f"Nothing archived for {source}")
+    names = {name.strip() for name in (classes or "").split(",") if name.strip()}
+    return {
+        "start_time": _archive_time(start, "start"),
+        "end_time": _archive_time(end, "end"),
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "classes": names or None,
+        "min_conf": min_conf,
+        "accidents_only": accidents,
+    }
+
+def _check_limit(limit):
+    if not 1 <= limit <= archive.MAX_QUERY_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {archive.MAX_QUERY_ROWS}")
+
+@app.get("/archive")
+def list_archive():
+    """
+    Every source with archived detections (jobs under their output video's
+    name, live sources under theirs) with its rows, size and time and
+    frame spans
+    """
+    return {"sources": archive.sources(), "max_bytes": config.ARCHIVE_MAX_BYTES}
+
+@app.get("/archive/{source}")
+def query_archive(source: str, start: str = None, end: str = None, start_frame: int = None,
+                  end_frame: int = None, classes: str = None, min_conf: float = None,
+                  accidents: bool = False, limit: int = 1000):
+    """
+    Archived detections of a source in the time range [start, end) (unix
+    seconds or ISO 8601) and/or frame range [start_frame, end_frame),
+    optionally only some classes (comma-separated), those above min_conf or
+    those in accident pairs. Returns at most limit rows, in order, and how
+    many matched.
+    """
+    _check_limit(limit)
+    filters = _archive_filters(source, start, end, start_frame, end_frame, classes, min_conf, accidents)
+    rows, matched = archive.query(source, limit=limit, **filters)
+    return {"source": archive.source_name(source), "matched": matched, "returned": len(rows), "detections": rows}
+
+@app.get("/archive/{source}/summary")
+def summarize_archive(source: str, start: str = None, end: str = None, start_frame: int = None,
+                      end_frame: int = None, classes: str = None, min_conf: float = None,
+                      accidents: bool = False, interval: float = None, min_count: int = None,
+                      limit: int = 1000):
+    """
+    Aggregates over the same filters as /archive/{source}: detections and
+    mean confidence per class, detections per interval seconds, and with
+    min_count the frames holding at least that many matching detections
+    (e.g. classes=car,truck&min_count=20 for the heaviest traffic). The
+    timeline may span at most archive.MAX_TIMELINE_BUCKETS intervals.
+    """
+    if interval is not None and not (interval > 0 and math.isfinite(interval)):
+        raise HTTPException(status_code=400, detail="interval must be a positive number of seconds")
+    _check_limit(limit)
+    filters = _archive_filters(source, start, end, start_frame, end_frame, classes, min_conf, accidents)
+    try:
+        return archive.aggregate(source, interval=interval, min_count=min_count, limit=limit, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/archive/{source}")
+def delete_archive(source: str):
+    """
+    Delete everything archived for a source
+    """
+    if not archive.remove(source):
+        raise HTTPException(status_code=404, detail=f"Nothing archived for {source}")
+    return {"message": f"Archive of {archive.source_name(source)} deleted"}
+
+ALLOWED_LIVE_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
+SOURCE_NAME = re.compile(r"[A-Za-z0-9_.-]{1,64}")  # Allowed live source names
+
+async def _upload_chunks(video):
+    while True:
+        chunk = await video.read(cache.HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def _check_live_filename(filename):
+    if not filename:
         raise HTTPException(status_code=400, detail="No filename provided")
-    
+
     # Check file format
-    allowed_extensions = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
-    if not video.filename.lower().endswith(allowed_extensions):
+    if not filename.lower().endswith(ALLOWED_LIVE_EXTENSIONS):
         raise HTTPException(
-            status_code=400, 
-            detail=f"Invalid video format. Supported formats: {', '.join(allowed_extensions)}"
+            status_code=400,
+            detail=f"Invalid video format. Supported formats: {', '.join(ALLOWED_LIVE_EXTENSIONS)}"
         )
-    
+
+async def _save_live_video(chunks, live_video_path):
+    """
+    Write an uploaded video to live_video_path chunk by chunk while a
+    worker thread decodes its first frame. Returns (width, height, upload
+    seconds) once both are done.
+    """
+    started = time.monotonic()
+
+    # Validate from the first decoded frame while the rest is still arriving
+    validation = asyncio.get_running_loop().run_in_executor(None, ingest.probe, live_video_path)
+    try:
+        try:
+            await ingest.receive(chunks, live_video_path)
+        except Exception as e:
+            await asyncio.gather(validation, return_exceptions=True)
+            if os.path.exists(live_video_path):
+                os.remove(live_video_path)
+            raise HTTPException(status_code=500, detail=f"Failed to save video: {str(e)}")
+        upload_seconds = time.monotonic() - started
+
+        try:
+            width, height = await validation
+        except (ValueError, ingest.UploadAborted):
+            os.remove(live_video_path)
+            raise HTTPException(status_code=400, detail="Invalid video file - cannot be opened")
+    finally:
+        ingest.remove_marker(live_video_path)
+    return width, height, upload_seconds
+
+async def _ingest_live_video(chunks, filename):
+    """
+    Save an uploaded live preview video and make it the current live video
+    """
+    global current_live_video
+
+    _check_live_filename(filename)
+
     # Clear previous live video
     with live_video_lock:
         if current_live_video and os.path.exists(current_live_video):
@@ -103,152 +439,70 @@ async def upload_live_video(video: UploadFile = File(...)):
                 os.remove(current_live_video)
             except:
                 pass
-    
+
     # Save the uploaded video to live directory
     timestamp = int(time.time())
-    safe_filename = f"live_{timestamp}_{video.filename}"
+    safe_filename = f"live_{timestamp}_{filename}"
     live_video_path = os.path.join(LIVE_DIR, safe_filename)
-    
-    try:
-        with open(live_video_path, "wb") as f:
-            shutil.copyfileobj(video.file, f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save video: {str(e)}")
-    
-    # Verify video can be opened
-    cap = cv2.VideoCapture(live_video_path)
-    if not cap.isOpened():
-        os.remove(live_video_path)
-        raise HTTPException(status_code=400, detail="Invalid video file - cannot be opened")
-    cap.release()
-    
+    width, height, upload_seconds = await _save_live_video(chunks, live_video_path)
+
     # Update the current live video path thread-safely
     with live_video_lock:
         current_live_video = live_video_path
-    
+
     return {
         "message": "Video uploaded successfully for live preview",
-        "filename": video.filename,
+        "filename": filename,
         "live_preview_url": "/live-preview",
-        "video_path": live_video_path
+        "video_path": live_video_path,
+        "video_info": {"width": width, "height": height},
+        "upload_seconds": round(upload_seconds, 4)
     }
 
-def generate_frames(video_path, stream_id):
+@app.post("/upload-live-video")
+async def upload_live_video(video: UploadFile = File(...)):
     """
-    Generate frames for live detection streaming with proper error handling
+    Upload a video for live detection preview
+    """
+    return await _ingest_live_video(_upload_chunks(video), video.filename)
+
+@app.post("/upload-live-video/stream")
+async def upload_live_video_stream(request: Request, filename: str):
+    """
+    Upload a video for live detection preview as the raw request body,
+    validating it from its first frames while the upload is in progress
+    """
+    return await _ingest_live_video(request.stream(), filename)
+
+def _subscribe(video_path, loop, raw=False, on_demand=True):
+    try:
+        return live.subscribe(video_path, loop, raw, on_demand)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No live source {video_path}")
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+async def generate_frames(source, subscriber, stream_id):
+    """
+    Stream one viewer's share of a live detection broadcast
     """
-    cap = None
     try:
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise Exception(f"Cannot open video file: {video_path}")
-        
-        # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS) or 30
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_delay = 1.0 / fps
-        
-        print(f"Video opened: FPS={fps}, Total frames={total_frames}")
-        
-        frame_count = 0
-        
         while stream_id in active_streams:
-            ret, frame = cap.read()
-            
-            if not ret:
-                # Loop video when it ends
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                frame_count = 0
+            frame_bytes = await subscriber.next_frame(timeout=1.0)
+            if frame_bytes is None:
+                if subscriber.closed:
+                    break
                 continue
-            
-            frame_count += 1
-            
-            # Resize frame if too large (for better performance)
-            height, width = frame.shape[:2]
-            if width > 1280:
-                scale = 1280 / width
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                frame = cv2.resize(frame, (new_width, new_height))
-            
-            # Perform YOLO detection
-            if model is not None:
-                try:
-                    results = model.predict(source=frame, conf=CONF_THRESHOLD, verbose=False)
-                    
-                    if results and len(results) > 0:
-                        result = results[0]
-                        if hasattr(result, 'boxes') and result.boxes is not None:
-                            boxes = result.boxes.xyxy.cpu().numpy()
-                            scores = result.boxes.conf.cpu().numpy()
-                            cls_ids = result.boxes.cls.cpu().numpy().astype(int)
-                            names = result.names
-                            
-                            # Draw detections
-                            for i in range(len(boxes)):
-                                x1, y1, x2, y2 = boxes[i].astype(int)
-                                cls_name = names[cls_ids[i]]
-                                conf = scores[i]
-                                
-                                # Different colors for different classes
-                                colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
-                                color = colors[cls_ids[i] % len(colors)]
-                                
-                                # Draw bounding box
-                                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                                
-                                # Draw label with background
-                                label = f"{cls_name} {conf:.2f}"
-                                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)[0]
-                                cv2.rectangle(frame, (x1, y1 - label_size[1] - 10), 
-                                            (x1 + label_size[0], y1), color, -1)
-                                cv2.putText(frame, label, (x1, y1 - 5),
-                                          cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                
-                except Exception as e:
-                    # If detection fails, show error on frame
-                    cv2.putText(frame, f"Detection Error: {str(e)[:30]}", (10, 30),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            else:
-                # Show message if model is not loaded
-                cv2.putText(frame, "YOLO model not loaded", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            
-            # Add frame counter
-            cv2.putText(frame, f"Frame: {frame_count}/{total_frames}", (10, frame.shape[0] - 10),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Encode frame
-            ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            if ret:
-                frame_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            # Control frame rate
-            time.sleep(frame_delay)
-    
-    except Exception as e:
-        print(f"Error in generate_frames: {e}")
-        # Generate error frame
-        error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-        cv2.putText(error_frame, f"Stream Error: {str(e)[:40]}", (10, 240),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-        ret, buffer = cv2.imencode('.jpg', error_frame)
-        if ret:
-            frame_bytes = buffer.tobytes()
             yield (b'--frame\r\n'
                    b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    
     finally:
-        if cap:
-            cap.release()
+        live.unsubscribe(source, subscriber)
         # Clean up stream
         if stream_id in active_streams:
             del active_streams[stream_id]
 
 @app.get("/live-preview")
-def live_preview():
+async def live_preview():
     """
     Streams live detection preview from uploaded video
     """
@@ -259,32 +513,234 @@ def live_preview():
     
     if not video_path or not os.path.exists(video_path):
         # Return error stream if no video is uploaded
-        def error_stream():
-            error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(error_frame, "No video uploaded", (150, 200),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            cv2.putText(error_frame, "Upload a video first", (140, 250),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            ret, buffer = cv2.imencode('.jpg', error_frame)
-            if ret:
-                frame_bytes = buffer.tobytes()
+        async def error_stream():
+            frame_bytes = live.error_jpeg(
+                ["No video uploaded", "Upload a video first"], [(150, 200), (140, 250)], scale=1
+            )
+            if frame_bytes:
                 while True:
                     yield (b'--frame\r\n'
                            b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                    time.sleep(1)
+                    await asyncio.sleep(1)
         
         return StreamingResponse(
             error_stream(),
             media_type='multipart/x-mixed-replace; boundary=frame'
         )
     
+    source, subscriber = _subscribe(video_path, asyncio.get_running_loop())
+
     # Create unique stream ID
     stream_counter += 1
     stream_id = f"stream_{stream_counter}"
     active_streams[stream_id] = True
     
     return StreamingResponse(
-        generate_frames(video_path, stream_id),
+        generate_frames(source, subscriber, stream_id),
+        media_type='multipart/x-mixed-replace; boundary=frame'
+    )
+
+async def _receive_ws_control(websocket, rate):
+    """
+    Apply a WebSocket viewer's messages until it disconnects:
+    {"type": "ack", "seq": n} once image n has been shown, and
+    {"type": "config", "frames", "max_width", "quality", "max_fps"} to
+    change its limits
+    """
+    while True:
+        try:
+            message = json.loads(await websocket.receive_text())
+        except WebSocketDisconnect:
+            return
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring WebSocket message: {e}")
+            continue
+        try:
+            if message.get("type") == "ack":
+                rate.ack(int(message["seq"]), time.monotonic())
+            elif message.get("type") == "config":
+                rate.configure(message.get("frames", True), message.get("max_width"),
+                               message.get("quality"), message.get("max_fps"))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Ignoring WebSocket message: {e}")
+
+@app.websocket("/ws")
+async def live_websocket(websocket: WebSocket, source: str = None, frames: bool = True, max_width: int = None,
+                         quality: int = None, max_fps: float = None):
+    """
+    Live detection over a WebSocket. Every produced frame is sent as a JSON
+    text message with its boxes, for the client to draw. Unless frames is
+    false, frames also carry the clean image as a binary message right
+    after the JSON (a 4-byte big-endian seq, then the JPEG), at a size and
+    quality adapted to how quickly the client acks them. source names a
+    camera added with POST /sources; without it this streams the uploaded
+    live video.
+    """
+    global stream_counter
+
+    await websocket.accept()
+    if source is not None:
+        video_path = source
+        missing = None
+    else:
+        with live_video_lock:
+            video_path = current_live_video
+        missing = None if video_path and os.path.exists(video_path) else "No video uploaded"
+    loop = asyncio.get_running_loop()
+    if not missing:
+        try:
+            # A named source that has gone away must not turn into a video path
+            live_source, subscriber = live.subscribe(video_path, loop, raw=True, on_demand=source is None)
+        except KeyError:
+            missing = f"No live source {source}"
+        except RuntimeError as e:
+            missing = str(e)
+    if missing:
+        await websocket.send_json({"type": "error", "message": missing})
+        await websocket.close()
+        return
+
+    stream_counter += 1
+    stream_id = f"stream_{stream_counter}"
+    active_streams[stream_id] = True
+    rate = live.StreamRate(frames, max_width, quality, max_fps)
+    receiver = asyncio.create_task(_receive_ws_control(websocket, rate))
+    try:
+        await websocket.send_json({"type": "hello", "video": os.path.basename(live_source.video_path)})
+        while stream_id in active_streams and not receiver.done():
+            packet = await subscriber.next_frame(timeout=1.0)
+            if packet is None:
+                if subscriber.closed:
+                    break
+                continue
+
+            message = packet.payload()
+            image = None
+            if packet.image is not None and rate.want_image(time.monotonic()):
+                width, jpeg_quality = rate.settings()
+                image = await loop.run_in_executor(None, packet.jpeg, width, jpeg_quality)
+                if image:
+                    message["image"] = {"quality": jpeg_quality, "bytes": len(image)}
+
+            text = json.dumps(message, separators=(",", ":"))
+            await websocket.send_text(text)
+            metrics.WS_SENT_BYTES.inc("detections", amount=len(text))
+            if image:
+                rate.sent(packet.seq, time.monotonic())
+                await websocket.send_bytes(struct.pack(">I", packet.seq) + image)
+                metrics.WS_SENT_BYTES.inc("image", amount=len(image) + 4)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        live.unsubscribe(live_source, subscriber)
+        active_streams.pop(stream_id, None)
+
+def _detection_filter(classes, region):
+    try:
+        return roi.parse(classes, region, inference.class_names())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid classes or roi: {e}")
+
+@app.post("/sources")
+async def add_live_source(name: str = Form(...), url: str = Form(None), video: UploadFile = File(None),
+                          classes: str = Form(None), region: str = Form(None, alias="roi")):
+    """
+    Add a named camera: a stream URL (rtsp://, http://...) or an uploaded
+    video file, looped. It runs until deleted, whether or not anyone is
+    watching, sharing live inference fairly with the other sources.
+    classes (comma-separated names, e.g. "car,truck,bus") limits detection
+    to those classes, and roi (a JSON list of [x, y] points as fractions of
+    the frame) to a region of interest: only its bounding rect goes through
+    the model and boxes standing outside it are dropped.
+    """
+    if not SOURCE_NAME.fullmatch(name):
+        raise HTTPException(status_code=400, detail="Source names are 1-64 letters, digits, '.', '_' or '-'")
+    if (url is None) == (video is None):
+        raise HTTPException(status_code=400, detail="Give either a stream url or a video file")
+    if live.get_source(name) is not None:
+        raise HTTPException(status_code=409, detail=f"Live source {name} already exists")
+    detection_filter = _detection_filter(classes, region)
+
+    video_info = None
+    if url is not None:
+        if "://" not in url:
+            raise HTTPException(status_code=400, detail="url must be a stream URL such as rtsp://camera/stream")
+        path = url
+    else:
+        _check_live_filename(video.filename)
+        path = os.path.join(LIVE_DIR, f"source_{name}_{int(time.time())}_{os.path.basename(video.filename)}")
+        width, height, _ = await _save_live_video(_upload_chunks(video), path)
+        video_info = {"width": width, "height": height}
+
+    try:
+        live.add_source(name, path, detection_filter)
+    except (ValueError, RuntimeError) as e:
+        if url is None:
+            os.remove(path)
+        raise HTTPException(status_code=409 if isinstance(e, ValueError) else 429, detail=str(e))
+    return {
+        "message": f"Live source {name} started",
+        "name": name,
+        "preview_url": f"/sources/{name}/preview",
+        "websocket_url": f"/ws?source={name}",
+        "video_info": video_info,
+        "filter": detection_filter.settings() if detection_filter else None,
+    }
+
+@app.put("/sources/{name}/filter")
+def update_live_source_filter(name: str, classes: str = Form(None), region: str = Form(None, alias="roi")):
+    """
+    Replace a source's classes and roi (see POST /sources); leaving both
+    out clears them, so the source detects every class in the whole frame
+    """
+    detection_filter = _detection_filter(classes, region)
+    if live.set_filter(name, detection_filter) is None:
+        raise HTTPException(status_code=404, detail=f"No live source {name}")
+    return {"name": name, "filter": detection_filter.settings() if detection_filter else None}
+
+@app.get("/sources")
+def list_live_sources():
+    """
+    Every live source with its state, viewers, target and achieved fps
+    (over the last few seconds), frames skipped to stay current and its
+    share of live inference
+    """
+    return {
+        "sources": live.stats(),
+        "inference_slots": scheduler.scheduler.slots,
+        "inference_budget_fps": scheduler.scheduler.budget_fps or None,
+    }
+
+@app.delete("/sources/{name}")
+def remove_live_source(name: str):
+    """
+    Stop a named source and disconnect its viewers
+    """
+    source = live.remove_source(name)
+    if source is None:
+        raise HTTPException(status_code=404, detail=f"No live source {name}")
+    # Uploaded videos belong to their source
+    if os.path.dirname(os.path.abspath(source.video_path)) == os.path.abspath(LIVE_DIR):
+        try:
+            os.remove(source.video_path)
+        except OSError as e:
+            print(f"Error removing video file: {e}")
+    return {"message": f"Live source {name} removed"}
+
+@app.get("/sources/{name}/preview")
+async def live_source_preview(name: str):
+    """
+    MJPEG detection preview of a named source
+    """
+    global stream_counter
+    source, subscriber = _subscribe(name, asyncio.get_running_loop(), on_demand=False)
+
+    stream_counter += 1
+    stream_id = f"stream_{stream_counter}"
+    active_streams[stream_id] = True
+    return StreamingResponse(
+        generate_frames(source, subscriber, stream_id),
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
 
@@ -348,20 +804,122 @@ def get_model_status():
     """
     Check if YOLO model is loaded properly
     """
+    info = inference.model_info or {}
     return {
-        "model_loaded": model is not None,
-        "model_type": "YOLOv8s" if model else None,
-        "confidence_threshold": CONF_THRESHOLD
+        "model_loaded": inference.model_loaded(),
+        "model_type": "YOLOv8s" if inference.model_loaded() else None,
+        "backend": info.get("backend"),
+        "model_file": info.get("path"),
+        "input_size": info.get("input_size"),
+        "load_seconds": info.get("load_seconds"),
+        "warmup_latency_ms": info.get("warmup_latency_ms"),
+        "confidence_threshold": inference.CONF_THRESHOLD,
+        "inference": inference.service.stats()
     }
 
+def _process_age():
+    # Seconds since this process started (Linux only)
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _memory_usage():
+    """
+    This worker's memory in MB: rss counts every resident page, pss splits
+    pages shared with other workers (e.g. a preloaded model) between them
+    """
+    try:
+        sizes = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == "kB":
+                    sizes[fields[0].rstrip(":")] = int(fields[1])
+        return {
+            "rss_mb": round(sizes["Rss"] / 1024, 1),
+            "pss_mb": round(sizes["Pss"] / 1024, 1),
+            "shared_mb": round((sizes["Shared_Clean"] + sizes["Shared_Dirty"]) / 1024, 1),
+        }
+    except (OSError, KeyError):
+        import resource
+        return {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+def _live_gauge(field):
+    return lambda: {(os.path.basename(s["name"]),): s[field] for s in live.stats()}
+
+metrics.Gauge("accident_inference_queue_depth", "Frames waiting for the inference service",
+              lambda: inference.service.stats()["queue_depth"])
+metrics.Gauge("accident_jobs_pending", "Queued and running /detect-video jobs", jobs.active_count)
+metrics.Gauge("accident_job_fps", "Frames per second of each running job",
+              lambda: {(job_id,): fps for job_id, fps in jobs.running_fps().items()}, ("job",))
+metrics.Gauge("accident_live_streams", "Open /live-preview connections", lambda: len(active_streams))
+metrics.Gauge("accident_live_subscribers", "Viewers per live source", _live_gauge("subscribers"), ("source",))
+metrics.Gauge("accident_live_fps", "Frames per second achieved per live source", _live_gauge("achieved_fps"), ("source",))
+metrics.Gauge("accident_live_dropped_frames", "Frames skipped by slow viewers of each live source",
+              _live_gauge("frames_dropped"), ("source",))
+metrics.Gauge("accident_live_skipped_frames", "Frames each live source skipped to keep up",
+              _live_gauge("frames_skipped"), ("source",))
+metrics.Gauge("accident_model_loaded", "Whether this process has loaded the model",
+              lambda: int(inference.model_loaded()))
+metrics.Gauge("accident_model_bytes", "Size of the loaded model's weights",
+              lambda: (inference.model_info or {}).get("model_bytes"))
+metrics.Gauge("accident_process_resident_bytes", "Resident memory of this server process",
+              lambda: int(_memory_usage().get("rss_mb", 0) * 1024 * 1024) or None)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Stage latencies, throughput, queue depths and memory in the Prometheus
+    text format
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _live_files_in_use():
+    with live_video_lock:
+        current = [current_live_video] if current_live_video else []
+    return current + [s["video_path"] for s in live.stats()]
+
+# Keeps uploads, outputs, live videos and the archive within their size limits
+retention_thread = retention.RetentionThread([
+    (UPLOAD_DIR, config.UPLOADS_MAX_BYTES, jobs.paths_in_use),
+    (PROCESSED_DIR, config.PROCESSED_MAX_BYTES, jobs.paths_in_use),
+    (LIVE_DIR, config.LIVE_FILES_MAX_BYTES, _live_files_in_use),
+])
+
+@app.on_event("startup")
+def startup_event():
+    """
+    Load the model before serving unless it was preloaded or is lazy
+    """
+    global startup_seconds
+    if config.MODEL_LOAD == "startup":
+        inference.load_model()
+    startup_seconds = _process_age()
+    retention_thread.start()
+    print(f"Server ready in {startup_seconds}s (model load: {config.MODEL_LOAD})")
+
 # Health check endpoint
 @app.get("/health")
 def health_check():
+    info = inference.model_info or {}
     return {
         "status": "healthy", 
         "message": "FastAPI server is running",
-        "model_loaded": model is not None,
-        "active_streams": len(active_streams)
+        "model_loaded": inference.model_loaded(),
+        "model_load": config.MODEL_LOAD,
+        "model_load_seconds": info.get("load_seconds"),
+        "startup_seconds": startup_seconds,
+        "pid": os.getpid(),
+        "memory": _memory_usage(),
+        "active_streams": len(active_streams),
+        "live_sources": live.stats(),
+        "pending_jobs": jobs.active_count(),
+        "cache": cache.stats()
     }
 
 @app.on_event("shutdown")
@@ -371,10 +929,13 @@ def shutdown_event():
     """
     global active_streams
     active_streams.clear()
+    live.shutdown()
+    jobs.shutdown()
+    retention_thread.stop()
     print("Server shutting down, cleaned up resources")
 
 if __name__ == "__main__":
     import uvicorn
     print("Starting FastAPI server...")
-    print(f"YOLO model loaded: {model is not None}")
+    print(f"YOLO model load: {config.MODEL_LOAD}")
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
@@ -0,0 +1,202 @@
+import bisect
+import threading
+
+# Prometheus metrics, served as text at /metrics. Counters and histograms are
+# updated in place by the code being measured; an observation is a bisect and
+# a few additions under a lock, and nothing is formatted until a scrape.
+# Values that already live elsewhere (queue depths, memory, per-stream fps)
+# are gauges read by a callback at scrape time only.
+#
+# Job worker processes have their own copies of these metrics. They send
+# what they've accumulated with take() over the job progress queue, and the
+# server process folds it in with merge(), so /metrics covers both.
+
+# Per-frame stage latencies, from 0.1ms up to 2s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_registry = {}  # name -> metric, in registration order
+_lock = threading.Lock()
+_samples = None  # While sampling: (histogram name, *label values) -> every value observed
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    """
+    Monotonic count, optionally per label values
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        _registry[name] = self
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _take(self):
+        values, self._values = self._values, {}
+        return values
+
+    def _merge(self, values):
+        for key, amount in values.items():
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render(self):
+        return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in self._values.items()]
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        _registry[name] = self
+
+    def observe(self, value, *label_values, count=1):
+        """
+        Record value, count times (e.g. a batch's per-frame time once for
+        each of its frames)
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            state[index] += count
+            state[-1] += value * count
+            if _samples is not None:
+                _samples.setdefault((self.name,) + label_values, []).extend([value] * count)
+
+    def _take(self):
+        values, self._values = self._values, {}
+        return values
+
+    def _merge(self, values):
+        for key, other in values.items():
+            state = self._values.get(key)
+            if state is None:
+                self._values[key] = list(other)
+            else:
+                for i, value in enumerate(other):
+                    state[i] += value
+
+    def _render(self):
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Gauge:
+    """
+    Current value read at scrape time from read(), which returns a number,
+    or a dict of label values tuple -> number, or None to skip it
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, read, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.read = read
+        _registry[name] = self
+
+    def _render(self):
+        try:
+            values = self.read()
+        except Exception as e:
+            print(f"Cannot read metric {self.name}: {e}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values.items() if value is not None]
+
+def start_sampling():
+    """
+    Also keep every histogram observation from now on, for exact
+    percentiles in benchmarks
+    """
+    global _samples
+    with _lock:
+        _samples = {}
+
+def stop_sampling():
+    """
+    Stop sampling and return the observations kept since start_sampling
+    """
+    global _samples
+    with _lock:
+        samples, _samples = _samples or {}, None
+    return samples
+
+def take():
+    """
+    Counter and histogram values accumulated since the last take, reset to
+    zero, for shipping to another process
+    """
+    with _lock:
+        return {name: metric._take() for name, metric in _registry.items() if metric.kind != "gauge"}
+
+def merge(values):
+    with _lock:
+        for name, metric_values in values.items():
+            metric = _registry.get(name)
+            if metric is not None and metric_values:
+                metric._merge(metric_values)
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in list(_registry.values()):
+        if metric.kind == "gauge":
+            samples = metric._render()  # May take other locks; not under ours
+        else:
+            with _lock:
+                samples = metric._render()
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+# Shared by every engine. path is "live", "upload" (run_pipeline) or
+# "sequential" (process_video); stage is one of decode, inference,
+# postprocess, draw, encode.
+STAGE_SECONDS = Histogram(
+    "accident_stage_seconds", "Per-frame time spent in each processing stage", ("path", "stage"))
+FRAMES = Counter("accident_frames_total", "Frames processed", ("path",))
+ACCIDENT_FRAMES = Counter("accident_alert_frames_total", "Frames with at least one sustained overlap", ("path",))
+
+# Inference service (per model call)
+INFERENCE_BATCH_SECONDS = Histogram(
+    "accident_inference_batch_seconds", "Time per inference service batch", ("stage",),
+    buckets=LATENCY_BUCKETS[4:] + (5.0, 10.0))
+INFERENCE_BATCH_SIZE = Histogram(
+    "accident_inference_batch_size", "Frames per model call", buckets=BATCH_SIZE_BUCKETS)
+
+# Jobs
+JOBS = Counter("accident_jobs_total", "Finished /detect-video jobs", ("status",))
+
+# WebSocket live viewers; kind is "detections" (JSON) or "image" (JPEG)
+WS_SENT_BYTES = Counter("accident_ws_sent_bytes_total", "Bytes sent to WebSocket live viewers", ("kind",))
@@ -0,0 +1,55 @@
+import json
+import os
+from . import process_video as pv
+
+# Detection overlay for clients that draw on top of the original video
+# instead of downloading an annotated copy. JSON lines: a header
+#   {"fps": 23.976, "width": 768, "height": 432}
+# then one line per frame that has any vehicles,
+#   {"f": 12, "v": [[x1, y1, x2, y2, "car"], ...], "a": [[x1, y1, x2, y2], ...]}
+# where v are the vehicle boxes drawn green and a the accident boxes drawn
+# red in the annotated video. Coordinates are source pixels.
+
+def overlay_path(video_path):
+    return os.path.splitext(video_path)[0] + ".overlay.jsonl"
+
+class OverlayWriter:
+    """
+    Streams per-frame overlay lines to path
+    """
+    def __init__(self, path, fps, width, height, header=True):
+        self._file = open(path, "w")
+        if header:
+            self._write({"fps": fps, "width": width, "height": height})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def write(self, frame_index, detections, incidents):
+        boxes, _, cls_ids, names = detections
+        vehicles = []
+        accident_boxes = {tuple(box) for incident in incidents for box in incident["boxes"]}
+        for box, cid in zip(boxes, cls_ids):
+            if names[cid] in pv.VEHICLE_CLASSES and tuple(box.round(1).tolist()) not in accident_boxes:
+                vehicles.append([int(v) for v in box] + [names[cid]])
+        accidents = []
+        for incident in incidents:
+            (ax1, ay1, ax2, ay2), (bx1, by1, bx2, by2) = incident["boxes"]
+            accidents.append([int(min(ax1, bx1)), int(min(ay1, by1)), int(max(ax2, bx2)), int(max(ay2, by2))])
+        if vehicles or accidents:
+            self._write({"f": frame_index, "v": vehicles, "a": accidents})
+
+    def close(self):
+        self._file.close()
+
+def concatenate(part_paths, path):
+    """
+    Join segment overlays (the first with a header, the rest without)
+    """
+    with open(path, "w") as out:
+        for part in part_paths:
+            if not os.path.exists(part):
+                continue  # Segment had no frames
+            with open(part) as f:
+                for line in f:
+                    out.write(line)
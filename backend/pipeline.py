@@ -0,0 +1,332 @@
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from . import archive, events, metrics
+from . import process_video as pv
+from .overlay import OverlayWriter
+from .stride import KeyframeInterpolator, StridePlanner
+from .tracker import VehicleTracker
+
+# Three-stage engine for /detect-video:
+#   decoder thread -> inference worker(s) -> annotator/encoder thread
+# Stages hand batches of frames to each other through bounded queues, and a
+# semaphore caps the number of batches alive at once so memory stays flat
+# however far decode runs ahead of inference. Inference workers all feed the
+# shared InferenceService, so more workers means more batches queued for it.
+
+_DONE = object()  # End-of-stream marker passed down the queues
+
+class _StageTimer:
+    """
+    Accumulates busy time per pipeline stage across threads
+    """
+    def __init__(self, stages):
+        self._lock = threading.Lock()
+        self.totals = {stage: 0.0 for stage in stages}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.totals[stage] += seconds
+
+def _put(q, item, stop):
+    # Block until there is room, but give up once another stage has failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def run_pipeline(input_path, output_path, batch_size=pv.BATCH_SIZE, queue_size=4, workers=1,
+                 progress=None, stride=1, adaptive=False, on_frame=None, detections=None,
+                 capture=None, start_frame=0, end_frame=None, warmup=0, codec="mp4v",
+                 write_video=True, scale=1.0, overlay_path=None, overlay_header=True,
+                 archive_source=None, archive_epoch=None):
+    """
+    Detect accidents in a video with decode, inference and annotate/encode
+    running concurrently. queue_size is the number of batches allowed in
+    flight between the decoder and the encoder. progress, if given, is
+    called as progress(frames_done, total_frames) after each batch is
+    written.
+
+    With stride > 1 only keyframes go through YOLO (every stride-th frame, or
+    on motion when adaptive is set) and the boxes of the frames in between
+    are interpolated. on_frame, if given, is called as
+    on_frame(frame_index, detections, confidences) for every frame after the
+    overlap check. Passing detections, a list of per-frame Detections from an
+    earlier run of the same video, skips inference and replays them.
+    capture, if given, is a cv2.VideoCapture-like reader used instead of
+    opening input_path (e.g. an ingest.GrowingVideoReader for an upload that
+    is still arriving).
+
+    start_frame and end_frame restrict the output to one segment of the
+    video. Decoding starts warmup frames earlier so the tracker and overlap
+    counts carry into the segment as they would in a full run; those frames
+    are detected but not written or counted.
+
+    The annotated video is written at the source frame rate with the given
+    fourcc codec, resized by scale. write_video=False skips drawing and
+    encoding altogether. overlay_path, if given, receives the boxes as an
+    overlay.OverlayWriter JSON lines file (without the header line when
+    overlay_header is False). archive_source, if given, is the name the
+    vehicle detections are archived under (see archive), each frame stamped
+    archive_epoch (default now) plus its position in the video; segments of
+    one job pass the same epoch.
+    Returns the same dict as process_video (including the accident events)
+    plus per-stage timings in seconds, including first_frame: the time
+    until the first frame was annotated.
+    """
+    batch_size = max(1, batch_size)
+    queue_size = max(1, queue_size)
+    archive_epoch = time.time() if archive_epoch is None else archive_epoch
+    workers = max(1, workers)
+    planner = StridePlanner(stride, adaptive)
+    replay = detections
+
+    cap = capture if capture is not None else cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise Exception(f"Cannot open video file: {input_path}")
+    if end_frame is None:
+        expected_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - start_frame)
+    else:
+        expected_frames = end_frame - start_frame
+
+    # Start on a stride boundary so keyframes fall where a full run puts
+    # them, and with a stride read on to the keyframe after end_frame so the
+    # segment's last frames are interpolated rather than held
+    decode_from = max(0, start_frame - warmup)
+    decode_from -= decode_from % planner.stride
+    decode_to = None
+    if end_frame is not None:
+        decode_to = end_frame + (-end_frame) % planner.stride + (1 if planner.active else 0)
+    if decode_from:
+        pv._seek(cap, decode_from)
+
+    decoded = queue.Queue(maxsize=queue_size)
+    inferred = queue.Queue(maxsize=queue_size)
+    # Interpolated frames wait in the encoder for the next keyframe, so up to
+    # stride - 1 frames can be held on top of this
+    in_flight = threading.BoundedSemaphore(queue_size)
+    stop = threading.Event()
+    errors = []
+    timer = _StageTimer(("decode", "inference", "annotate", "encode"))
+    summary = {"accident_detected": False, "accident_confidences": [], "total_frames": 0,
+               "first_frame_at": None, "fps": None}
+
+    def fail(exc):
+        errors.append(exc)
+        stop.set()
+
+    def decoder():
+        try:
+            seq = 0
+            first_index = 0
+            while not stop.is_set():
+                if not in_flight.acquire(timeout=0.1):
+                    continue
+                start = time.perf_counter()
+                count = batch_size
+                if decode_to is not None:
+                    count = min(batch_size, decode_to - decode_from - first_index)
+                frames = pv._read_batch(cap, count) if count > 0 else []
+                if summary["fps"] is None and frames:
+                    # Read once the capture is known to be open (a growing
+                    # upload opens lazily); the queue hands it to the encoder
+                    summary["fps"] = cap.get(cv2.CAP_PROP_FPS) or 30
+                if replay is None:
+                    keyframes = [planner.is_keyframe(frame) for frame in frames]
+                else:
+                    keyframes = [False] * len(frames)
+                elapsed = time.perf_counter() - start
+                timer.add("decode", elapsed)
+                if not frames:
+                    in_flight.release()
+                    break
+                metrics.STAGE_SECONDS.observe(elapsed / len(frames), "upload", "decode", count=len(frames))
+                if not _put(decoded, (seq, first_index, frames, keyframes), stop):
+                    return
+                seq += 1
+                first_index += len(frames)
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(workers):
+                _put(decoded, _DONE, stop)
+
+    def inference_worker():
+        try:
+            while True:
+                item = _get(decoded, stop)
+                if item is _DONE:
+                    break
+                seq, first_index, frames, keyframes = item
+                start = time.perf_counter()
+                if replay is not None:
+                    offset = decode_from + first_index
+                    detections = replay[offset:offset + len(frames)]
+                    if len(detections) != len(frames):
+                        raise Exception("Stored detections do not match the video's frame count")
+                else:
+                    found = iter(pv.VEHICLE_FILTER.predict([f for f, key in zip(frames, keyframes) if key]))
+                    detections = [next(found) if key else None for key in keyframes]
+                elapsed = time.perf_counter() - start
+                timer.add("inference", elapsed)
+                metrics.STAGE_SECONDS.observe(elapsed / len(frames), "upload", "inference", count=len(frames))
+                if not _put(inferred, (seq, frames, detections), stop):
+                    return
+        except Exception as e:
+            fail(e)
+        finally:
+            _put(inferred, _DONE, stop)
+
+    def encoder():
+        out = None
+        overlay = None
+        writer = None
+        fourcc = cv2.VideoWriter_fourcc(*codec)
+        tracker = VehicleTracker()
+        timeline = events.EventTimeline()
+        interpolator = KeyframeInterpolator()
+        overlap_counts = dict()
+        pending = {}  # Batches that finished inference ahead of their turn
+        next_seq = 0
+        finished_workers = 0
+        position = decode_from  # Index of the next frame to come out of the interpolator
+        stage_times = {}
+
+        def emit(ready):
+            nonlocal out, overlay, writer, overlap_counts, position
+            for frame, dets in ready:
+                frame_index = position
+                position += 1
+                if end_frame is not None and frame_index >= end_frame:
+                    continue  # Read only to interpolate towards
+                if frame_index < start_frame:
+                    # Warmup: prime the tracker and overlap counts only
+                    overlap_counts, _ = pv.detect_accidents(frame, dets, overlap_counts, tracker, draw=False)
+                    continue
+                summary["total_frames"] += 1
+
+                start = time.perf_counter()
+                incidents = []
+                vehicles = {} if archive_source else None
+                overlap_counts, confidences = pv.detect_accidents(
+                    frame, dets, overlap_counts, tracker, incidents, draw=write_video, stage_times=stage_times,
+                    vehicles=vehicles,
+                )
+                timeline.add(frame_index, incidents)
+                if archive_source:
+                    if writer is None:
+                        writer = archive.ArchiveWriter(archive_source, summary["fps"])
+                    writer.write(frame_index, archive_epoch + frame_index / summary["fps"],
+                                 vehicles["detections"], vehicles["tracks"], vehicles["flags"])
+                if overlay_path:
+                    if overlay is None:
+                        height, width = frame.shape[:2]
+                        overlay = OverlayWriter(overlay_path, summary["fps"], width, height, overlay_header)
+                    overlay.write(frame_index, dets, incidents)
+                elapsed = time.perf_counter() - start
+                timer.add("annotate", elapsed)
+                metrics.STAGE_SECONDS.observe(elapsed - stage_times["draw"], "upload", "postprocess")
+                metrics.STAGE_SECONDS.observe(stage_times["draw"], "upload", "draw")
+                metrics.FRAMES.inc("upload")
+                if summary["first_frame_at"] is None:
+                    summary["first_frame_at"] = time.perf_counter()
+                if confidences:
+                    metrics.ACCIDENT_FRAMES.inc("upload")
+                    summary["accident_detected"] = True
+                    summary["accident_confidences"].extend(confidences)
+                if on_frame:
+                    on_frame(frame_index, dets, confidences)
+
+                if not write_video:
+                    continue
+                start = time.perf_counter()
+                if scale != 1.0:
+                    height, width = frame.shape[:2]
+                    frame = cv2.resize(frame, (round(width * scale), round(height * scale)),
+                                       interpolation=cv2.INTER_AREA)
+                if out is None:
+                    height, width = frame.shape[:2]
+                    out = cv2.VideoWriter(output_path, fourcc, summary["fps"], (width, height))
+                    if not out.isOpened():
+                        raise Exception(f"Cannot write {codec} video to {output_path}")
+                out.write(frame)
+                elapsed = time.perf_counter() - start
+                timer.add("encode", elapsed)
+                metrics.STAGE_SECONDS.observe(elapsed, "upload", "encode")
+
+        try:
+            while finished_workers < workers:
+                item = _get(inferred, stop)
+                if item is _DONE:
+                    if stop.is_set():
+                        return
+                    finished_workers += 1
+                    continue
+                seq, frames, detections = item
+                pending[seq] = (frames, detections)
+
+                while next_seq in pending:
+                    frames, detections = pending.pop(next_seq)
+                    for frame, dets in zip(frames, detections):
+                        emit(interpolator.push(frame, dets))
+                    next_seq += 1
+                    in_flight.release()
+                    if progress:
+                        progress(summary["total_frames"], expected_frames)
+            emit(interpolator.flush())
+            summary["timeline"] = timeline
+        except Exception as e:
+            fail(e)
+        finally:
+            if out: out.release()
+            if overlay: overlay.close()
+            if writer: writer.close()
+
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=decoder, name="pipeline-decode", daemon=True)]
+    threads += [
+        threading.Thread(target=inference_worker, name=f"pipeline-infer-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    threads.append(threading.Thread(target=encoder, name="pipeline-encode", daemon=True))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fps = summary["fps"] or cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    wall = time.perf_counter() - wall_start
+
+    if errors:
+        raise errors[0]
+
+    confidences = summary["accident_confidences"]
+    total_frames = summary["total_frames"]
+    timings = {stage: round(seconds, 4) for stage, seconds in timer.totals.items()}
+    timings["wall"] = round(wall, 4)
+    timings["fps"] = round(total_frames / wall, 2) if wall > 0 else 0.0
+    if summary["first_frame_at"] is not None:
+        timings["first_frame"] = round(summary["first_frame_at"] - wall_start, 4)
+
+    return {
+        "accident_detected": summary["accident_detected"],
+        "confidence": float(np.mean(confidences)) if confidences else 0.0,
+        "total_frames": total_frames,
+        "inferred_frames": planner.keyframes,
+        "timings": timings,
+        "fps": fps,
+        "events": summary["timeline"].finish(fps)
+    }
@@ -0,0 +1,137 @@
+import cv2
+import numpy as np
+
+# Inference-resolution preprocessing, shared by every caller of the inference
+# service (live preview, the upload pipeline and process_video). YOLO
+# letterboxes its input down to the model size anyway, so a 4K frame is
+# downscaled once here, into a buffer reused from batch to batch, and run at
+# that size; the boxes are then scaled back so callers only ever see source
+# pixel coordinates.
+
+MODEL_STRIDE = 32  # YOLO input sizes are rounded up to a multiple of this
+
+def model_size(size):
+    """
+    The inference size YOLO will actually use for a requested size
+    """
+    return max(MODEL_STRIDE, -(-int(size) // MODEL_STRIDE) * MODEL_STRIDE)
+
+def target_size(width, height, size):
+    """
+    (width, height) of a frame downscaled so its longest side fits size.
+    Frames already small enough are left alone.
+    """
+    scale = model_size(size) / max(width, height)
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def scale_detections(detections, fx, fy=None):
+    """
+    Detections with their boxes multiplied by fx horizontally and fy
+    (default fx) vertically
+    """
+    fy = fx if fy is None else fy
+    if fx == 1.0 and fy == 1.0:
+        return detections
+    factors = np.array([fx, fy, fx, fy], dtype=np.float32)
+    return detections._replace(boxes=detections.boxes * factors)
+
+class FrameResizer:
+    """
+    Downscales batches of equally sized frames to the inference size into
+    preallocated buffers, one per output shape, grown to the largest batch
+    seen. The returned frames are views into the buffer and are overwritten
+    by the next call, so a FrameResizer belongs to one thread.
+    """
+    def __init__(self):
+        self._buffers = {}  # (height, width, *channels) -> (batch, height, width, *channels) uint8
+
+    def resize(self, frames, size):
+        """
+        Return the frames at inference size and the (fx, fy) factors that
+        map boxes on them back to the originals
+        """
+        height, width = frames[0].shape[:2]
+        new_width, new_height = target_size(width, height, size)
+        if (new_width, new_height) == (width, height):
+            return frames, (1.0, 1.0)
+
+        shape = (new_height, new_width) + frames[0].shape[2:]
+        buffer = self._buffers.get(shape)
+        if buffer is None or len(buffer) < len(frames):
+            buffer = np.empty((len(frames),) + shape, dtype=np.uint8)
+            self._buffers[shape] = buffer
+        resized = []
+        for frame, slot in zip(frames, buffer):
+            # Bilinear like YOLO's own letterbox; INTER_AREA is 5-15x slower
+            cv2.resize(frame, (new_width, new_height), dst=slot, interpolation=cv2.INTER_LINEAR)
+            resized.append(slot)
+        return resized, (width / new_width, height / new_height)
+
+def _match_counts(reference, detections, iou=0.5):
+    # Boxes of detections that pair up with a reference box of the same class
+    from .tracker import greedy_match, iou_matrix
+    if len(reference.boxes) == 0 or len(detections.boxes) == 0:
+        return 0
+    ious = iou_matrix(reference.boxes, detections.boxes)
+    same_class = reference.cls_ids[:, None] == detections.cls_ids[None, :]
+    return len(greedy_match(ious, (ious >= iou) & same_class, descending=True))
+
+def compare_sizes(video_path, sizes, max_frames=200, batch_size=16):
+    """
+    Run the first max_frames frames of a video at each inference size and
+    report throughput plus how well each size's boxes agree with the
+    largest size's (matched at IoU 0.5 with the same class)
+    """
+    import time
+    from . import inference
+    from .process_video import _read_batch
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frames = _read_batch(cap, max_frames)
+    finally:
+        cap.release()
+    if not frames:
+        raise ValueError(f"Cannot read frames from {video_path}")
+
+    sizes = sorted({model_size(size) for size in sizes}, reverse=True)
+    runs = {}
+    for size in sizes:
+        inference.predict(frames[:1], size=size)  # Warm up this input shape
+        start = time.perf_counter()
+        detections = []
+        for i in range(0, len(frames), batch_size):
+            detections.extend(inference.predict(frames[i:i + batch_size], size=size))
+        runs[size] = (time.perf_counter() - start, detections)
+
+    reference = runs[sizes[0]][1]
+    reference_boxes = sum(len(d.boxes) for d in reference)
+    report = []
+    for size in sizes:
+        seconds, detections = runs[size]
+        boxes = sum(len(d.boxes) for d in detections)
+        matched = sum(_match_counts(r, d) for r, d in zip(reference, detections))
+        report.append({
+            "size": size,
+            "fps": round(len(frames) / seconds, 2),
+            "boxes": boxes,
+            "recall": round(matched / reference_boxes, 4) if reference_boxes else 1.0,
+            "precision": round(matched / boxes, 4) if boxes else 1.0,
+        })
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare detection speed and agreement across inference sizes")
+    parser.add_argument("video_path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1280, 960, 640, 480, 320])
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{len(args.sizes)} sizes, recall/precision against the largest")
+    for row in compare_sizes(args.video_path, args.sizes, args.frames):
+        print(f"{row['size']:>5}px  {row['fps']:>7.2f} fps  {row['boxes']:>6} boxes  "
+              f"recall {row['recall']:.3f}  precision {row['precision']:.3f}")
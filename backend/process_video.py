@@ -1,14 +1,26 @@
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
 
-model = YOLO("yolov8s.pt")
-CONF_THRESHOLD = 0.3
+if not __package__:
+    # Run as a script (python backend/process_video.py) rather than with
+    # python -m backend.process_video: import the rest of backend as a package
+    import os
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "backend"
+
+from . import archive, events, metrics, roi
+from .inference import Detections
+from .tracker import VehicleTracker
+
 IOU_THRESHOLD = 0.4  # Slightly higher to reduce false positives
 SUSTAINED_FRAMES = 3  # Number of consecutive frames overlap must persist
+BATCH_SIZE = 16  # Frames per model.predict call
 
 # List of vehicle class names as per your model (adjust as needed)
 VEHICLE_CLASSES = {"car", "truck", "bus", "motorcycle", "bicycle", "van"}
+VEHICLE_FILTER = roi.DetectionFilter(VEHICLE_CLASSES)  # The model only looks for these
 
 def compute_iou(boxA, boxB):
     xA = max(boxA[0], boxB[0])
@@ -22,84 +34,269 @@ def compute_iou(boxA, boxB):
     boxBArea = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
     return interArea / float(boxAArea + boxBArea - interArea + 1e-6)
 
-def process_video(input_path, output_path):
+def paired_iou(boxesA, boxesB):
+    """
+    Element-wise IoU of two equally long (N, 4) arrays of xyxy boxes, using
+    the same arithmetic as compute_iou
+    """
+    xA = np.maximum(boxesA[:, 0], boxesB[:, 0])
+    yA = np.maximum(boxesA[:, 1], boxesB[:, 1])
+    xB = np.minimum(boxesA[:, 2], boxesB[:, 2])
+    yB = np.minimum(boxesA[:, 3], boxesB[:, 3])
+    interW = np.maximum(0, xB - xA)
+    interH = np.maximum(0, yB - yA)
+    interArea = interW * interH
+    boxAArea = (boxesA[:, 2] - boxesA[:, 0]) * (boxesA[:, 3] - boxesA[:, 1])
+    boxBArea = (boxesB[:, 2] - boxesB[:, 0]) * (boxesB[:, 3] - boxesB[:, 1])
+    return interArea / (boxAArea + boxBArea - interArea + 1e-6)
+
+def candidate_pairs(boxes):
+    """
+    Sort-and-sweep along x: return index arrays (i, j), i < j, of the box
+    pairs whose x and y extents intersect. Every other pair has zero IoU.
+    """
+    n = len(boxes)
+    if n < 2:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    order = np.argsort(boxes[:, 0], kind="stable")
+    x1 = boxes[order, 0]
+    x2 = boxes[order, 2]
+    # Boxes after position k in x1 order overlap it in x until x1 reaches its x2
+    ends = np.searchsorted(x1, x2, side="left")
+    counts = np.maximum(ends - np.arange(1, n + 1), 0)
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+
+    first = np.repeat(np.arange(n), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    a = order[first]
+    b = order[first + 1 + offsets]
+    i = np.minimum(a, b)
+    j = np.maximum(a, b)
+
+    overlap_y = np.minimum(boxes[i, 3], boxes[j, 3]) > np.maximum(boxes[i, 1], boxes[j, 1])
+    return i[overlap_y], j[overlap_y]
+
+def overlapping_pairs(boxes, threshold=IOU_THRESHOLD):
+    """
+    Return (i, j) index arrays of the box pairs with IoU above threshold,
+    ordered as the nested i < j loop would visit them
+    """
+    i, j = candidate_pairs(boxes)
+    if len(i):
+        keep = paired_iou(boxes[i], boxes[j]) > threshold
+        i, j = i[keep], j[keep]
+        order = np.lexsort((j, i))
+        i, j = i[order], j[order]
+    return i, j
+
+def _read_batch(cap, batch_size):
+    """
+    Read up to batch_size frames from an open capture
+    """
+    frames = []
+    while len(frames) < batch_size:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    return frames
+
+def _seek(cap, index):
+    """
+    Position an open capture so the next read returns frame index
+    """
+    cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != index:
+        # Backend can't seek exactly here; decode forward from the start
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        for _ in range(index):
+            if not cap.grab():
+                break
+
+def detect_accidents(frame, detections, overlap_counts, tracker, incidents=None, draw=True, stage_times=None,
+                     vehicles=None):
+    """
+    Run the sustained vehicle overlap check on one frame's Detections and
+    draw the boxes onto the frame. Overlaps are counted per pair of tracked
+    vehicles, so tracker must be the same VehicleTracker for every frame of
+    a video. Returns the overlap counts to carry into the next frame and the
+    confidences of the accident pairs found. If incidents is a list, each
+    accident pair is also appended to it with its track ids, boxes, class
+    names and confidence. draw=False skips the drawing, for callers that
+    don't keep the frame. If stage_times is a dict, the seconds spent on
+    the overlap check and on drawing are stored in its "postprocess" and
+    "draw" entries. If vehicles is a dict, the frame's vehicle Detections
+    are stored in it as "detections", with their track ids under "tracks"
+    and archive flags (accident pair or not) under "flags".
+    """
+    start = time.perf_counter()
+    boxes, scores, cls_ids, names = detections
+
+    # Only keep vehicle detections (inference already drops the other
+    # classes; stored detections from before that may still have them)
+    vehicle_ids = [cid for cid, name in names.items() if name in VEHICLE_CLASSES]
+    vehicle_indices = np.flatnonzero(np.isin(cls_ids, vehicle_ids))
+    vehicle_boxes = boxes[vehicle_indices]
+    vehicle_scores = scores[vehicle_indices]
+    vehicle_cls_ids = cls_ids[vehicle_indices].tolist()
+
+    track_ids = tracker.update(vehicle_boxes)
+
+    # Find sustained overlaps
+    used = set()
+    new_overlaps = dict()
+    confidences = []
+    accident_pairs = {}  # key: i, value: [j, ...] in visiting order
+    for i, j in zip(*overlapping_pairs(vehicle_boxes)):
+        i, j = int(i), int(j)
+        key = tuple(sorted((int(track_ids[i]), int(track_ids[j]))))
+        count = overlap_counts.get(key, 0) + 1
+        new_overlaps[key] = count
+        if count >= SUSTAINED_FRAMES:
+            accident_pairs.setdefault(i, []).append(j)
+            used.add(i)
+            used.add(j)
+            confidences.append(max(vehicle_scores[i], vehicle_scores[j]))
+            if incidents is not None:
+                incidents.append({
+                    "tracks": key,
+                    "boxes": [vehicle_boxes[i].round(1).tolist(), vehicle_boxes[j].round(1).tolist()],
+                    "classes": [names[vehicle_cls_ids[i]], names[vehicle_cls_ids[j]]],
+                    "confidence": float(confidences[-1]),
+                })
+
+    if vehicles is not None:
+        flags = np.zeros(len(vehicle_boxes), dtype=np.uint8)
+        flags[list(used)] = archive.FLAG_ACCIDENT
+        vehicles["detections"] = Detections(vehicle_boxes, vehicle_scores, cls_ids[vehicle_indices], names)
+        vehicles["tracks"] = track_ids
+        vehicles["flags"] = flags
+
+    if stage_times is not None:
+        drawn_at = time.perf_counter()
+        stage_times["postprocess"] = drawn_at - start
+        stage_times["draw"] = 0.0
+    if not draw:
+        return new_overlaps, confidences
+
+    # Draw boxes
+    for i in range(len(vehicle_boxes)):
+        for j in accident_pairs.get(i, ()):
+            x1 = min(vehicle_boxes[i][0], vehicle_boxes[j][0])
+            y1 = min(vehicle_boxes[i][1], vehicle_boxes[j][1])
+            x2 = max(vehicle_boxes[i][2], vehicle_boxes[j][2])
+            y2 = max(vehicle_boxes[i][3], vehicle_boxes[j][3])
+            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0,0,255), 2)
+            cv2.putText(frame, "Accident", (int(x1), int(y1)-10), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
+        # Draw non-accident vehicle boxes
+        if i not in used:
+            x1, y1, x2, y2 = vehicle_boxes[i].astype(int)
+            cls_name = names[vehicle_cls_ids[i]]
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
+            cv2.putText(frame, cls_name, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
+
+    if stage_times is not None:
+        stage_times["draw"] = time.perf_counter() - drawn_at
+    return new_overlaps, confidences
+
+def process_video(input_path, output_path, batch_size=BATCH_SIZE, archive_source=None):
+    """
+    Detect accidents in a video and write the annotated copy to output_path.
+    Frames are sent to YOLO batch_size at a time; batch_size=1 is the old
+    one-call-per-frame behaviour. archive_source, if given, is the name the
+    vehicle detections are archived under, timed from now at the video's
+    frame rate.
+    """
     cap = cv2.VideoCapture(input_path)
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     out = None
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
 
     accident_detected = False
     accident_confidences = []
     total_frames = 0
 
     # For sustained overlap
-    overlap_counts = dict()  # key: (i, j), value: count
+    tracker = VehicleTracker()
+    overlap_counts = dict()  # key: (track_id, track_id), value: count
+    timeline = events.EventTimeline()
+
+    stage_times = {}
+    writer = archive.ArchiveWriter(archive_source, fps) if archive_source else None
+    epoch = time.time()
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        start = time.perf_counter()
+        frames = _read_batch(cap, max(1, batch_size))
+        if not frames:
             break
-        total_frames += 1
-
-        results = model.predict(source=frame, conf=CONF_THRESHOLD, verbose=False)
-        dets = results[0].boxes
-        names = results[0].names
-        boxes = dets.xyxy.cpu().numpy()
-        scores = dets.conf.cpu().numpy()
-        cls_ids = dets.cls.cpu().numpy().astype(int)
-
-        # Only keep vehicle detections
-        vehicle_indices = [i for i, cid in enumerate(cls_ids) if names[cid] in VEHICLE_CLASSES]
-        vehicle_boxes = boxes[vehicle_indices]
-        vehicle_scores = scores[vehicle_indices]
-        vehicle_cls_ids = [cls_ids[i] for i in vehicle_indices]
-
-        # Draw boxes
-        used = set()
-        new_overlaps = dict()
-        for i in range(len(vehicle_boxes)):
-            for j in range(i+1, len(vehicle_boxes)):
-                # Only check between different vehicles
-                if i == j:
-                    continue
-                iou = compute_iou(vehicle_boxes[i], vehicle_boxes[j])
-                if iou > IOU_THRESHOLD:
-                    key = (i, j)
-                    count = overlap_counts.get(key, 0) + 1
-                    new_overlaps[key] = count
-                    if count >= SUSTAINED_FRAMES:
-                        x1 = min(vehicle_boxes[i][0], vehicle_boxes[j][0])
-                        y1 = min(vehicle_boxes[i][1], vehicle_boxes[j][1])
-                        x2 = max(vehicle_boxes[i][2], vehicle_boxes[j][2])
-                        y2 = max(vehicle_boxes[i][3], vehicle_boxes[j][3])
-                        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0,0,255), 2)
-                        cv2.putText(frame, "Accident", (int(x1), int(y1)-10), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
-                        used.add(i)
-                        used.add(j)
-                        accident_detected = True
-                        accident_confidences.append(max(vehicle_scores[i], vehicle_scores[j]))
-            # Draw non-accident vehicle boxes
-            if i not in used:
-                x1, y1, x2, y2 = vehicle_boxes[i].astype(int)
-                cls_name = names[vehicle_cls_ids[i]]
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
-                cv2.putText(frame, cls_name, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
-
-        # Update overlap counts for next frame
-        overlap_counts = new_overlaps
-
-        if out is None:
-            height, width = frame.shape[:2]
-            out = cv2.VideoWriter(output_path, fourcc, 20.0, (width, height))
-
-        out.write(frame)
+        decoded = time.perf_counter()
+
+        detections = VEHICLE_FILTER.predict(frames)
+        inferred = time.perf_counter()
+        metrics.STAGE_SECONDS.observe((decoded - start) / len(frames), "sequential", "decode", count=len(frames))
+        metrics.STAGE_SECONDS.observe((inferred - decoded) / len(frames), "sequential", "inference", count=len(frames))
+
+        # Overlap state depends on the previous frame, so keep frame order
+        for frame, dets in zip(frames, detections):
+            total_frames += 1
+
+            incidents = []
+            vehicles = {} if writer else None
+            overlap_counts, confidences = detect_accidents(frame, dets, overlap_counts, tracker, incidents,
+                                                           stage_times=stage_times, vehicles=vehicles)
+            timeline.add(total_frames - 1, incidents)
+            if writer:
+                writer.write(total_frames - 1, epoch + (total_frames - 1) / fps, vehicles["detections"],
+                             vehicles["tracks"], vehicles["flags"])
+            if confidences:
+                accident_detected = True
+                accident_confidences.extend(confidences)
+
+            start = time.perf_counter()
+            if out is None:
+                height, width = frame.shape[:2]
+                out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+            out.write(frame)
+            metrics.STAGE_SECONDS.observe(stage_times["postprocess"], "sequential", "postprocess")
+            metrics.STAGE_SECONDS.observe(stage_times["draw"], "sequential", "draw")
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "sequential", "encode")
+            metrics.FRAMES.inc("sequential")
 
     cap.release()
     if out: out.release()
+    if writer: writer.close()
 
     confidence = float(np.mean(accident_confidences)) if accident_confidences else 0.0
 
     return {
         "accident_detected": accident_detected,
         "confidence": confidence,
-        "total_frames": total_frames
+        "total_frames": total_frames,
+        "fps": fps,
+        "events": timeline.finish(fps)
     }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run accident detection on a video file")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--archive", help="Archive the detections under this source name")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = process_video(args.input_path, args.output_path, batch_size=args.batch_size,
+                           archive_source=args.archive)
+    elapsed = time.perf_counter() - start
+    print(dict(result, events=events.summarize(result["events"])))
+    print(f"{result['total_frames']} frames in {elapsed:.2f}s "
+          f"({result['total_frames'] / elapsed:.1f} fps, batch size {args.batch_size})")
@@ -0,0 +1,111 @@
+import os
+import shutil
+import threading
+import time
+from . import archive, config
+
+# Size limits for the directories that otherwise only grow: uploaded videos,
+# annotated outputs, live preview videos and the detection archive. Now that
+# every detection is archived, an old video is no longer the only way to
+# answer questions about it, so once a directory is over its limit the
+# oldest entries go. Files that belong together (processed_x.mp4 with its
+# .overlay.jsonl and .events directory) share the name before their first
+# dot and are deleted together. Hidden files (uploads still arriving) and
+# anything modified within RETENTION_MIN_AGE_SECONDS are never touched, and
+# callers can name paths that are in use, which keeps their whole group
+# (a running job's output protects its part files before it exists itself).
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+def _group(name):
+    return name.split(".", 1)[0]
+
+def _groups(directory):
+    # name before the first dot -> [newest mtime, bytes, paths]
+    groups = {}
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return groups
+    for name in names:
+        if name.startswith("."):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            size, modified = _size(path), os.path.getmtime(path)
+        except OSError:
+            continue  # Deleted meanwhile
+        group = groups.setdefault(_group(name), [0.0, 0, []])
+        group[0] = max(group[0], modified)
+        group[1] += size
+        group[2].append(path)
+    return groups
+
+def enforce(directory, max_bytes, min_age=None, keep=()):
+    """
+    Delete the oldest groups of files in directory until it fits in
+    max_bytes, leaving alone any group younger than min_age seconds or
+    that a path in keep belongs to. Returns the bytes freed.
+    """
+    min_age = config.RETENTION_MIN_AGE_SECONDS if min_age is None else min_age
+    directory = os.path.abspath(directory)
+    keep = {_group(os.path.basename(path)) for path in keep
+            if path and os.path.dirname(os.path.abspath(path)) == directory}
+    groups = sorted((modified, size, paths, name) for name, (modified, size, paths) in _groups(directory).items())
+    total = sum(size for _, size, _, _ in groups)
+    freed = 0
+    now = time.time()
+    for modified, size, paths, name in groups:
+        if total <= max_bytes:
+            break
+        if now - modified < min_age or name in keep:
+            continue
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        total -= size
+        freed += size
+    if freed:
+        print(f"Retention: freed {freed / 1024 ** 2:.1f}MB in {directory}")
+    return freed
+
+class RetentionThread:
+    """
+    Enforces the limits every RETENTION_INTERVAL_SECONDS. limits is a list
+    of (directory, max_bytes, in_use) where in_use, if not None, returns
+    the paths to keep.
+    """
+    def __init__(self, limits, interval=None):
+        self.limits = limits
+        self.interval = config.RETENTION_INTERVAL_SECONDS if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        for directory, max_bytes, in_use in self.limits:
+            enforce(directory, max_bytes, keep=in_use() if in_use else ())
+        archive.evict()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Retention error: {e}")
+            if self._stop.wait(self.interval):
+                break
@@ -0,0 +1,139 @@
+import json
+import threading
+import numpy as np
+from . import inference
+from .inference import CONF_THRESHOLD, Detections
+
+# What a source looks for and where. A DetectionFilter names the classes to
+# detect, which are handed to the model so it drops the others before NMS
+# rather than the caller filtering them afterwards, and optionally a polygon
+# region of interest for fixed cameras. Only the polygon's bounding rect is
+# cut out of the frame and sent to inference, so sky, buildings and
+# sidewalks outside it cost nothing; boxes whose ground point (bottom centre)
+# falls outside the polygon itself are then dropped with a vectorized
+# point-in-polygon test. Polygon points are [x, y] fractions of the frame's
+# width and height, so one region fits any resolution of the same camera.
+
+MIN_ROI_PIXELS = 32  # Smallest side of the crop sent to inference
+
+def points_in_polygon(points, polygon):
+    """
+    Whether each of points (N, 2) lies inside polygon (K, 2), by counting
+    the polygon edges a ray to the right of each point crosses
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    spans = (y1 > y) != (y2 > y)  # (N, K): edge straddles the point's row
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(spans & (x < crossing), axis=1) % 2 == 1
+
+class DetectionFilter:
+    """
+    Target classes (None for all) and an optional ROI polygon for a source
+    """
+    def __init__(self, classes=None, polygon=None):
+        self.classes = frozenset(classes) if classes is not None else None
+        if self.classes is not None and not self.classes:
+            raise ValueError("classes must name at least one class")
+        self.polygon = None
+        if polygon is not None:
+            polygon = np.asarray(polygon, dtype=np.float64)
+            if polygon.ndim != 2 or polygon.shape[1] != 2 or len(polygon) < 3:
+                raise ValueError("roi must be a list of at least three [x, y] points")
+            if not np.isfinite(polygon).all() or polygon.min() < 0 or polygon.max() > 1:
+                raise ValueError("roi points must be fractions of the frame between 0 and 1")
+            self.polygon = polygon
+        self._regions = {}  # (height, width) -> (crop rect, polygon in pixels)
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.classes is not None or self.polygon is not None
+
+    def settings(self):
+        return {
+            "classes": sorted(self.classes) if self.classes is not None else None,
+            "roi": self.polygon.tolist() if self.polygon is not None else None,
+        }
+
+    def region(self, width, height):
+        """
+        The crop rect (x0, y0, x1, y1) and pixel polygon for a frame size
+        """
+        with self._lock:
+            region = self._regions.get((height, width))
+            if region is None:
+                pixels = self.polygon * (width, height)
+                x0, y0 = np.floor(pixels.min(axis=0)).astype(int)
+                x1, y1 = np.ceil(pixels.max(axis=0)).astype(int)
+                # Too thin a crop can't hold a vehicle; widen it around its centre
+                if x1 - x0 < MIN_ROI_PIXELS:
+                    x0 = max(0, min(width - MIN_ROI_PIXELS, (x0 + x1 - MIN_ROI_PIXELS) // 2))
+                    x1 = min(width, x0 + MIN_ROI_PIXELS)
+                if y1 - y0 < MIN_ROI_PIXELS:
+                    y0 = max(0, min(height - MIN_ROI_PIXELS, (y0 + y1 - MIN_ROI_PIXELS) // 2))
+                    y1 = min(height, y0 + MIN_ROI_PIXELS)
+                region = self._regions[(height, width)] = ((int(x0), int(y0), int(x1), int(y1)), pixels)
+            return region
+
+    def inside(self, detections, width, height):
+        """
+        detections without the boxes whose bottom centre is outside the ROI
+        """
+        if self.polygon is None or not len(detections.boxes):
+            return detections
+        _, pixels = self.region(width, height)
+        boxes = detections.boxes
+        ground = np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]])
+        keep = points_in_polygon(ground, pixels)
+        return Detections(boxes[keep], detections.scores[keep], detections.cls_ids[keep], detections.names)
+
+    def predict(self, frames, conf=CONF_THRESHOLD, size=None):
+        """
+        inference.predict for frames, restricted to the classes and ROI
+        """
+        if self.polygon is None:
+            return inference.predict(frames, conf, size, classes=self.classes)
+
+        crops, rects = [], []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            rect, _ = self.region(width, height)
+            x0, y0, x1, y1 = rect
+            crops.append(frame[y0:y1, x0:x1])
+            rects.append(rect)
+        found = inference.predict(crops, conf, size, classes=self.classes)
+
+        results = []
+        for frame, (x0, y0, _, _), dets in zip(frames, rects, found):
+            boxes = dets.boxes + np.array([x0, y0, x0, y0], dtype=dets.boxes.dtype)
+            height, width = frame.shape[:2]
+            results.append(self.inside(Detections(boxes, dets.scores, dets.cls_ids, dets.names), width, height))
+        return results
+
+def parse(classes=None, roi=None, known=None):
+    """
+    A DetectionFilter from request fields: classes as a comma-separated
+    string or a list of names, roi as a JSON string or a list of [x, y]
+    fractions. Returns None when neither is set; raises ValueError if they
+    are malformed or a class isn't one of the names in known (when given).
+    """
+    if isinstance(classes, str):
+        classes = [name.strip() for name in classes.split(",") if name.strip()] or None
+    if isinstance(roi, str):
+        roi = json.loads(roi) if roi.strip() else None
+    if classes is not None and (not isinstance(classes, list) or not all(isinstance(c, str) for c in classes)):
+        raise ValueError("classes must be a list of class names")
+    if classes is not None and known is not None:
+        unknown = sorted(set(classes) - set(known))
+        if unknown:
+            raise ValueError(f"unknown classes {', '.join(unknown)}; the model detects {', '.join(sorted(known))}")
+    if classes is None and roi is None:
+        return None
+    try:
+        return DetectionFilter(classes, roi)
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e)) from None
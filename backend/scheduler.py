@@ -0,0 +1,110 @@
+import itertools
+import threading
+import time
+from . import config, inference
+
+# Fair admission of live frames to the inference service. Each live source
+# thread asks for one frame at a time, so a source never has more than one
+# frame waiting. At most `slots` frames are inside the inference service at
+# once; when a slot frees up it goes to the waiting source that has been
+# served least, ties in arrival order. Under capacity every frame is admitted
+# straight away. Over it, each source's inferred fps falls to its fair share
+# (sources asking for less than that keep their full rate) and the sources
+# skip ahead past the frames that went stale meanwhile, instead of every
+# stream lagging further and further behind. budget_fps optionally caps the
+# node's total live inference rate, leaving the rest of the model to jobs.
+# State is keyed by the source object rather than its name: a removed
+# source's thread may still be leaving when a new one takes the name.
+
+class FrameScheduler:
+    """
+    Shares live inference fairly between sources
+    """
+    def __init__(self, slots=None, budget_fps=0):
+        self.slots = max(1, slots or config.INFERENCE_MAX_BATCH)
+        self.budget_fps = budget_fps
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._arrivals = itertools.count()
+        self._waiting = {}  # source -> arrival number
+        self._served = {}  # source -> frames admitted, never behind _clock while waiting
+        self._clock = 0  # served count of the source admitted last
+        self._next_grant = 0.0  # Earliest monotonic time of the next admission under budget_fps
+        self._stats = {}  # source -> {"inferred", "wait_seconds"}
+
+    def _register(self, source):
+        if source not in self._served:
+            self._served[source] = self._clock
+            self._stats[source] = {"inferred": 0, "wait_seconds": 0.0}
+
+    def join(self, source):
+        with self._cond:
+            self._register(source)
+
+    def leave(self, source):
+        with self._cond:
+            self._served.pop(source, None)
+            self._stats.pop(source, None)
+            self._waiting.pop(source, None)
+            self._cond.notify_all()
+
+    def _turn(self):
+        # The waiting source to admit next
+        return min(self._waiting, key=lambda source: (self._served[source], self._waiting[source]))
+
+    def _acquire(self, source):
+        with self._cond:
+            self._register(source)
+            # An idle source doesn't bank credit to crowd the others out later
+            self._served[source] = max(self._served[source], self._clock)
+            self._waiting[source] = next(self._arrivals)
+            while True:
+                delay = self._next_grant - time.monotonic() if self.budget_fps else 0.0
+                if self._busy < self.slots and self._turn() == source and delay <= 0:
+                    break
+                self._cond.wait(delay if delay > 0 else None)
+            del self._waiting[source]
+            self._busy += 1
+            self._clock = self._served[source]
+            self._served[source] += 1
+            if self.budget_fps:
+                self._next_grant = max(self._next_grant, time.monotonic()) + 1.0 / self.budget_fps
+            self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._busy -= 1
+            self._cond.notify_all()
+
+    def infer(self, source, frame, detection_filter=None):
+        """
+        Detections for one frame of source, once it's its turn, limited
+        by the source's roi.DetectionFilter if it has one
+        """
+        start = time.perf_counter()
+        self._acquire(source)
+        waited = time.perf_counter() - start
+        try:
+            if detection_filter is not None:
+                return detection_filter.predict([frame])[0]
+            return inference.predict([frame])[0]
+        finally:
+            self._release()
+            with self._cond:
+                stats = self._stats.get(source)
+                if stats is not None:
+                    stats["inferred"] += 1
+                    stats["wait_seconds"] += waited
+
+    def stats(self, source):
+        with self._cond:
+            stats = self._stats.get(source)
+            if stats is None:
+                return {"inferred": 0, "mean_wait_ms": None}
+            inferred = stats["inferred"]
+            return {
+                "inferred": inferred,
+                "mean_wait_ms": round(1000 * stats["wait_seconds"] / inferred, 2) if inferred else None,
+            }
+
+scheduler = FrameScheduler(config.LIVE_INFERENCE_SLOTS, config.LIVE_INFERENCE_FPS)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+import cv2
+import numpy as np
+from . import events
+from . import process_video as pv
+
+# Parallel segment mode for long /detect-video uploads. The video is cut into
+# contiguous frame ranges that job workers process at the same time, each
+# with its own model, and the annotated pieces are joined back into one
+# output. Each segment starts decoding SEGMENT_WARMUP frames early so
+# tracks and sustained-overlap counts carry across the cut.
+#
+# With an ffmpeg binary on the PATH the segments are written as usual and
+# joined by stream copy, with no re-encode. Without one they are written
+# losslessly and re-encoded once by OpenCV, so either way the output has
+# been through the lossy codec only once, as in a single-pass run.
+
+SEGMENT_WARMUP = 2 * pv.SUSTAINED_FRAMES  # Frames detected before a segment's start
+MIN_SEGMENT_FRAMES = 64  # Shortest segment worth a worker of its own
+FFMPEG = shutil.which("ffmpeg")
+LOSSLESS_CODEC = "FFV1"  # For segment files that will be re-encoded
+
+def count_frames(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    finally:
+        cap.release()
+
+def plan_segments(total_frames, segments, stride=1):
+    """
+    Split total_frames into at most segments contiguous (start, end) ranges
+    of about equal length, cut on stride boundaries. The last range ends at
+    None, i.e. wherever the stream does, since container frame counts are
+    not always exact.
+    """
+    stride = max(1, stride)
+    n = max(1, min(segments, total_frames // MIN_SEGMENT_FRAMES))
+    bounds = []
+    for k in range(n):
+        start = total_frames * k // n
+        start -= start % stride
+        if not bounds or start > bounds[-1]:
+            bounds.append(start)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+def segment_path(output_path, part):
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.part{part}{ext if FFMPEG else '.mkv'}"
+
+def part_codec(codec):
+    """
+    Codec to write segment files in when the output should use codec
+    """
+    return codec if FFMPEG else LOSSLESS_CODEC
+
+def _concat_copy(paths, output_path):
+    list_path = output_path + ".concat.txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        subprocess.run(
+            [FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+             "-i", list_path, "-c", "copy", output_path],
+            check=True, capture_output=True,
+        )
+    finally:
+        os.remove(list_path)
+
+def merge_videos(paths, output_path, fps, codec="mp4v"):
+    """
+    Concatenate the annotated segment videos into output_path
+    """
+    if FFMPEG:
+        try:
+            _concat_copy(paths, output_path)
+            return
+        except subprocess.CalledProcessError as e:
+            print(f"ffmpeg concat failed, re-encoding instead: {e.stderr.decode(errors='replace')[:200]}")
+
+    out = None
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    try:
+        for path in paths:
+            cap = cv2.VideoCapture(path)
+            try:
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    if out is None:
+                        height, width = frame.shape[:2]
+                        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+                    out.write(frame)
+            finally:
+                cap.release()
+    finally:
+        if out: out.release()
+
+def merge_results(results, confidences):
+    """
+    Combine per-segment run_pipeline results into one in the same shape.
+    confidences is the flat list of accident confidences from all segments.
+    """
+    timings = {}
+    for result in results:
+        for stage, seconds in result["timings"].items():
+            if stage not in ("fps", "first_frame"):
+                timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+    # Segments run side by side, so the slowest one is the wall time
+    wall = max(result["timings"]["wall"] for result in results)
+    total_frames = sum(result["total_frames"] for result in results)
+    timings["wall"] = round(wall, 4)
+    timings["fps"] = round(total_frames / wall, 2) if wall > 0 else 0.0
+    if "first_frame" in results[0]["timings"]:
+        timings["first_frame"] = results[0]["timings"]["first_frame"]
+
+    fps = results[0]["fps"]
+    return {
+        "accident_detected": any(result["accident_detected"] for result in results),
+        "confidence": float(np.mean(confidences)) if confidences else 0.0,
+        "total_frames": total_frames,
+        "inferred_frames": sum(result["inferred_frames"] for result in results),
+        "timings": timings,
+        "fps": fps,
+        "events": events.merge_segments([result["events"] for result in results], fps),
+        "segments": len(results)
+    }
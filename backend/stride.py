@@ -0,0 +1,107 @@
+import cv2
+import numpy as np
+from .inference import Detections
+from .tracker import greedy_match, iou_matrix
+
+# Frame skipping. StridePlanner picks the keyframes that go through YOLO,
+# either every Nth frame or, in adaptive mode, whenever a cheap thumbnail
+# difference says the scene has moved enough since the last keyframe. Frames
+# in between get their boxes from KeyframeInterpolator, so the overlap check
+# still sees every frame.
+
+MOTION_THUMBNAIL = (64, 36)  # Size of the grayscale thumbnail used for motion scores
+MOTION_THRESHOLD = 6.0  # Mean absolute thumbnail difference (0-255) that forces a keyframe
+INTERPOLATE_MIN_IOU = 0.1  # Keyframe boxes must overlap this much to be interpolated
+
+def motion_thumbnail(frame):
+    small = cv2.resize(frame, MOTION_THUMBNAIL, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+class StridePlanner:
+    """
+    Decides which frames need a fresh detection. stride is the fixed spacing
+    of keyframes, or the longest allowed gap in adaptive mode.
+    """
+    def __init__(self, stride=1, adaptive=False, motion_threshold=MOTION_THRESHOLD):
+        self.stride = max(1, stride)
+        self.adaptive = adaptive
+        self.motion_threshold = motion_threshold
+        self._since_keyframe = None
+        self._keyframe_thumb = None
+        self.keyframes = 0
+
+    @property
+    def active(self):
+        return self.stride > 1
+
+    def is_keyframe(self, frame):
+        if self._since_keyframe is None or self._since_keyframe + 1 >= self.stride:
+            keyframe = True
+        elif self.adaptive:
+            thumb = motion_thumbnail(frame)
+            keyframe = float(np.abs(thumb - self._keyframe_thumb).mean()) > self.motion_threshold
+        else:
+            keyframe = False
+
+        if keyframe:
+            self._since_keyframe = 0
+            self.keyframes += 1
+            if self.adaptive:
+                self._keyframe_thumb = motion_thumbnail(frame)
+        else:
+            self._since_keyframe += 1
+        return keyframe
+
+def interpolate_detections(before, after, t):
+    """
+    Detections a fraction t of the way from keyframe before to keyframe
+    after. Boxes matched by IoU and class are blended linearly; boxes only
+    seen in before are held in place.
+    """
+    if len(before.boxes) == 0:
+        return before
+    boxes = before.boxes.copy()
+    scores = before.scores.copy()
+    if len(after.boxes):
+        ious = iou_matrix(before.boxes, after.boxes)
+        same_class = before.cls_ids[:, None] == after.cls_ids[None, :]
+        for i, j in greedy_match(ious, same_class & (ious > INTERPOLATE_MIN_IOU), descending=True):
+            boxes[i] = (1 - t) * before.boxes[i] + t * after.boxes[j]
+            scores[i] = (1 - t) * before.scores[i] + t * after.scores[j]
+    return Detections(boxes, scores, before.cls_ids, before.names)
+
+class KeyframeInterpolator:
+    """
+    Fills in detections for skipped frames. Push frames in order with their
+    Detections, or None if they were skipped; get back the (frame,
+    detections) pairs that are ready. With hold=True skipped frames reuse
+    the last keyframe immediately, otherwise they wait for the next keyframe
+    and are interpolated between the two.
+    """
+    def __init__(self, hold=False):
+        self.hold = hold
+        self._last = None
+        self._gap = []
+
+    def push(self, frame, detections):
+        if detections is None:
+            if self.hold:
+                return [(frame, self._last)]
+            self._gap.append(frame)
+            return []
+
+        ready = []
+        if self._gap:
+            steps = len(self._gap) + 1
+            for k, gap_frame in enumerate(self._gap, start=1):
+                ready.append((gap_frame, interpolate_detections(self._last, detections, k / steps)))
+            self._gap = []
+        ready.append((frame, detections))
+        self._last = detections
+        return ready
+
+    def flush(self):
+        # Nothing comes after the last keyframe, so hold it
+        ready = [(frame, self._last) for frame in self._gap]
+        self._gap = []
+        return ready
@@ -0,0 +1,79 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from backend import archive
+from backend.inference import Detections
+
+NAMES = {2: "car", 7: "truck"}
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    return tmp_path / "archive"
+
+def detections(count, cls=2):
+    boxes = np.tile(np.array([[10, 20, 110, 120]], dtype=np.float32), (count, 1))
+    return Detections(boxes, np.full(count, 0.5, dtype=np.float32), np.full(count, cls), NAMES)
+
+def write_frames(writer, first, count, per_frame=4, start_time=1000.0):
+    for frame in range(first, first + count):
+        writer.write(frame, start_time + frame / 10, detections(per_frame))
+    writer.flush()
+
+def test_query_and_aggregate_round_trip():
+    writer = archive.ArchiveWriter("cam", fps=10)
+    write_frames(writer, 0, 50)
+    writer.write(50, 1005.0, detections(2, cls=7))
+    writer.close()
+
+    rows, matched = archive.query("cam", start_frame=10, end_frame=20, limit=5)
+    assert matched == 40
+    assert [row["frame"] for row in rows] == [10, 10, 10, 10, 11]
+    assert archive.query("cam", classes={"truck"})[1] == 2
+
+    summary = archive.aggregate("cam", interval=1.0, min_count=4, limit=3)
+    assert summary["detections"] == 202
+    assert summary["classes"]["truck"]["detections"] == 2
+    assert sum(bucket["detections"] for bucket in summary["timeline"]) == 202
+    assert len(summary["dense_frames"]) == 3
+
+def test_aggregate_rejects_too_many_buckets():
+    writer = archive.ArchiveWriter("cam")
+    write_frames(writer, 0, 20)
+    writer.close()
+    with pytest.raises(ValueError):
+        archive.aggregate("cam", interval=1e-6)
+
+def test_evict_leaves_open_writer_alone():
+    old = archive.ArchiveWriter("old")
+    write_frames(old, 0, 20, start_time=100.0)
+    old.close()
+    live = archive.ArchiveWriter("live")
+    write_frames(live, 0, 20, start_time=200.0)
+
+    # Over any limit: everything that isn't open goes, however old
+    os.utime(live._part, (0, 0))
+    assert archive.evict(max_bytes=0) == 1
+    assert not archive.exists("old")
+    assert os.path.isdir(live._part)
+
+    write_frames(live, 20, 5, start_time=200.0)
+    live.close()
+    assert archive.query("live")[1] == 25 * 4
+    assert archive.evict(max_bytes=0) == 1
+    assert not archive.parts("live")
+
+def test_writer_recovers_when_its_part_is_deleted():
+    writer = archive.ArchiveWriter("cam")
+    write_frames(writer, 0, 10)
+    first_part = writer._part
+    shutil.rmtree(first_part)
+
+    write_frames(writer, 10, 10)
+    writer.close()
+    assert writer._part is None
+    parts = archive.parts("cam")
+    assert len(parts) == 1 and parts[0].path != first_part
+    rows, matched = archive.query("cam")
+    assert matched == 40 and rows[0]["frame"] == 10
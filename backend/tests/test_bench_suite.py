@@ -0,0 +1,45 @@
+import copy
+from backend.benchmarks import bench_suite
+
+def scenario(fps=100.0, p95=0.010, rss=500, accident=True):
+    return {
+        "name": "clip.mp4",
+        "engine": "run_pipeline",
+        "fps": fps,
+        "stages": {"inference": {"p50": 0.008, "p95": p95}},
+        "peak_rss_mb": rss,
+        "result": {"accident_detected": accident, "confidence": 0.9, "total_frames": 300, "events": []},
+    }
+
+BASELINE = {"scenarios": [scenario()]}
+
+def test_same_run_has_no_regressions():
+    assert bench_suite.compare([scenario()], BASELINE) == []
+
+def test_changes_within_tolerance_pass():
+    assert bench_suite.compare([scenario(fps=90.0, p95=0.0112, rss=560)], BASELINE, tolerance=0.15) == []
+
+def test_slower_fps():
+    [line] = bench_suite.compare([scenario(fps=80.0)], BASELINE, tolerance=0.15)
+    assert "80.0 fps, was 100.0" in line
+
+def test_slower_p95():
+    [line] = bench_suite.compare([scenario(p95=0.020)], BASELINE, tolerance=0.15)
+    assert "inference p95 20.00ms, was 10.00ms" in line
+
+def test_tiny_p95_change_is_noise():
+    baseline = {"scenarios": [scenario(p95=0.0001)]}
+    assert bench_suite.compare([scenario(p95=0.0003)], baseline, tolerance=0.15) == []
+
+def test_more_memory():
+    [line] = bench_suite.compare([scenario(rss=700)], BASELINE, tolerance=0.15)
+    assert "peak RSS 700MB, was 500MB" in line
+
+def test_result_change():
+    [line] = bench_suite.compare([scenario(accident=False)], BASELINE)
+    assert "accident result changed" in line
+
+def test_scenarios_missing_from_the_baseline_are_skipped():
+    new = copy.deepcopy(scenario(fps=1.0))
+    new["name"] = "other.mp4"
+    assert bench_suite.compare([new], BASELINE) == []
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from backend import inference
+
+NAMES = {0: "person", 2: "car"}
+
+class Tensor:
+    def __init__(self, values):
+        self.values = np.asarray(values)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+class Boxes:
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.xyxy, self.conf, self.cls = Tensor(rows[:, :4]), Tensor(rows[:, 4]), Tensor(rows[:, 5])
+
+class Result:
+    def __init__(self, rows):
+        self.boxes = Boxes(rows)
+        self.names = NAMES
+
+class FakeModel:
+    """
+    One car per frame; frames whose top-left pixel is 255 make predict
+    raise, and fail_results makes a result unreadable
+    """
+    names = NAMES
+
+    def __init__(self):
+        self.fail_results = False
+
+    def predict(self, source, conf, imgsz, classes, verbose):
+        if any(frame[0, 0, 0] == 255 for frame in source):
+            raise RuntimeError("bad frame")
+        if self.fail_results:
+            return [object() for _ in source]
+        return [Result([[1, 2, 3, 4, 0.9, 2]]) for _ in source]
+
+@pytest.fixture
+def service():
+    return inference.InferenceService(FakeModel(), max_batch=8, max_wait=0.001, size=64)
+
+def frame(value=0):
+    return np.full((48, 64, 3), value, dtype=np.uint8)
+
+def test_predict_returns_detections(service):
+    dets = service.predict([frame(), frame()])
+    assert [len(d.boxes) for d in dets] == [1, 1]
+    assert dets[0].names == NAMES
+
+def test_model_error_fails_its_frames_only(service):
+    with pytest.raises(RuntimeError, match="bad frame"):
+        service.predict([frame(255)])
+    assert len(service.predict([frame()])[0].boxes) == 1
+
+def test_error_outside_the_model_call_keeps_the_scheduler_alive(service):
+    service.model.fail_results = True
+    with pytest.raises(AttributeError):
+        service.submit(frame()).result(timeout=5)
+    service.model.fail_results = False
+    assert len(service.submit(frame()).result(timeout=5).boxes) == 1
+    assert service._thread.is_alive()
+
+def test_error_serving_a_batch_fails_its_futures(service, monkeypatch):
+    def broken(batch):
+        raise ValueError("broken batch")
+    monkeypatch.setattr(service, "_serve", broken)
+    with pytest.raises(ValueError, match="broken batch"):
+        service.submit(frame()).result(timeout=5)
+    monkeypatch.undo()
+    assert len(service.submit(frame()).result(timeout=5).boxes) == 1
+
+def test_unknown_classes_give_empty_detections(service):
+    dets = service.predict([frame()], classes={"truck"})
+    assert len(dets[0].boxes) == 0
@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from backend import config, jobs, segments
+from backend.overlay import overlay_path
+
+class FakePool:
+    """
+    Records submitted tasks and hands back Futures the test resolves
+    """
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        if self.broken:
+            raise BrokenProcessPool("worker died")
+        future = Future()
+        self.tasks.append((fn, args, future))
+        return future
+
+@pytest.fixture
+def pools(monkeypatch):
+    created = []
+
+    def ensure_executor():
+        if not created or created[-1] is None:
+            created.append(FakePool())
+        return created[-1]
+
+    def shutdown():
+        created.append(None)
+
+    monkeypatch.setattr(jobs, "_ensure_executor", ensure_executor)
+    monkeypatch.setattr(jobs, "shutdown", shutdown)
+    monkeypatch.setattr(jobs, "_plan_segments",
+                        lambda path, key, stride, count: ([(i, i + 1) for i in range(count)], count)
+                        if count > 1 else (None, None))
+    monkeypatch.setattr(config, "MAX_PENDING_JOBS", 8)
+    monkeypatch.setattr(jobs, "_jobs", {})
+    return created
+
+def test_failed_segment_cleans_up_once_all_are_done(tmp_path, pools):
+    output = str(tmp_path / "processed_x.mp4")
+    job_id = jobs.submit("upload.mp4", output, ("det", "res"), segments=3)
+    tasks = pools[-1].tasks
+    parts = [segments.segment_path(output, part) for part in range(3)]
+    for path in parts + [overlay_path(p) for p in parts]:
+        open(path, "w").close()
+
+    tasks[0][2].set_running_or_notify_cancel()
+    tasks[1][2].set_running_or_notify_cancel()
+    tasks[0][2].set_exception(RuntimeError("segment failed"))
+    assert jobs.get_job(job_id)["status"] == "failed"
+    assert tasks[2][2].cancelled()
+    # Segment 1 is still running and writing its part
+    assert os.path.exists(parts[1])
+
+    tasks[1][2].set_result(({}, [], []))
+    assert os.listdir(tmp_path) == []
+    assert all(fn is jobs._run_segment for fn, _, _ in pools[-1].tasks)
+
+def test_segments_replace_a_broken_pool(tmp_path, pools):
+    pools.append(FakePool(broken=True))
+    job_id = jobs.submit("upload.mp4", str(tmp_path / "processed_y.mp4"), ("det", "res"), segments=2)
+    assert pools[-1] is not None and len(pools[-1].tasks) == 2
+    assert jobs.get_job(job_id)["status"] == "queued"
+
+def test_split_job_counts_each_segment(tmp_path, pools):
+    jobs.submit("a.mp4", str(tmp_path / "a.mp4"), ("det-a", "res-a"), segments=6)
+    with pytest.raises(jobs.JobQueueFull):
+        jobs.submit("b.mp4", str(tmp_path / "b.mp4"), ("det-b", "res-b"), segments=3)
+    jobs.submit("c.mp4", str(tmp_path / "c.mp4"), ("det-c", "res-c"), segments=2)
+    assert not jobs.has_capacity()
+    assert jobs.active_count() == 2
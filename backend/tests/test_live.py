@@ -0,0 +1,17 @@
+import pytest
+from backend import live
+
+class BrokenWriter:
+    def write(self, *args):
+        raise FileNotFoundError("part gone")
+
+def test_archive_failure_is_not_a_detection_error():
+    source = live.LiveSource("clip.mp4", archive_detections=True)
+    source._archive(BrokenWriter(), 0, None)
+    assert source.archive_error == "part gone"
+    assert source.error is None
+
+def test_named_subscription_does_not_create_a_source():
+    with pytest.raises(KeyError):
+        live.subscribe("removed-camera", None, on_demand=False)
+    assert live.get_source("removed-camera") is None
@@ -0,0 +1,29 @@
+import os
+import time
+from backend import retention
+
+def make(path, size=1000, age=5000):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (time.time() - age,) * 2)
+
+def test_deletes_oldest_groups_together(tmp_path):
+    make(tmp_path / "a.mp4", age=9000)
+    make(tmp_path / "a.overlay.jsonl", age=9000)
+    make(tmp_path / "b.mp4", age=8000)
+    make(tmp_path / ".upload-x.part", age=9999)
+    assert retention.enforce(str(tmp_path), 1500) == 2000
+    assert sorted(os.listdir(tmp_path)) == [".upload-x.part", "b.mp4"]
+
+def test_keeps_young_files(tmp_path):
+    make(tmp_path / "a.mp4", age=10)
+    assert retention.enforce(str(tmp_path), 0, min_age=3600) == 0
+
+def test_keep_protects_the_whole_group(tmp_path):
+    # A running split job: its output doesn't exist yet, its parts do
+    make(tmp_path / "processed_x.part0.mkv")
+    make(tmp_path / "processed_x.part0.overlay.jsonl")
+    make(tmp_path / "processed_y.mp4")
+    keep = [str(tmp_path / "processed_x.mp4"), str(tmp_path / "elsewhere" / "processed_y.mp4"), None]
+    retention.enforce(str(tmp_path), 0, keep=keep)
+    assert sorted(os.listdir(tmp_path)) == ["processed_x.part0.mkv", "processed_x.part0.overlay.jsonl"]
@@ -0,0 +1,61 @@
+import threading
+import time
+import pytest
+from backend import scheduler as scheduler_module
+from backend.scheduler import FrameScheduler
+
+class Source:
+    def __init__(self, name):
+        self.name = name
+
+@pytest.fixture
+def model(monkeypatch):
+    """
+    Frames reach the fake model in this order; the first blocks until released
+    """
+    seen = []
+    release = threading.Event()
+
+    def predict(frames, *args, **kwargs):
+        seen.append(frames[0])
+        if len(seen) == 1:
+            release.wait(5)
+        return [frames[0]]
+
+    monkeypatch.setattr(scheduler_module.inference, "predict", predict)
+    return seen, release
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_least_served_source_goes_first(model):
+    order, release = model
+    frames = FrameScheduler(slots=1)
+    a, b = Source("a"), Source("b")
+    threads = [threading.Thread(target=frames.infer, args=(a, "a1"))]
+    threads[0].start()
+    wait_for(lambda: order == ["a1"])
+    # a asks again before b does, but b hasn't been served yet
+    for source, frame in ((a, "a2"), (b, "b1")):
+        threads.append(threading.Thread(target=frames.infer, args=(source, frame)))
+        threads[-1].start()
+        wait_for(lambda: source in frames._waiting)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["a1", "b1", "a2"]
+    assert frames.stats(a)["inferred"] == 2
+
+def test_leaving_source_does_not_clear_its_replacement(model):
+    _, release = model
+    release.set()
+    frames = FrameScheduler(slots=1)
+    old, new = Source("cam"), Source("cam")
+    frames.join(old)
+    frames.join(new)
+    frames.leave(old)  # The removed source's thread exits after the new one started
+    assert frames.infer(new, "frame") == "frame"
+    assert frames.stats(new)["inferred"] == 1
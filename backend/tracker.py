@@ -0,0 +1,148 @@
+import numpy as np
+
+# Lightweight multi-object tracker for vehicle boxes. Detections are matched to
+# existing tracks by IoU against each track's motion-predicted box, with a
+# centroid-distance fallback for fast movers, so a vehicle keeps its id from
+# frame to frame. Track state lives in parallel NumPy arrays holding only the
+# active tracks; a track is dropped after max_misses frames without a match.
+
+TRACK_IOU_THRESHOLD = 0.3  # Minimum IoU to continue a track
+TRACK_MAX_MISSES = 10  # Frames a track survives without a detection
+TRACK_MAX_CENTER_SHIFT = 0.5  # Centroid fallback gate, as a fraction of box size
+VELOCITY_SMOOTHING = 0.5  # Weight of the newest displacement in the velocity
+
+def iou_matrix(boxesA, boxesB):
+    """
+    IoU of every box in boxesA (M, 4) against every box in boxesB (N, 4)
+    """
+    xA = np.maximum(boxesA[:, None, 0], boxesB[None, :, 0])
+    yA = np.maximum(boxesA[:, None, 1], boxesB[None, :, 1])
+    xB = np.minimum(boxesA[:, None, 2], boxesB[None, :, 2])
+    yB = np.minimum(boxesA[:, None, 3], boxesB[None, :, 3])
+    interArea = np.maximum(0, xB - xA) * np.maximum(0, yB - yA)
+    boxAArea = (boxesA[:, 2] - boxesA[:, 0]) * (boxesA[:, 3] - boxesA[:, 1])
+    boxBArea = (boxesB[:, 2] - boxesB[:, 0]) * (boxesB[:, 3] - boxesB[:, 1])
+    return interArea / (boxAArea[:, None] + boxBArea[None, :] - interArea + 1e-6)
+
+def _centers(boxes):
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+def greedy_match(scores, valid, descending):
+    """
+    Pair rows with columns best score first, each used at most once.
+    Only cells where valid is True are considered.
+    """
+    rows, cols = np.nonzero(valid)
+    if len(rows) == 0:
+        return []
+    values = scores[rows, cols]
+    order = np.argsort(-values if descending else values, kind="stable")
+    used_rows, used_cols = set(), set()
+    matches = []
+    for k in order:
+        r, c = int(rows[k]), int(cols[k])
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        matches.append((r, c))
+    return matches
+
+class VehicleTracker:
+    """
+    Assigns stable ids to vehicle boxes across frames
+    """
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_misses=TRACK_MAX_MISSES,
+                 max_center_shift=TRACK_MAX_CENTER_SHIFT):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.max_center_shift = max_center_shift
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)  # Last matched box
+        self.velocities = np.empty((0, 2), dtype=np.float32)  # Center shift in px/frame
+        self.misses = np.empty(0, dtype=np.int32)  # Frames since last match
+        self.hits = np.empty(0, dtype=np.int32)  # Frames matched so far
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _predicted_boxes(self):
+        shift = self.velocities * (self.misses + 1)[:, None]
+        return self.boxes + np.concatenate([shift, shift], axis=1)
+
+    def _associate(self, boxes):
+        n_tracks, n_dets = len(self.ids), len(boxes)
+        if n_tracks == 0 or n_dets == 0:
+            return []
+
+        predicted = self._predicted_boxes()
+        ious = iou_matrix(predicted, boxes)
+        matches = greedy_match(ious, ious > self.iou_threshold, descending=True)
+
+        # Centroid fallback for what IoU left unmatched
+        free_tracks = np.setdiff1d(np.arange(n_tracks), [t for t, _ in matches])
+        free_dets = np.setdiff1d(np.arange(n_dets), [d for _, d in matches])
+        if len(free_tracks) and len(free_dets):
+            track_centers = _centers(predicted[free_tracks])
+            det_centers = _centers(boxes[free_dets])
+            dist = np.linalg.norm(track_centers[:, None, :] - det_centers[None, :, :], axis=2)
+            sizes = np.maximum(predicted[free_tracks, 2] - predicted[free_tracks, 0],
+                               predicted[free_tracks, 3] - predicted[free_tracks, 1])
+            gate = dist < (self.max_center_shift * sizes)[:, None]
+            for r, c in greedy_match(dist, gate, descending=False):
+                matches.append((int(free_tracks[r]), int(free_dets[c])))
+        return matches
+
+    def update(self, boxes):
+        """
+        Match this frame's (N, 4) xyxy boxes to tracks and return their ids,
+        one per box
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        matches = self._associate(boxes)
+        det_ids = np.zeros(len(boxes), dtype=np.int64)
+
+        matched = np.zeros(len(self.ids), dtype=bool)
+        if matches:
+            t = np.array([m[0] for m in matches])
+            d = np.array([m[1] for m in matches])
+            step = (_centers(boxes[d]) - _centers(self.boxes[t])) / (self.misses[t] + 1)[:, None]
+            first = (self.hits[t] == 1)[:, None]
+            smoothed = VELOCITY_SMOOTHING * step + (1 - VELOCITY_SMOOTHING) * self.velocities[t]
+            self.velocities[t] = np.where(first, step, smoothed)
+            self.boxes[t] = boxes[d]
+            self.misses[t] = 0
+            self.hits[t] += 1
+            matched[t] = True
+            det_ids[d] = self.ids[t]
+
+        # Age unmatched tracks and forget the stale ones
+        self.misses[~matched] += 1
+        keep = self.misses <= self.max_misses
+
+        # Start tracks for unmatched detections
+        new = np.ones(len(boxes), dtype=bool)
+        if matches:
+            new[d] = False
+        n_new = int(new.sum())
+        new_ids = np.arange(self._next_id, self._next_id + n_new, dtype=np.int64)
+        self._next_id += n_new
+        det_ids[new] = new_ids
+
+        self.ids = np.concatenate([self.ids[keep], new_ids])
+        self.boxes = np.concatenate([self.boxes[keep], boxes[new]])
+        self.velocities = np.concatenate([self.velocities[keep], np.zeros((n_new, 2), dtype=np.float32)])
+        self.misses = np.concatenate([self.misses[keep], np.zeros(n_new, dtype=np.int32)])
+        self.hits = np.concatenate([self.hits[keep], np.ones(n_new, dtype=np.int32)])
+        return det_ids
+
+    def velocity(self, track_id):
+        """
+        Center velocity (dx, dy) in pixels per frame, or None for an unknown id
+        """
+        index = np.flatnonzero(self.ids == track_id)
+        if len(index) == 0:
+            return None
+        vx, vy = self.velocities[index[0]]
+        return float(vx), float(vy)
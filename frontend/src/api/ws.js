@@ -1,12 +1,36 @@
 let socket;
 
-export const connectWebSocket = (onMessage) => {
-  socket = new WebSocket("ws://localhost:5000/ws");
-  socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+// Live detection stream from the backend's /ws. Each frame arrives as a JSON
+// message with its boxes ([x1, y1, x2, y2, class, confidence] in the pixels
+// of `size`); when it has `image`, the next binary message is that frame as
+// a JPEG behind a 4-byte big-endian seq. Acknowledging each image lets the
+// server adapt its frame rate and quality to this client.
+export const connectWebSocket = (onMessage, onFrame, options = {}) => {
+  const params = new URLSearchParams(options).toString();
+  socket = new WebSocket(`ws://localhost:8000/ws${params ? `?${params}` : ""}`);
+  socket.binaryType = "arraybuffer";
+  socket.onmessage = (event) => {
+    if (typeof event.data === "string") {
+      onMessage(JSON.parse(event.data));
+      return;
+    }
+    const seq = new DataView(event.data).getUint32(0);
+    const image = new Blob([event.data.slice(4)], { type: "image/jpeg" });
+    if (onFrame) onFrame(seq, image);
+  };
+  return socket;
 };
 
-export const sendFrame = (blob) => {
+// Call once an image has been drawn
+export const ackFrame = (seq) => {
   if (socket && socket.readyState === WebSocket.OPEN) {
-    blob.arrayBuffer().then((buffer) => socket.send(buffer));
+    socket.send(JSON.stringify({ type: "ack", seq }));
+  }
+};
+
+// Change the client's limits: { frames, max_width, quality, max_fps }
+export const configureStream = (settings) => {
+  if (socket && socket.readyState === WebSocket.OPEN) {
+    socket.send(JSON.stringify({ type: "config", ...settings }));
   }
 };
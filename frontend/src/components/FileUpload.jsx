@@ -115,20 +115,21 @@ const CombinedDetection = () => {
     if (fileInputRef.current) fileInputRef.current.value = "";
   };
 
-  const simulateFrameProgress = (totalFrameCount) => {
-    setTotalFrames(totalFrameCount);
-    setProcessedFrames(0);
-    const progressInterval = setInterval(() => {
-      setProcessedFrames((prev) => {
-        const newCount = prev + Math.floor(Math.random() * 5) + 1;
-        if (newCount >= totalFrameCount) {
-          clearInterval(progressInterval);
-          return totalFrameCount;
-        }
-        return newCount;
-      });
-    }, 100);
-    return progressInterval;
+  const pollDetectionJob = async (statusUrl) => {
+    while (true) {
+      const response = await fetch(`http://localhost:8000${statusUrl}`);
+      if (!response.ok)
+        throw new Error(`HTTP error! status: ${response.status}`);
+      const job = await response.json();
+      if (job.progress?.total_frames) {
+        setTotalFrames(job.progress.total_frames);
+        setProcessedFrames(job.progress.frames_done);
+      }
+      if (job.status === "done") return job.result;
+      if (job.status === "failed")
+        throw new Error(job.error || "Video processing failed");
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
   };
 
   const handleFiles = (files) => {
@@ -207,10 +208,6 @@ const CombinedDetection = () => {
         setStreamKey((prev) => prev + 1);
         await checkCurrentVideo();
         setProcessingStatus("⏳ Processing video frames...");
-        const estimatedFrames = Math.floor(
-          (selectedFile.size / 1024 / 1024) * 30
-        );
-        const progressInterval = simulateFrameProgress(estimatedFrames);
         const detectFormData = new FormData();
         detectFormData.append("video", selectedFile);
         const detectResponse = await fetch(
@@ -220,14 +217,14 @@ const CombinedDetection = () => {
             body: detectFormData,
           }
         );
-        clearInterval(progressInterval);
         if (!detectResponse.ok) {
           const errorData = await detectResponse.json().catch(() => null);
           throw new Error(
             errorData?.detail || `HTTP error! status: ${detectResponse.status}`
           );
         }
-        const detectData = await detectResponse.json();
+        const { status_url } = await detectResponse.json();
+        const detectData = await pollDetectionJob(status_url);
         const videoResult = { type: "video", ...detectData };
         setResult(videoResult);
         setProcessingStatus("✅ Analysis complete!");
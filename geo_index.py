@@ -0,0 +1,264 @@
+import itertools
+import math
+import threading
+import numpy as np
+
+# In-memory spatial index over each device's last location, for "who is near
+# this accident" queries. Devices are bucketed into latitude/longitude grids
+# of a few cell sizes; a query collects the buckets its search circle touches
+# on the finest grid where that's only a handful of cells, then computes
+# exact haversine distances for those candidates in one vectorized pass.
+# Updates move a device between buckets only when it crosses a cell edge, so
+# keeping the index current costs a few dict lookups per ping.
+#
+#   python geo_index.py --devices 100000 --queries 1000
+#
+# benchmarks it against the linear scan it replaces.
+
+EARTH_RADIUS = 6371000  # Meters
+CELL_DEGREES = (0.01, 0.1, 1.0)  # Grid cell sizes, finest first; 0.01 is about 1.1km of latitude
+MAX_QUERY_CELLS = 1024  # A query uses the finest grid where its circle touches at most this many cells
+INITIAL_CAPACITY = 1024
+
+def haversine(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+def haversine_many(lat1, lon1, lat2, lon2):
+    """
+    haversine over arrays of coordinates, in meters
+    """
+    R = EARTH_RADIUS
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+
+    a = np.sin(dphi/2)**2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda/2)**2
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+class Grid:
+    """
+    One grid level: cell -> set of slots
+    """
+    def __init__(self, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self.rows = int(math.ceil(180 / cell_degrees)) + 1
+        self.cols = int(round(360 / cell_degrees))
+        self.cells = {}  # (row, col) -> set of slots
+
+    def cell(self, lat, lon):
+        return int((lat + 90) // self.cell_degrees), int((lon + 180) // self.cell_degrees) % self.cols
+
+    def move(self, slot, old, new):
+        # Move slot from cell old (None for a new device) to cell new
+        if old is not None:
+            bucket = self.cells[old]
+            bucket.discard(slot)
+            if not bucket:
+                del self.cells[old]
+        self.cells.setdefault(new, set()).add(slot)
+
+    def span(self, lat, lon, angle):
+        """
+        Row and column ranges of the cells a circle of angle radians
+        around lat, lon touches; columns may run past the last and wrap
+        """
+        dlat = math.degrees(angle)
+        first_row = max(0, int((lat - dlat + 90) // self.cell_degrees))
+        last_row = min(self.rows - 1, int((lat + dlat + 90) // self.cell_degrees))
+
+        # Widest longitude spread of the circle; all of it at the poles
+        spread = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+        if lat + dlat >= 90 or lat - dlat <= -90 or spread >= 1:
+            cols = range(self.cols)
+        else:
+            dlon = math.degrees(math.asin(spread))
+            first_col = int((lon - dlon + 180) // self.cell_degrees)
+            last_col = int((lon + dlon + 180) // self.cell_degrees)
+            cols = range(first_col, min(last_col, first_col + self.cols - 1) + 1)
+        return range(first_row, last_row + 1), cols
+
+class GeoIndex:
+    """
+    Grid index of device_id -> (lat, lon). Thread-safe; results are
+    (device_id, lat, lon, meters) tuples, nearest first.
+    """
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self._grids = [Grid(size) for size in cell_degrees]
+        self._ids = []  # slot -> device_id
+        self._slots = {}  # device_id -> slot
+        self._coords = np.empty((INITIAL_CAPACITY, 2))  # slot -> lat, lon
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _update(self, device_id, lat, lon):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            slot = len(self._ids)
+            if slot == len(self._coords):
+                self._coords = np.concatenate([self._coords, np.empty_like(self._coords)])
+            self._ids.append(device_id)
+            self._slots[device_id] = slot
+            previous = None
+        else:
+            previous = self._coords[slot].tolist()
+        self._coords[slot] = lat, lon
+        for grid in self._grids:
+            new = grid.cell(lat, lon)
+            old = grid.cell(*previous) if previous else None
+            if old == new:
+                # Coarser cells contain finer ones
+                break
+            grid.move(slot, old, new)
+
+    def update(self, device_id, lat, lon):
+        with self._lock:
+            self._update(device_id, lat, lon)
+
+    def update_many(self, positions):
+        """
+        Add or move many devices, from (device_id, lat, lon) tuples
+        """
+        with self._lock:
+            for device_id, lat, lon in positions:
+                self._update(device_id, lat, lon)
+
+    def _candidates(self, lat, lon, radius):
+        # Slots in every cell a circle of radius meters around lat, lon can
+        # touch, on the finest grid where that's few cells
+        angle = radius / EARTH_RADIUS
+        if angle < math.pi:
+            for grid in self._grids:
+                rows, cols = grid.span(lat, lon, angle)
+                if len(rows) * len(cols) <= MAX_QUERY_CELLS:
+                    buckets = (grid.cells.get((row, col % grid.cols), ()) for row in rows for col in cols)
+                    return np.fromiter(itertools.chain.from_iterable(buckets), dtype=np.intp)
+        return np.arange(len(self._ids))
+
+    def _results(self, slots, distances, order):
+        chosen = slots[order]
+        ids = [self._ids[slot] for slot in chosen.tolist()]
+        return [(device_id, lat, lon, distance) for device_id, (lat, lon), distance
+                in zip(ids, self._coords[chosen].tolist(), distances[order].tolist())]
+
+    def within(self, lat, lon, radius, limit=None):
+        """
+        Devices within radius meters of lat, lon, at most limit of them
+        """
+        with self._lock:
+            slots = self._candidates(lat, lon, radius)
+            coords = self._coords[slots]
+            distances = haversine_many(lat, lon, coords[:, 0], coords[:, 1])
+            inside = np.flatnonzero(distances <= radius)
+            if limit is not None and len(inside) > limit:
+                inside = inside[np.argpartition(distances[inside], limit - 1)[:limit]]
+            order = inside[np.argsort(distances[inside], kind="stable")]
+            return self._results(slots, distances, order)
+
+    def nearest(self, lat, lon, k):
+        """
+        The k devices closest to lat, lon. Searches a circle that grows
+        until it holds k devices: everything outside it is farther than
+        everything inside, so the k closest in it are the k closest overall.
+        """
+        radius = math.radians(self._grids[0].cell_degrees) * EARTH_RADIUS
+        while True:
+            found = self.within(lat, lon, radius, limit=k)
+            if len(found) >= k or len(found) == len(self) or radius >= math.pi * EARTH_RADIUS:
+                return found
+            radius *= 4
+
+def _scan(positions, lat, lon, radius):
+    # The linear scan the index replaces: scalar haversine per device
+    found = []
+    for device_id, (device_lat, device_lon) in positions.items():
+        distance = haversine(lat, lon, device_lat, device_lon)
+        if distance <= radius:
+            found.append((distance, device_id))
+    return [device_id for _, device_id in sorted(found)]
+
+def _scan_many(ids, coords, lat, lon, radius):
+    # Linear scan, vectorized
+    distances = haversine_many(lat, lon, coords[:, 0], coords[:, 1])
+    inside = np.flatnonzero(distances <= radius)
+    return [ids[i] for i in inside[np.argsort(distances[inside], kind="stable")]]
+
+def benchmark(devices, queries, radius, k, seed=0):
+    """
+    Time radius and k-nearest queries on the index against a scalar and a
+    vectorized linear scan, over devices clustered around a few cities plus
+    a spread across the globe, and check they all agree
+    """
+    import time
+    rng = np.random.default_rng(seed)
+    centers = np.array([[27.70, 85.32], [28.21, 83.99], [40.71, -74.01], [51.51, -0.13], [-33.87, 151.21]])
+    clustered = devices * 9 // 10
+    coords = np.concatenate([
+        centers[rng.integers(len(centers), size=clustered)] + rng.normal(0, 0.1, (clustered, 2)),
+        np.column_stack([rng.uniform(-85, 85, devices - clustered), rng.uniform(-180, 180, devices - clustered)]),
+    ])
+    ids = [f"device-{i}" for i in range(devices)]
+    positions = dict(zip(ids, map(tuple, coords.tolist())))
+
+    start = time.perf_counter()
+    index = GeoIndex()
+    index.update_many((device_id, lat, lon) for device_id, (lat, lon) in positions.items())
+    build = time.perf_counter() - start
+
+    points = coords[rng.integers(devices, size=queries)] + rng.normal(0, 0.01, (queries, 2))
+    report = {"devices": devices, "queries": queries, "build_seconds": round(build, 3)}
+
+    start = time.perf_counter()
+    indexed = [[r[0] for r in index.within(lat, lon, radius)] for lat, lon in points]
+    report["radius_index_ms"] = 1000 * (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    vectorized = [_scan_many(ids, coords, lat, lon, radius) for lat, lon in points]
+    report["radius_vectorized_scan_ms"] = 1000 * (time.perf_counter() - start) / queries
+
+    scalar_queries = max(1, queries // 100)  # Too slow to run them all
+    start = time.perf_counter()
+    scalar = [_scan(positions, lat, lon, radius) for lat, lon in points[:scalar_queries]]
+    report["radius_scalar_scan_ms"] = 1000 * (time.perf_counter() - start) / scalar_queries
+    report["radius_mean_results"] = round(sum(map(len, indexed)) / queries, 1)
+    report["radius_agree"] = indexed == vectorized and indexed[:scalar_queries] == scalar
+
+    start = time.perf_counter()
+    nearest = [[r[0] for r in index.nearest(lat, lon, k)] for lat, lon in points]
+    report["nearest_index_ms"] = 1000 * (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    nearest_scan = []
+    for lat, lon in points:
+        distances = haversine_many(lat, lon, coords[:, 0], coords[:, 1])
+        closest = np.argpartition(distances, k - 1)[:k]
+        nearest_scan.append([ids[i] for i in closest[np.argsort(distances[closest], kind="stable")]])
+    report["nearest_vectorized_scan_ms"] = 1000 * (time.perf_counter() - start) / queries
+    report["nearest_agree"] = nearest == nearest_scan
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the device location index against a linear scan")
+    parser.add_argument("--devices", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--radius", type=float, default=1000, help="Radius query size in meters")
+    parser.add_argument("-k", type=int, default=10, help="Neighbours per k-nearest query")
+    args = parser.parse_args()
+
+    report = benchmark(args.devices, args.queries, args.radius, args.k)
+    print(f"{report['devices']} devices, index built in {report['build_seconds']}s")
+    print(f"radius {args.radius:.0f}m ({report['radius_mean_results']} results): "
+          f"index {report['radius_index_ms']:.3f}ms, vectorized scan {report['radius_vectorized_scan_ms']:.3f}ms, "
+          f"scalar scan {report['radius_scalar_scan_ms']:.3f}ms per query, agree: {report['radius_agree']}")
+    print(f"{args.k} nearest: index {report['nearest_index_ms']:.3f}ms, "
+          f"vectorized scan {report['nearest_vectorized_scan_ms']:.3f}ms per query, agree: {report['nearest_agree']}")
@@ -0,0 +1,168 @@
+import ast
+import json
+import os
+import threading
+import time
+
+# Append-only log of accepted device locations for app.py. Each ping is one
+# JSON line, [device_id, latitude, longitude, timestamp]. Requests only append
+# to an in-memory buffer; a writer thread group-commits whatever has piled up
+# with a single write every FLUSH_SECONDS and fsyncs at most every
+# FSYNC_SECONDS, so a crash loses at most that last second of pings.
+#
+# The log is never rewritten: it keeps every accepted ping. So that startup
+# doesn't have to read the whole history, replay() keeps a snapshot next to
+# it (<log>.snapshot) with every device's last record and the byte offset of
+# the log it covers, and only reads the log from that offset on.
+
+FLUSH_SECONDS = 0.05  # Longest a ping waits in the buffer before it's written
+FSYNC_SECONDS = 1.0  # Longest written pings wait before they're synced to disk
+MAX_BUFFERED = 200000  # Appends block while this many pings wait to be written
+SNAPSHOT_SUFFIX = ".snapshot"
+
+def encode(device_id, lat, lon, timestamp):
+    return json.dumps([device_id, lat, lon, timestamp], separators=(",", ":")) + "\n"
+
+class LocationLog:
+    """
+    Buffered writer for the location log. append is thread-safe and
+    returns once the pings are buffered; close writes and syncs the rest.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self.written = 0
+        self.syncs = 0
+        self._thread = threading.Thread(target=self._run, name="location-log", daemon=True)
+        self._thread.start()
+
+    def append(self, lines):
+        """
+        Queue already encoded lines (see encode) for writing
+        """
+        with self._cond:
+            while len(self._buffer) >= MAX_BUFFERED and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Location log is closed")
+            self._buffer.extend(lines)
+            self._cond.notify_all()
+
+    def _run(self):
+        last_sync = time.monotonic()
+        dirty = False
+        while True:
+            with self._cond:
+                if not self._buffer and not self._closed:
+                    self._cond.wait(max(0.0, last_sync + FSYNC_SECONDS - time.monotonic()) if dirty else None)
+                lines, self._buffer = self._buffer, []
+                closed = self._closed
+                self._cond.notify_all()
+
+            if lines:
+                self._file.write("".join(lines))
+                self._file.flush()
+                self.written += len(lines)
+                dirty = True
+            if dirty and (closed or time.monotonic() - last_sync >= FSYNC_SECONDS):
+                os.fsync(self._file.fileno())
+                self.syncs += 1
+                last_sync = time.monotonic()
+                dirty = False
+            if closed:
+                break
+            if lines:
+                # Let the next group gather instead of writing line by line
+                time.sleep(FLUSH_SECONDS)
+        self._file.close()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+def _read(path, last, offset=0):
+    """
+    Update last (device_id -> record) from the log's lines after byte
+    offset. Returns the lines read and the offset just past the last
+    complete line.
+    """
+    lines = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Still being written, or cut short by a crash
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an earlier crash
+                continue
+            last[record[0]] = record
+            lines += 1
+    return lines, offset
+
+def _load_snapshot(path, log_size):
+    # (records by device, log offset) from the snapshot, if it still fits the log
+    try:
+        with open(path + SNAPSHOT_SUFFIX, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {}, 0
+    if not isinstance(snapshot, dict) or not 0 <= snapshot.get("offset", -1) <= log_size:
+        return {}, 0  # The log was replaced or truncated since
+    return {record[0]: record for record in snapshot["records"]}, snapshot["offset"]
+
+def _save_snapshot(path, last, offset):
+    temp_path = path + SNAPSHOT_SUFFIX + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"offset": offset, "records": list(last.values())}, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path + SNAPSHOT_SUFFIX)
+
+def _write_all(path, records):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.writelines(encode(*record) for record in records)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def import_legacy(legacy_path, path):
+    """
+    Convert the old locations.txt (one Python dict repr per line) into a
+    new log at path
+    """
+    records = []
+    with open(legacy_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                data = ast.literal_eval(line.strip())
+                records.append((data["device_id"], data["latitude"], data["longitude"], data.get("timestamp")))
+            except (ValueError, SyntaxError, KeyError, TypeError):
+                continue
+    _write_all(path, records)
+    return len(records)
+
+def replay(path):
+    """
+    Rebuild {device_id: (lat, lon)} from the snapshot and the part of the
+    log at path written since, then bring the snapshot up to date. The log
+    itself is left as it is.
+    """
+    if not os.path.exists(path):
+        return {}
+    last, offset = _load_snapshot(path, os.path.getsize(path))
+    lines, offset = _read(path, last, offset)
+    if lines:
+        _save_snapshot(path, last, offset)
+        print(f"Replayed {lines} new lines of {path} onto the snapshot")
+    return {device_id: (lat, lon) for device_id, lat, lon, _ in last.values()}